@@ -0,0 +1,41 @@
+"""
+各基准测试脚本共用的计时工具，在 benchmarks 目录下的脚本中导入：
+
+  from _common import bench
+"""
+import time
+import tracemalloc
+
+#: 输出时描述文字的列宽
+WIDTH = 40
+
+
+def bench(desc, func, *args, **kwargs):
+  """
+  执行一次func并输出耗时
+
+  Returns:
+    (耗时，单位：秒，func的返回值)
+  """
+  start = time.perf_counter()
+  res = func(*args, **kwargs)
+  cost = time.perf_counter() - start
+  print(f'{desc:<{WIDTH}}{cost:>8.3f} s')
+  return cost, res
+
+
+def bench_memory(desc, func, *args, **kwargs):
+  """
+  执行一次func并输出耗时及内存峰值
+
+  Returns:
+    (耗时，单位：秒，func的返回值)
+  """
+  tracemalloc.start()
+  start = time.perf_counter()
+  res = func(*args, **kwargs)
+  cost = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f'{desc:<{WIDTH}}{cost:>8.3f} s{peak / 2 ** 20:>10.1f} MB')
+  return cost, res
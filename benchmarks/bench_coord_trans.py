@@ -0,0 +1,62 @@
+"""
+坐标系转换数组内核与逐行转换的耗时对比
+
+Usage:
+  python benchmarks/bench_coord_trans.py [rows]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from _common import bench
+from ricco.geometry.coord_trans import _coord_transform
+from ricco.geometry.coord_trans import _coord_transform_geometry
+from ricco.geometry.coord_trans import coord_trans_geom
+from ricco.geometry.coord_trans import coord_trans_x2y
+
+
+def _per_row(df, srs_from, srs_to):
+  """改造前的逐行转换方式"""
+  return df.apply(
+      lambda r: _coord_transform(r['lng'], r['lat'], srs_from, srs_to),
+      axis=1, result_type='expand'
+  )
+
+
+def _per_geom(df, srs_from, srs_to):
+  """改造前的逐顶点转换方式"""
+  return df['geometry'].apply(
+      lambda x: _coord_transform_geometry(x, srs_from, srs_to)
+  )
+
+
+def main(n=200_000):
+  rng = np.random.default_rng(0)
+  df = pd.DataFrame({
+    'lng': rng.uniform(73, 135, n),
+    'lat': rng.uniform(18, 53, n),
+  })
+  print(f'rows: {n}')
+  for srs_from, srs_to in (('gcj02', 'wgs84'), ('bd09', 'wgs84')):
+    print(f'--- {srs_from} -> {srs_to}')
+    t0, _ = bench('per-row', _per_row, df, srs_from, srs_to)
+    t1, _ = bench('coord_trans_x2y', coord_trans_x2y, df, srs_from, srs_to)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+    t2, _ = bench('coord_trans_x2y exact', coord_trans_x2y, df,
+                  srs_from, srs_to, 'lng', 'lat', True)
+    print(f'{"exact / single-step":<40}{t2 / t1:>8.1f} x')
+
+  polygons = shapely.buffer(
+      shapely.points(df['lng'][: n // 10], df['lat'][: n // 10]), 0.001)
+  df_geom = pd.DataFrame({'geometry': polygons})
+  print(f'--- polygons: {len(polygons)}, gcj02 -> wgs84')
+  t0, _ = bench('per-vertex', _per_geom, df_geom, 'gcj02', 'wgs84')
+  t1, _ = bench('coord_trans_geom', coord_trans_geom, df_geom, 'gcj02', 'wgs84',
+                'geometry', 'shapely')
+  print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+
+
+if __name__ == '__main__':
+  main(*[int(i) for i in sys.argv[1:]])
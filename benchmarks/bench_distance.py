@@ -0,0 +1,52 @@
+"""
+逐对计算距离与批量距离、OD矩阵接口的耗时对比
+
+Usage:
+  python benchmarks/bench_distance.py [rows]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from _common import bench
+from ricco.geometry.df import distance_pairs
+from ricco.geometry.df import od_distance
+from ricco.geometry.util import distance
+
+
+def _per_pair(df):
+  """改造前的逐对计算方式"""
+  return [
+    distance((r.lng, r.lat), (r.lng_2, r.lat_2), epsg_to=32651)
+    for r in df.itertuples()
+  ]
+
+
+def main(n=20_000):
+  rng = np.random.default_rng(0)
+  df = pd.DataFrame({
+    'lng': rng.uniform(121, 122, n),
+    'lat': rng.uniform(30.8, 31.8, n),
+    'lng_2': rng.uniform(121, 122, n),
+    'lat_2': rng.uniform(30.8, 31.8, n),
+  })
+  print(f'rows: {n}')
+  t0, _ = bench('distance per pair', _per_pair, df)
+  for method in ('haversine', 'geodesic', 'projection'):
+    t1, _ = bench(f'distance_pairs {method}', distance_pairs, df,
+                  method=method, epsg=32651)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+
+  df_o, df_d = df[['lng', 'lat']], df[['lng_2', 'lat_2']]
+  df_d.columns = ['lng', 'lat']
+  print(f'--- od {n} x {n}')
+  for method in ('haversine', 'projection'):
+    bench(f'od_distance {method} top_k=5', od_distance, df_o, df_d,
+          method=method, top_k=5, epsg=32651)
+    bench(f'od_distance {method} <=1km', od_distance, df_o, df_d,
+          method=method, max_distance=1000, epsg=32651)
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""
+geometry批量编解码与逐行编解码的耗时对比
+
+Usage:
+  python benchmarks/bench_geometry_codec.py [rows]
+"""
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from _common import bench
+from ricco.geometry.df import shapely2geojson
+from ricco.geometry.df import shapely2wkb
+from ricco.geometry.df import wkb2shapely
+from ricco.geometry.df import wkt2shapely
+from ricco.geometry.util import geojson_dumps
+from ricco.geometry.util import wkb_dumps
+from ricco.geometry.util import wkb_loads
+from ricco.geometry.util import wkt_loads
+
+
+def _per_row(df, func):
+  """改造前的逐行编解码方式"""
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    return df['geometry'].apply(func)
+
+
+def main(n=200_000):
+  rng = np.random.default_rng(0)
+  points = shapely.points(rng.uniform(120, 122, n), rng.uniform(30, 32, n))
+  polygons = shapely.buffer(points[: n // 10], 0.001)
+  for name, geoms in (('point', points), ('polygon', polygons)):
+    df_wkb = pd.DataFrame({'geometry': shapely.to_wkb(geoms, hex=True)})
+    df_wkt = pd.DataFrame({'geometry': shapely.to_wkt(geoms)})
+    print(f'--- {name}, rows: {len(geoms)}')
+    t0, _ = bench('wkb per-row', _per_row, df_wkb, wkb_loads)
+    t1, _ = bench('wkb2shapely', wkb2shapely, df_wkb)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+    t0, _ = bench('wkt per-row', _per_row, df_wkt, wkt_loads)
+    t1, _ = bench('wkt2shapely', wkt2shapely, df_wkt)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+    df_shapely = pd.DataFrame({'geometry': geoms})
+    t0, _ = bench('wkb_dumps per-row', _per_row, df_shapely, wkb_dumps)
+    t1, _ = bench('shapely2wkb', shapely2wkb, df_shapely)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+    t0, _ = bench('geojson_dumps per-row', _per_row, df_shapely, geojson_dumps)
+    t1, _ = bench('shapely2geojson', shapely2geojson, df_shapely)
+    print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+
+
+if __name__ == '__main__':
+  main(*[int(i) for i in sys.argv[1:]])
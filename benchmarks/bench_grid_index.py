@@ -0,0 +1,51 @@
+"""
+GridIndex 与 PolygonTagger 点位查询的耗时对比，面数据为互不重叠的街镇式划分
+
+Usage:
+  python benchmarks/bench_grid_index.py [rows] [polygons]
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from _common import bench
+from ricco.geometry.codec import dumps_array
+from ricco.geometry.tagger import GridIndex
+from ricco.geometry.tagger import PolygonTagger
+
+
+def make_streets(n, seed=0):
+  """用泰森多边形模拟互不重叠的街镇边界，边界加密以接近真实数据的顶点数"""
+  rng = np.random.default_rng(seed)
+  extent = shapely.box(121, 30.8, 122, 31.8)
+  seeds = shapely.multipoints(
+      np.column_stack([rng.uniform(121, 122, n), rng.uniform(30.8, 31.8, n)]))
+  polygons = shapely.get_parts(
+      shapely.voronoi_polygons(seeds, extend_to=extent))
+  polygons = shapely.segmentize(shapely.intersection(polygons, extent), 0.002)
+  return pd.DataFrame({
+    'street': [f'street_{i}' for i in range(len(polygons))],
+    'geometry': dumps_array(polygons, 'wkb'),
+  })
+
+
+def main(n=2_000_000, n_polygons=300):
+  polygon_df = make_streets(n_polygons)
+  rng = np.random.default_rng(1)
+  lng, lat = rng.uniform(121, 122, n), rng.uniform(30.8, 31.8, n)
+  print(f'rows: {n}, polygons: {len(polygon_df)}')
+  _, tagger = bench('build PolygonTagger', PolygonTagger, polygon_df)
+  _, grid = bench('build GridIndex', GridIndex, polygon_df)
+  print(f'{"grid shape / boundary ratio":<40}{grid.grid.shape} '
+        f'{grid.boundary_ratio:.1%}')
+  t0, expected = bench(
+      'PolygonTagger.first', lambda: tagger.first(shapely.points(lng, lat)))
+  t1, res = bench('GridIndex.lookup', grid.lookup, lng, lat)
+  assert (res == expected).all()
+  print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
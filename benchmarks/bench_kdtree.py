@@ -0,0 +1,41 @@
+"""
+PointIndex 分块并行查询在不同线程数下的耗时
+
+Usage:
+  python benchmarks/bench_kdtree.py [tree_rows] [query_rows] [max_workers]
+
+sklearn 的 KDTree 查询时释放GIL，各线程共用同一棵树，需在多核机器上运行才能体现并行效果
+"""
+import os
+import sys
+
+import numpy as np
+
+from _common import bench
+from ricco.util.kdtree import PointIndex
+
+
+def main(n_tree=2_000_000, n_query=500_000, max_workers=None):
+  max_workers = max_workers or os.cpu_count() or 1
+  rng = np.random.default_rng(0)
+  xy_tree = rng.uniform(0, 50_000, (n_tree, 2))
+  xy_query = rng.uniform(0, 50_000, (n_query, 2))
+  print(f'tree: {n_tree}, query: {n_query}, cpu: {os.cpu_count()}')
+  _, index = bench('build PointIndex', PointIndex, xy_tree)
+  print(f'leaf_size: {index.leaf_size}')
+
+  workers = sorted({1, *[2 ** i for i in range(1, 8) if 2 ** i < max_workers],
+                    max_workers})
+  for desc, kwargs in [('radius r=300', {'r': 300}),
+                       ('knn k=10', {'limit': 10})]:
+    base = None
+    for n_jobs in workers:
+      cost, res = bench(f'{desc}, n_jobs={n_jobs}', index.query,
+                        xy_query, n_jobs=n_jobs, **kwargs)
+      base = base or (cost, res)
+      assert all(np.array_equal(a, b) for a, b in zip(res, base[1]))
+      print(f'{"speedup":<40}{base[0] / cost:>8.1f} x')
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
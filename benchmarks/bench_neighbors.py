@@ -0,0 +1,53 @@
+"""
+get_neighbors 基于STRtree批量查询与逐对判断相邻的耗时对比
+
+Usage:
+  python benchmarks/bench_neighbors.py [n_side] [n_side_pairwise]
+
+在 n_side x n_side 的经纬度网格上计算邻接关系，逐对判断的方式复杂度为O(n²)，
+只在较小的网格上运行
+"""
+import sys
+
+import pandas as pd
+import shapely
+
+from _common import bench
+from ricco.geometry.df import get_neighbors
+from ricco.geometry.df import neighbor_edges
+
+
+def make_grid(n_side, step=0.002):
+  cells = [shapely.box(121 + i * step, 31 + j * step,
+                       121 + (i + 1) * step, 31 + (j + 1) * step)
+           for j in range(n_side) for i in range(n_side)]
+  return pd.DataFrame({'key': range(len(cells)), 'geometry': cells})
+
+
+def pairwise_neighbors(df, key_col):
+  """逐对调用touches的实现，作为对照"""
+  res = {}
+  for key, v in zip(df[key_col], df['geometry']):
+    neighbors = [k for k, g in zip(df[key_col], df['geometry']) if v.touches(g)]
+    if neighbors:
+      res[key] = neighbors
+  return res
+
+
+def main(n_side=175, n_side_pairwise=30):
+  df = make_grid(n_side_pairwise)
+  _, expected = bench(f'pairwise touches ({len(df)} cells)',
+                      pairwise_neighbors, df, 'key')
+  _, res = bench(f'STRtree ({len(df)} cells)', get_neighbors, df, 'key')
+  assert res == expected
+
+  df = make_grid(n_side)
+  bench(f'STRtree queen ({len(df)} cells)', get_neighbors, df, 'key')
+  bench(f'STRtree rook ({len(df)} cells)', get_neighbors, df, 'key',
+        contiguity='rook')
+  bench(f'edges + border_length ({len(df)} cells)', neighbor_edges, df, 'key',
+        border_length=True, epsg=32651)
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
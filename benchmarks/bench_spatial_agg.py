@@ -0,0 +1,35 @@
+"""
+spatial_agg 关联后 groupby 与流式统计的耗时及峰值内存对比
+
+Usage:
+  python benchmarks/bench_spatial_agg.py [rows] [polygons]
+"""
+import sys
+
+import numpy as np
+
+from _common import bench_memory
+from bench_tagger import make_points
+from bench_tagger import make_polygons
+from ricco.geometry.df import spatial_agg
+from ricco.geometry.tagger import PolygonTagger
+
+AGG = {'value': ['count', 'sum', 'mean', 'max']}
+
+
+def main(n=1_000_000, n_polygons=2_000):
+  polygon_df = make_polygons(n_polygons)
+  tagger = PolygonTagger(polygon_df, 'tag')
+  df = make_points(n)
+  df['value'] = np.random.default_rng(2).integers(0, 100, n)
+  print(f'rows: {n}, polygons: {n_polygons}')
+  _, expected = bench_memory('mark_tags_v2 + groupby', spatial_agg,
+                             df, tagger, 'tag', AGG)
+  _, res = bench_memory('streaming (chunk_size=100000)', spatial_agg,
+                        df, tagger, 'tag', AGG, chunk_size=100_000,
+                        warning=False)
+  assert np.allclose(res.iloc[:, 1:], expected.iloc[:, 1:])
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
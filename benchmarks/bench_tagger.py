@@ -0,0 +1,76 @@
+"""
+mark_tags_v2 使用面数据与预先构建的 PolygonTagger 的耗时对比
+
+Usage:
+  python benchmarks/bench_tagger.py [rows] [polygons] [batches]
+
+分块并行部分对比不同线程数下的吞吐量，需在多核机器上运行才能体现并行效果
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from _common import bench
+from ricco.geometry.codec import dumps_array
+from ricco.geometry.df import mark_tags_v2
+from ricco.geometry.tagger import PolygonTagger
+
+
+def make_polygons(n, seed=0):
+  """在上海附近生成n个不规则的面"""
+  rng = np.random.default_rng(seed)
+  centers = shapely.points(rng.uniform(121, 122, n), rng.uniform(30.8, 31.8, n))
+  polygons = shapely.buffer(centers, rng.uniform(0.005, 0.03, n), quad_segs=16)
+  return pd.DataFrame({
+    'tag': [f'polygon_{i}' for i in range(n)],
+    'geometry': dumps_array(polygons, 'wkb'),
+  })
+
+
+def make_points(n, seed=1):
+  rng = np.random.default_rng(seed)
+  return pd.DataFrame({
+    'lng': rng.uniform(121, 122, n),
+    'lat': rng.uniform(30.8, 31.8, n),
+  })
+
+
+def main(n=100_000, n_polygons=2_000, batches=5):
+  polygon_df = make_polygons(n_polygons)
+  print(f'rows: {n} x {batches} batches, polygons: {n_polygons}')
+
+  def run(polygons):
+    for i in range(batches):
+      mark_tags_v2(make_points(n, seed=i), polygons, 'tag', warning=False)
+
+  t0, _ = bench('polygon_df', run, polygon_df)
+  t1, tagger = bench('build PolygonTagger', PolygonTagger, polygon_df, 'tag')
+  t2, _ = bench('PolygonTagger', run, tagger)
+  print(f'{"speedup (incl. build)":<40}{t0 / (t1 + t2):>8.1f} x')
+
+  df = make_points(n * batches)
+  print(f'--- overlapping polygons, rows: {len(df)}')
+
+  def sjoin_dedup():
+    res = mark_tags_v2(df, polygon_df, 'tag', warning=False)
+    return res[~res.index.duplicated()]
+
+  t0, _ = bench('sjoin + dedup', sjoin_dedup)
+  t1, _ = bench('first_match', mark_tags_v2, df, tagger, 'tag',
+                first_match=True, warning=False)
+  print(f'{"speedup":<40}{t0 / t1:>8.1f} x')
+
+  print(f'--- chunked, rows: {len(df)}, cpus: {os.cpu_count()}')
+  for n_jobs in sorted({1, 2, 4, os.cpu_count() or 1}):
+    cost, _ = bench(
+        f'n_jobs={n_jobs}', mark_tags_v2, df, tagger, 'tag',
+        chunk_size=max(n // 2, 1), n_jobs=n_jobs, warning=False,
+    )
+    print(f'{"rows/s":<40}{len(df) / cost:>8.0f}')
+
+
+if __name__ == '__main__':
+  main(*map(int, sys.argv[1:]))
@@ -0,0 +1,54 @@
+"""
+面数据拓扑检查及修复的耗时
+
+Usage:
+  python benchmarks/bench_topology.py [n_side] [overlap_ratio] [n_jobs]
+
+在 n_side x n_side 的网格上构造地块，其中一部分地块向右扩展形成与相邻地块的重叠，
+另有少量小地块位于其他地块内部
+"""
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from _common import bench
+from ricco.geometry.topology import fix_topology
+from ricco.geometry.topology import is_topology_valid
+
+
+def make_parcels(n_side, overlap_ratio=0.01, seed=0):
+  rng = np.random.default_rng(seed)
+  x, y = np.meshgrid(np.arange(n_side, dtype=float),
+                     np.arange(n_side, dtype=float))
+  x, y = x.ravel(), y.ravel()
+  grow = np.where(rng.random(len(x)) < overlap_ratio, 0.3, 0)
+  geoms = shapely.box(x, y, x + 1 + grow, y + 1)
+  inner = np.flatnonzero(rng.random(len(x)) < overlap_ratio / 10)
+  inner = shapely.box(x[inner] + 0.4, y[inner] + 0.4,
+                      x[inner] + 0.6, y[inner] + 0.6)
+  return gpd.GeoDataFrame(geometry=np.r_[geoms, inner])
+
+
+def main(n_side=317, overlap_ratio=0.01, n_jobs=None):
+  n_jobs = n_jobs or os.cpu_count() or 1
+  df = make_parcels(n_side, overlap_ratio)
+  print(f'parcels: {len(df)}')
+  bench('is_topology_valid', is_topology_valid, df)
+  _, res = bench('is_topology_valid(report=True)', is_topology_valid, df,
+                 report=True)
+  print(f'overlaps: {len(res)}, area: {res["overlap_area"].sum():.1f}')
+  for kwargs in [{}, {'fill_intersects': True, 'keep_contains': True}]:
+    for jobs in sorted({1, n_jobs}):
+      _, fixed = bench(f'fix_topology {kwargs or ""} n_jobs={jobs}',
+                       fix_topology, df, n_jobs=jobs, **kwargs)
+  assert is_topology_valid(fixed)
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:]
+  main(int(args[0]) if args else 317,
+       float(args[1]) if len(args) > 1 else 0.01,
+       int(args[2]) if len(args) > 2 else None)
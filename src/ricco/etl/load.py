@@ -7,10 +7,10 @@ import pandas as pd
 from shapely.geometry.base import BaseGeometry
 
 from ..fs.oss import OssUtils
+from ..geometry.codec import dumps_array
 from ..geometry.df import auto2shapely
 from ..geometry.df import shapely2wkt
 from ..geometry.util import infer_geom_format
-from ..geometry.util import wkb_dumps
 from ..util.os import ensure_dirpath_exist
 from ..util.os import extension
 from ..util.os import split_path
@@ -62,7 +62,7 @@ def to_parquet(df: pd.DataFrame, filepath: str, index=False):
     c for c in df if isinstance(first_notnull_value(df[c]), BaseGeometry)
   ]
   for c in shapely_columns:
-    df[c] = df[c].apply(wkb_dumps)
+    df[c] = dumps_array(df[c], 'wkb')
   df.to_parquet(filepath, index=index)
 
 
@@ -2,8 +2,8 @@ import os
 import re
 import warnings
 
-from ..geometry.coord_trans import _gcj2bd
-from ..geometry.coord_trans import _gcj2wgs
+from ..geometry.coord_trans import SRS
+from ..geometry.coord_trans import coord_transform_array
 from ..util.decorator import check_null
 
 DEFAULT_RES = {
@@ -36,13 +36,18 @@ class MapKeys:
 
 
 def gcj2xx(lnglat, srs):
+  """
+  将高德（gcj02）坐标转为指定坐标系，返回(纬度, 经度)
+
+  Args:
+    lnglat: (经度, 纬度)，经度和纬度可以是数值、文本或数组
+    srs: 要转换为的坐标系，可选bd09,wgs84,gcj02
+  """
   assert srs in ('wgs84', 'bd09', 'gcj02'), '可选参数为bd09,wgs84,gcj02'
-  if srs == 'wgs84':
-    return _gcj2wgs(float(lnglat[1]), float(lnglat[0]))
-  elif srs == 'bd09':
-    return _gcj2bd(float(lnglat[1]), float(lnglat[0]))
-  else:
-    return float(lnglat[1]), float(lnglat[0])
+  lng, lat = coord_transform_array(lnglat[0], lnglat[1], SRS.gcj02, srs)
+  if lng.ndim == 0:
+    return float(lat), float(lng)
+  return lat, lng
 
 
 def error_baidu(js):
@@ -1,18 +1,22 @@
 """地理/geometry相关"""
 
+from .cache import geometry_cache
 from .coord_trans import coord_trans_geom
 from .coord_trans import coord_trans_x2y
 from .coord_trans import coord_transformer
 from .df import auto2shapely
 from .df import buffer
+from .df import distance_pairs
 from .df import geojson2shapely
 from .df import get_area
 from .df import lnglat2shapely
 from .df import lnglat2wkb
 from .df import lnglat2wkt
+from .df import mark_tags_file
 from .df import mark_tags_v2
 from .df import nearest_kdtree
 from .df import nearest_neighbor
+from .df import od_distance
 from .df import projection
 from .df import shapely2geojson
 from .df import shapely2lnglat
@@ -26,6 +30,8 @@ from .df import wkb2wkt
 from .df import wkt2lnglat
 from .df import wkt2shapely
 from .df import wkt2wkb
+from .tagger import GridIndex
+from .tagger import PolygonTagger
 from .util import _projection_lnglat
 from .util import distance
 from .util import epsg_from_lnglat
@@ -0,0 +1,179 @@
+"""
+分组统计的流式累加器
+
+点数据量很大时，先给每个点关联标签再 groupby 需要构建与点数据等长的中间结果。
+GroupAccumulator 按块接收每条数据所属的分组编号及被统计的字段，只保留每个分组的
+计数、求和、最值等中间量，去重计数使用 HyperLogLog 近似估计，
+最终结果与 groupby(...).agg(agg) 一致。
+
+Examples:
+  >>> acc = GroupAccumulator(3, {'poi': ['sum', 'mean']})
+  >>> acc.update([0, 0, 2], pd.DataFrame({'poi': [1, 2, 5]}))
+  >>> acc.size.tolist()
+  [2, 0, 1]
+"""
+import numpy as np
+import pandas as pd
+
+from ..base import agg_parser
+
+AGG_FUNCS = ('count', 'sum', 'mean', 'min', 'max', 'nunique_approx')
+_NUMERIC_FUNCS = ('sum', 'mean', 'min', 'max')
+
+
+def hll_registers(values, codes, precision: int = 12):
+  """
+  计算HyperLogLog的寄存器编号及取值，空值不参与计算
+
+  Args:
+    values: 要去重计数的值
+    codes: 每个值所属的分组编号
+    precision: 寄存器个数为 2**precision，估计的相对误差约为 1.04/sqrt(2**precision)
+
+  Returns:
+    寄存器的全局编号（分组编号 * 2**precision + 组内编号）及对应的取值
+  """
+  values = pd.Series(values)
+  valid = values.notna().to_numpy()
+  values, codes = values[valid], np.asarray(codes)[valid]
+  if pd.api.types.is_numeric_dtype(values):
+    # 统一为浮点数，避免分块读取时同一列的整数和浮点数哈希值不同
+    values = values.astype(float)
+  hashes = pd.util.hash_array(values.to_numpy())
+  bits = 64 - precision
+  reg = (hashes >> np.uint64(bits)).astype(np.int64)
+  rest = hashes & np.uint64((1 << bits) - 1)
+  # 剩余位中第一个1出现的位置，剩余位全为0时取 bits + 1
+  bit_length = np.zeros(len(rest), dtype=np.int64)
+  nonzero = rest > 0
+  bit_length[nonzero] = np.floor(
+      np.log2(rest[nonzero].astype(float))
+  ).astype(np.int64) + 1
+  ranks = (bits - bit_length + 1).astype(np.uint8)
+  return codes.astype(np.int64) * (1 << precision) + reg, ranks
+
+
+def hll_merge(keys, ranks):
+  """合并寄存器，同一寄存器取最大值，结果按寄存器编号排序"""
+  if not len(keys):
+    return keys, ranks
+  order = np.argsort(keys, kind='stable')
+  keys, ranks = keys[order], ranks[order]
+  start = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+  return keys[start], np.maximum.reduceat(ranks, start)
+
+
+def hll_estimate(keys, ranks, n_groups: int, precision: int = 12):
+  """根据稀疏存储的寄存器估计每个分组的去重个数"""
+  m = 1 << precision
+  groups = keys // m
+  filled = np.bincount(groups, minlength=n_groups)
+  zeros = m - filled
+  total = np.bincount(
+      groups, weights=np.exp2(-ranks.astype(float)), minlength=n_groups
+  ) + zeros
+  alpha = 0.7213 / (1 + 1.079 / m)
+  est = alpha * m * m / total
+  # 小基数修正
+  small = (est <= 2.5 * m) & (zeros > 0)
+  est[small] = m * np.log(m / zeros[small])
+  return np.round(est).astype(np.int64)
+
+
+class GroupAccumulator:
+  """
+  按分组累计统计量，支持 count、sum、mean、min、max 及近似去重计数 nunique_approx
+
+  Args:
+    n_groups: 分组个数，分组编号为 0 ~ n_groups-1
+    agg: 统计操作，格式与 groupby(...).agg 的字典参数一致，如 {'poi': ['sum', 'mean']}
+    precision: nunique_approx 使用的HyperLogLog精度，默认12，相对误差约1.6%
+  """
+
+  def __init__(self, n_groups: int, agg: dict, precision: int = 12):
+    assert isinstance(agg, dict) and agg, 'agg必须为非空的字典'
+    self.n_groups = n_groups
+    self.agg = agg
+    self.precision = precision
+    self.funcs = agg_parser(agg)
+    for _, func, _ in self.funcs:
+      assert func in AGG_FUNCS, f'不支持的统计操作：{func}，可选：{AGG_FUNCS}'
+    self.size = np.zeros(n_groups, dtype=np.int64)
+    self._state = {}
+    for c, func, _ in self.funcs:
+      state = self._state.setdefault(c, {'is_int': True})
+      state.setdefault('count', np.zeros(n_groups, dtype=np.int64))
+      if func in ('sum', 'mean'):
+        state.setdefault('sum', np.zeros(n_groups))
+      elif func in ('min', 'max'):
+        fill = np.inf if func == 'min' else -np.inf
+        state.setdefault(func, np.full(n_groups, fill))
+      elif func == 'nunique_approx':
+        state.setdefault('hll', (np.zeros(0, np.int64), np.zeros(0, np.uint8)))
+
+  def update(self, codes, df: pd.DataFrame):
+    """
+    累计一块数据
+
+    Args:
+      codes: 每条数据所属的分组编号，小于0时不参与统计
+      df: 与codes一一对应的数据，需包含被统计的字段
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    valid = codes >= 0
+    codes = codes[valid]
+    self.size += np.bincount(codes, minlength=self.n_groups)
+    for c, state in self._state.items():
+      values = df[c][valid]
+      notna = values.notna().to_numpy()
+      state['count'] += np.bincount(codes[notna], minlength=self.n_groups)
+      if 'hll' in state:
+        keys, ranks = hll_registers(values, codes, self.precision)
+        state['hll'] = hll_merge(
+            np.concatenate([state['hll'][0], keys]),
+            np.concatenate([state['hll'][1], ranks]),
+        )
+      if not any(k in state for k in _NUMERIC_FUNCS):
+        continue
+      assert pd.api.types.is_numeric_dtype(values), f'“{c}”列不是数值类型'
+      if not pd.api.types.is_integer_dtype(values):
+        state['is_int'] &= pd.api.types.is_bool_dtype(values)
+      x, g = values.to_numpy(dtype=float)[notna], codes[notna]
+      if 'sum' in state:
+        state['sum'] += np.bincount(g, weights=x, minlength=self.n_groups)
+      if 'min' in state:
+        np.minimum.at(state['min'], g, x)
+      if 'max' in state:
+        np.maximum.at(state['max'], g, x)
+
+  def result(self, groups=None) -> dict:
+    """
+    计算统计结果
+
+    Args:
+      groups: 要输出的分组编号，默认全部分组
+
+    Returns:
+      {(字段名, 统计操作): 结果数组} 形式的字典
+    """
+    groups = np.arange(self.n_groups) if groups is None else groups
+    res = {}
+    for c, func, _ in self.funcs:
+      state = self._state[c]
+      count = state['count'][groups]
+      if func == 'count':
+        values = count
+      elif func == 'nunique_approx':
+        values = hll_estimate(*state['hll'], self.n_groups, self.precision)
+        values = values[groups]
+      elif func == 'mean':
+        with np.errstate(invalid='ignore', divide='ignore'):
+          values = state['sum'][groups] / count
+      else:
+        values = state[func][groups].copy()
+        if func != 'sum':
+          values[count == 0] = np.nan
+        if state['is_int'] and (func == 'sum' or (count > 0).all()):
+          values = values.astype(np.int64)
+      res[(c, func)] = values
+    return res
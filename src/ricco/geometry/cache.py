@@ -0,0 +1,155 @@
+"""
+geometry解析及投影结果缓存
+
+同一个数据集在流水线中多次调用 mark_tags_v2、nearest_kdtree、buffer、get_area 等方法时，
+每次都会重新解析geometry列并重新投影。开启缓存后，解析后的shapely数组（以及面内点数组）
+会按列的内容哈希缓存下来，projection 投影后的坐标按 (数据集指纹, 目标坐标系) 缓存，
+project_lnglat 投影后的坐标按 (经纬度数组指纹, 原坐标系, 目标坐标系) 缓存，
+后续调用直接复用。缓存默认关闭，需显式开启：
+
+Examples:
+  >>> with geometry_cache(maxsize=8) as cache:  # doctest: +SKIP
+  ...   df = mark_tags_v2(df, polygon_df, '板块')
+  ...   df = get_area(df)
+  ...   print(cache.stats())
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import shapely
+
+_active_cache = None
+
+
+class GeometryCache:
+  """
+  geometry解析结果的LRU缓存，按 (列名, 行数, 内容哈希) 区分数据集
+
+  Args:
+    maxsize: 最多缓存的数据集个数
+    max_rows: 全部缓存数组的总行数上限，默认不限制
+  """
+
+  def __init__(self, maxsize: int = 16, max_rows: int = None):
+    assert maxsize > 0, 'maxsize必须大于0'
+    self.maxsize = maxsize
+    self.max_rows = max_rows
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = {}
+    self.misses = {}
+
+  @staticmethod
+  def fingerprint(series: pd.Series) -> tuple:
+    """计算列的标识：列名、行数及包含索引的内容哈希"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(series, index=True).values.tobytes())
+    return series.name, len(series), h.hexdigest()
+
+  @staticmethod
+  def fingerprint_geoms(geoms, coords=None) -> tuple:
+    """
+    计算shapely数组的标识：行数及几何类型、坐标个数、全部坐标的哈希
+
+    Args:
+      geoms: shapely数组
+      coords: 已提取的坐标，即 shapely.get_coordinates(geoms)，避免重复提取
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if coords is None:
+      coords = shapely.get_coordinates(geoms)
+    h = hashlib.blake2b(digest_size=16)
+    for arr in (
+        shapely.get_type_id(geoms),
+        shapely.get_num_coordinates(geoms),
+        coords,
+    ):
+      h.update(np.ascontiguousarray(arr).tobytes())
+    return len(geoms), h.hexdigest()
+
+  @staticmethod
+  def fingerprint_arrays(*arrays) -> tuple:
+    """计算等长数值数组（如经度、纬度）的标识：长度及全部取值的哈希"""
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+      h.update(np.ascontiguousarray(arr, dtype=float).tobytes())
+    return len(arrays[0]), h.hexdigest()
+
+  @property
+  def rows(self) -> int:
+    """当前缓存的总行数"""
+    return sum(len(v) for item in self._data.values() for v in item.values())
+
+  def get(self, key: tuple, kind: str = 'geometry'):
+    """获取缓存的数组，返回副本，未命中时返回None"""
+    with self._lock:
+      item = self._data.get(key)
+      if item is None or kind not in item:
+        self.misses[kind] = self.misses.get(kind, 0) + 1
+        return
+      self._data.move_to_end(key)
+      self.hits[kind] = self.hits.get(kind, 0) + 1
+      return item[kind].copy()
+
+  def put(self, key: tuple, kind: str, values):
+    """写入缓存，超出数量或行数上限时淘汰最久未使用的数据集"""
+    values = np.array(values)
+    with self._lock:
+      self._data.setdefault(key, {})[kind] = values
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize or (
+          self.max_rows and self.rows > self.max_rows and len(self._data) > 1
+      ):
+        self._data.popitem(last=False)
+
+  def clear(self):
+    """清空缓存及命中统计"""
+    with self._lock:
+      self._data.clear()
+      self.hits.clear()
+      self.misses.clear()
+
+  def stats(self) -> dict:
+    """缓存的命中统计信息"""
+    return {
+      'hits': dict(self.hits),
+      'misses': dict(self.misses),
+      'entries': len(self._data),
+      'rows': self.rows,
+    }
+
+  def __len__(self):
+    return len(self._data)
+
+  def __contains__(self, key):
+    return key in self._data
+
+
+def get_geometry_cache() -> (GeometryCache, None):
+  """获取当前生效的缓存，未开启时返回None"""
+  return _active_cache
+
+
+@contextmanager
+def geometry_cache(maxsize: int = 16,
+                   max_rows: int = None,
+                   cache: GeometryCache = None):
+  """
+  在上下文中开启geometry解析缓存，退出时恢复之前的状态
+
+  Args:
+    maxsize: 最多缓存的数据集个数
+    max_rows: 全部缓存数组的总行数上限，默认不限制
+    cache: 使用已有的缓存对象，指定时忽略maxsize和max_rows
+  """
+  global _active_cache
+  previous = _active_cache
+  _active_cache = cache or GeometryCache(maxsize=maxsize, max_rows=max_rows)
+  try:
+    yield _active_cache
+  finally:
+    _active_cache = previous
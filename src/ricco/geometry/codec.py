@@ -0,0 +1,285 @@
+"""
+geometry格式的批量编解码
+
+基于shapely2的数组函数（from_wkb/to_wkb等）对整列进行转换，
+转换失败的行以掩码的形式返回，不再逐行警告，空值和空的geometry均通过掩码处理；
+非文本或批量转换出错的元素（如dict格式的geojson）回退到逐行转换。
+"""
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .util import EMPTY_GEOM_STRINGS
+from .util import geojson_loads
+from .util import wkb_loads
+from .util import wkt_loads
+
+_ROW_LOADERS = {
+  'wkb': wkb_loads,
+  'wkt': wkt_loads,
+  'geojson': geojson_loads,
+}
+_WKT_PATTERN = re.compile(
+    r'^\s*((MULTI)?(POINT|LINESTRING|POLYGON)|GEOMETRYCOLLECTION|LINEARRING)',
+    flags=re.I
+)
+_DUMP_FORMATS = ('wkb', 'wkt', 'geojson')
+
+
+def _as_object_array(values) -> np.ndarray:
+  """转为object类型的一维数组，空值统一为None"""
+  values = np.asarray(values, dtype=object).ravel()
+  values = values.copy()
+  values[pd.isna(values)] = None
+  return values
+
+
+def _is_text(values: np.ndarray) -> np.ndarray:
+  """判断数组中的元素是否为str或bytes"""
+  return np.fromiter(
+      (isinstance(v, (str, bytes)) for v in values),
+      dtype=bool, count=len(values)
+  )
+
+
+def _loads_per_row(values: np.ndarray, geom_format: str) -> np.ndarray:
+  """逐行转换，屏蔽逐行的警告信息"""
+  loader = _ROW_LOADERS[geom_format]
+  res = np.empty(len(values), dtype=object)
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    for i, v in enumerate(values):
+      res[i] = None if v is None else loader(v)
+  return res
+
+
+def _loads_batch(values: np.ndarray, geom_format: str) -> np.ndarray:
+  """调用shapely2的数组函数进行批量转换"""
+  if geom_format == 'wkb':
+    return shapely.from_wkb(values, on_invalid='ignore')
+  if geom_format == 'wkt':
+    return shapely.from_wkt(values, on_invalid='ignore')
+  if geom_format == 'geojson':
+    return shapely.from_geojson(values, on_invalid='ignore')
+  raise ValueError(f'不支持的地理格式:"{geom_format}"')
+
+
+def _loads_vectorized(values: np.ndarray, geom_format: str) -> np.ndarray:
+  """批量转换，无法批量处理的元素回退到逐行转换"""
+  text = pd.notna(values)
+  # geojson中的FeatureCollection需要合并要素，与逐行转换的结果保持一致
+  if geom_format == 'geojson':
+    text &= ~pd.Series(values).str.contains(
+        'FeatureCollection', regex=False, na=True).values
+  res = np.empty(len(values), dtype=object)
+  try:
+    res[text] = _loads_batch(values[text], geom_format)
+  except TypeError:
+    # 存在非文本的元素，仅批量转换文本
+    text &= _is_text(values)
+    res[text] = _loads_batch(values[text], geom_format)
+  # 非文本或批量转换失败的元素逐行转换，如dict格式的geojson、单引号的geojson
+  fallback = pd.isna(res) & pd.notna(values)
+  if geom_format != 'geojson':
+    fallback &= ~text
+  if fallback.any():
+    res[fallback] = _loads_per_row(values[fallback], geom_format)
+  return res
+
+
+def loads_array(values,
+                geom_format: str,
+                *,
+                empty2null: bool = True) -> (np.ndarray, np.ndarray):
+  """
+  将wkb/wkt/geojson格式的数组批量转换为shapely数组
+
+  Args:
+    values: 要转换的数组或Series
+    geom_format: 输入的地理格式，支持wkb,wkt,geojson
+    empty2null: 是否将空的geometry置为None
+
+  Returns:
+    (shapely数组, 转换失败的掩码)，空值不计为转换失败
+  """
+  assert geom_format in _ROW_LOADERS, f'不支持的地理格式:"{geom_format}"'
+  values = _as_object_array(values)
+  geoms = _loads_vectorized(values, geom_format)
+  failed = pd.isna(geoms) & pd.notna(values)
+  if empty2null:
+    geoms[is_empty_array(geoms)] = None
+  return geoms, failed
+
+
+def is_empty_array(values) -> np.ndarray:
+  """
+  批量判断是否为空，空值、空的shapely对象、文本形式的空geometry均视为空
+
+  Args:
+    values: shapely或文本形式的geometry数组
+  """
+  values = _as_object_array(values)
+  empty = pd.isna(values)
+  if not (notnull := ~empty).any():
+    return empty
+  _values = values[notnull]
+  is_geom = shapely.is_geometry(_values)
+  _empty = np.zeros(len(_values), dtype=bool)
+  _empty[is_geom] = shapely.is_empty(_values[is_geom])
+  _empty[~is_geom] = pd.Series(_values[~is_geom]).isin(EMPTY_GEOM_STRINGS)
+  empty[notnull] = _empty
+  return empty
+
+
+def _round_coords(geoms: np.ndarray, precision: int) -> np.ndarray:
+  """对全部坐标保留指定的小数位数"""
+  return shapely.transform(geoms, lambda c: np.round(c, precision))
+
+
+def _dumps_batch(geoms: np.ndarray, geom_format: str, hex: bool,
+                 precision: int):
+  """调用shapely2的数组函数进行批量转换"""
+  if geom_format == 'wkt':
+    return shapely.to_wkt(
+        geoms, rounding_precision=6 if precision is None else precision)
+  if precision is not None:
+    geoms = _round_coords(geoms, precision)
+  if geom_format == 'wkb':
+    return shapely.to_wkb(geoms, hex=hex)
+  if geom_format == 'geojson':
+    return shapely.to_geojson(geoms)
+  raise ValueError(f'不支持的地理格式:"{geom_format}"')
+
+
+def dumps_array(geoms,
+                geom_format: str,
+                *,
+                hex: bool = True,
+                precision: int = None) -> np.ndarray:
+  """
+  将shapely数组批量转换为wkb/wkt/geojson格式，空值和空的geometry均输出为None
+
+  Args:
+    geoms: shapely数组或Series
+    geom_format: 输出的地理格式，支持wkb,wkt,geojson
+    hex: 输出wkb时是否为16进制文本，为False时输出bytes
+    precision: 坐标保留的小数位数，默认不处理，wkt默认保留6位
+  """
+  assert geom_format in _DUMP_FORMATS, f'不支持的地理格式:"{geom_format}"'
+  geoms = _as_object_array(geoms)
+  res = np.full(len(geoms), None, dtype=object)
+  valid = ~is_empty_array(geoms)
+  if not valid.any():
+    return res
+  res[valid] = _dumps_batch(geoms[valid], geom_format, hex, precision)
+  return res
+
+
+def _wkb_header_valid(header: str) -> bool:
+  """根据wkb的字节序和几何类型判断是否为有效的wkb头部"""
+  if len(header) < 10 or header[:2] not in ('00', '01'):
+    return False
+  byteorder = 'little' if header[:2] == '01' else 'big'
+  code = int.from_bytes(bytes.fromhex(header[2:10]), byteorder)
+  # 去除EWKB的Z/M/SRID标记位
+  code &= 0x0FFFFFFF
+  return 1 <= code % 1000 <= 7 and code // 1000 <= 3
+
+
+def classify_geom_formats(values) -> np.ndarray:
+  """
+  通过前缀和字节特征逐个判断geometry格式，不进行实际的解析
+
+  规则：
+    - shapely: shapely对象
+    - wkb: bytes，或16进制文本且头部为有效的字节序和几何类型
+    - wkt: 以几何类型关键字开头
+    - geojson: dict，或以“{”开头的文本
+
+  Args:
+    values: 要判断的数组或Series
+
+  Returns:
+    格式数组，取值为shapely,wkb,wkt,geojson,unknown，空值为None
+  """
+  values = _as_object_array(values)
+  res = np.full(len(values), None, dtype=object)
+  notnull = pd.notna(values)
+  if not notnull.any():
+    return res
+  _values = pd.Series(values[notnull])
+  _res = np.full(len(_values), 'unknown', dtype=object)
+  _res[shapely.is_geometry(_values.values)] = 'shapely'
+  _types = _values.map(type)
+  _res[(_types == bytes).values] = 'wkb'
+  _res[(_types == dict).values] = 'geojson'
+
+  is_str = (_types == str).values
+  if is_str.any():
+    text = _values[is_str].str.strip()
+    _fmt = np.full(len(text), 'unknown', dtype=object)
+    is_hex = (text.str.len() % 2 == 0) & text.str.fullmatch('[0-9A-Fa-f]+')
+    if is_hex.any():
+      headers = text[is_hex].str[:10]
+      valid = headers.map(
+          {h: _wkb_header_valid(h) for h in headers.unique()})
+      _fmt[is_hex.values.nonzero()[0][valid.values.astype(bool)]] = 'wkb'
+    unknown = _fmt == 'unknown'
+    _fmt[unknown & text.str.match(_WKT_PATTERN).values] = 'wkt'
+    unknown = _fmt == 'unknown'
+    _fmt[unknown & text.str.startswith('{').values] = 'geojson'
+    _res[is_str] = _fmt
+  res[notnull] = _res
+  return res
+
+
+def geom_format_mix(series, sample: int = 1000, random_state=0) -> dict:
+  """
+  抽样判断一列geometry的格式构成
+
+  Args:
+    series: 要判断的数组或Series
+    sample: 抽样的非空值个数，为None时判断全部非空值
+    random_state: 抽样的随机种子
+
+  Returns:
+    各格式的占比，按占比降序排列，如：{'wkb': 0.9, 'wkt': 0.1}，全为空时返回{}
+  """
+  values = _as_object_array(series)
+  values = values[pd.notna(values)]
+  if sample and len(values) > sample:
+    rng = np.random.default_rng(random_state)
+    values = values[rng.choice(len(values), size=sample, replace=False)]
+  if len(values) == 0:
+    return {}
+  ratio = pd.Series(classify_geom_formats(values)).value_counts(normalize=True)
+  return ratio.to_dict()
+
+
+def loads_mixed(values, formats=None) -> (np.ndarray, np.ndarray):
+  """
+  将格式混合的数组按格式分组后批量转换为shapely数组
+
+  Args:
+    values: 要转换的数组或Series
+    formats: 每个元素的格式，默认通过classify_geom_formats判断
+
+  Returns:
+    (shapely数组, 转换失败的掩码)，无法识别格式的元素计为转换失败
+  """
+  values = _as_object_array(values)
+  if formats is None:
+    formats = classify_geom_formats(values)
+  geoms = np.full(len(values), None, dtype=object)
+  failed = pd.notna(values)
+  for fmt in pd.unique(formats[pd.notna(formats)]):
+    mask = formats == fmt
+    if fmt == 'shapely':
+      geoms[mask], failed[mask] = values[mask], False
+    elif fmt in _ROW_LOADERS:
+      geoms[mask], failed[mask] = loads_array(values[mask], fmt)
+  geoms[is_empty_array(geoms)] = None
+  return geoms, failed
@@ -1,15 +1,19 @@
 import math
+import warnings
 
 import geojson.utils
+import geopandas as gpd
+import numpy as np
+import shapely
+from geopandas.array import GeometryArray
 from shapely.geometry.base import BaseGeometry
 from shapely.geometry.base import BaseMultipartGeometry
 from shapely.ops import transform as sh_transform
-from tqdm import tqdm
 
 from ..base import is_empty
 from ..util.decorator import check_null
-from .df import ensure_geometry
-from .df import shapely2x
+from .codec import dumps_array
+from .df import auto2shapely
 from .util import infer_geom_format
 
 earthR = 6378245.0
@@ -131,6 +135,210 @@ _fn_mapping = {
 }
 
 
+def out_of_china_array(lat, lng) -> np.ndarray:
+  """out_of_china的数组版本，空值视为国外"""
+  return ~((72.004 <= lng) & (lng <= 137.8347) &
+           (0.8293 <= lat) & (lat <= 55.8271))
+
+
+def _transform_array(x, y):
+  xy = x * y
+  abs_x = np.sqrt(np.abs(x))
+  xpi = x * math.pi
+  ypi = y * math.pi
+  d = 20.0 * np.sin(6.0 * xpi) + 20.0 * np.sin(2.0 * xpi)
+
+  lat = d + 20.0 * np.sin(ypi) + 40.0 * np.sin(ypi / 3.0)
+  lng = d + 20.0 * np.sin(xpi) + 40.0 * np.sin(xpi / 3.0)
+
+  lat += 160.0 * np.sin(ypi / 12.0) + 320 * np.sin(ypi / 30.0)
+  lng += 150.0 * np.sin(xpi / 12.0) + 300.0 * np.sin(xpi / 30.0)
+
+  lat *= 2.0 / 3.0
+  lng *= 2.0 / 3.0
+
+  lat += -100.0 + 2.0 * x + 3.0 * y + 0.2 * y * y + 0.1 * xy + 0.2 * abs_x
+  lng += 300.0 + x + 2.0 * y + 0.1 * x * x + 0.1 * xy + 0.1 * abs_x
+
+  return lat, lng
+
+
+def _delta_array(lat, lng):
+  ee = 0.00669342162296594323
+  d_lat, d_lng = _transform_array(lng - 105.0, lat - 35.0)
+  rad_lat = lat / 180.0 * math.pi
+  magic = np.sin(rad_lat)
+  magic = 1 - ee * magic * magic
+  sqrt_magic = np.sqrt(magic)
+  d_lat = (d_lat * 180.0) / (
+      (earthR * (1 - ee)) / (magic * sqrt_magic) * math.pi)
+  d_lng = (d_lng * 180.0) / (earthR / sqrt_magic * np.cos(rad_lat) * math.pi)
+  return d_lat, d_lng
+
+
+def _wgs2gcj_core(wgs_lat, wgs_lng):
+  """不判断是否在国外的wgs84转gcj02"""
+  dlat, dlng = _delta_array(wgs_lat, wgs_lng)
+  return wgs_lat + dlat, wgs_lng + dlng
+
+
+def _gcj2bd_core(gcj_lat, gcj_lng):
+  """不判断是否在国外的gcj02转bd09"""
+  x = gcj_lng
+  y = gcj_lat
+  z = np.hypot(x, y) + 0.00002 * np.sin(y * x_pi)
+  theta = np.arctan2(y, x) + 0.000003 * np.cos(x * x_pi)
+  return z * np.sin(theta) + 0.006, z * np.cos(theta) + 0.0065
+
+
+def _wgs2gcj_array(wgs_lat, wgs_lng):
+  mask = out_of_china_array(wgs_lat, wgs_lng)
+  gcj_lat, gcj_lng = _wgs2gcj_core(wgs_lat, wgs_lng)
+  return np.where(mask, wgs_lat, gcj_lat), np.where(mask, wgs_lng, gcj_lng)
+
+
+def _gcj2wgs_array(gcj_lat, gcj_lng):
+  mask = out_of_china_array(gcj_lat, gcj_lng)
+  dlat, dlng = _delta_array(gcj_lat, gcj_lng)
+  return (np.where(mask, gcj_lat, gcj_lat - dlat),
+          np.where(mask, gcj_lng, gcj_lng - dlng))
+
+
+def _gcj2bd_array(gcj_lat, gcj_lng):
+  mask = out_of_china_array(gcj_lat, gcj_lng)
+  bd_lat, bd_lng = _gcj2bd_core(gcj_lat, gcj_lng)
+  return np.where(mask, gcj_lat, bd_lat), np.where(mask, gcj_lng, bd_lng)
+
+
+def _bd2gcj_array(bd_lat, bd_lng):
+  mask = out_of_china_array(bd_lat, bd_lng)
+  x = bd_lng - 0.0065
+  y = bd_lat - 0.006
+  z = np.hypot(x, y) - 0.00002 * np.sin(y * x_pi)
+  theta = np.arctan2(y, x) - 0.000003 * np.cos(x * x_pi)
+  gcj_lng = z * np.cos(theta)
+  gcj_lat = z * np.sin(theta)
+  return np.where(mask, bd_lat, gcj_lat), np.where(mask, bd_lng, gcj_lng)
+
+
+def _wgs2bd_array(wgs_lat, wgs_lng):
+  return _gcj2bd_array(*_wgs2gcj_array(wgs_lat, wgs_lng))
+
+
+def _bd2wgs_array(bd_lat, bd_lng):
+  return _gcj2wgs_array(*_bd2gcj_array(bd_lat, bd_lng))
+
+
+def _inverse_array(forward, lat, lng, tol=1e-6, max_iter=20):
+  """
+  通过不动点迭代对正向转换求逆，每个点单独判断是否收敛，已收敛的点不再参与计算
+
+  Args:
+    forward: 正向转换的数组函数，如_wgs2gcj_core
+    lat: 正向转换后的纬度数组
+    lng: 正向转换后的经度数组
+    tol: 相邻两次迭代的变化量阈值（度），默认1e-6（约0.1米），
+      由于每次迭代误差缩小约两个数量级，收敛时的实际误差远小于该值
+    max_iter: 最大迭代次数
+
+  Returns:
+    (纬度数组, 经度数组, 是否收敛的掩码)
+  """
+  res_lat, res_lng = lat.copy(), lng.copy()
+  active = ~out_of_china_array(lat, lng)
+  for _ in range(max_iter):
+    if active.all():
+      idx = slice(None)
+    elif active.any():
+      idx = active.nonzero()[0]
+    else:
+      break
+    f_lat, f_lng = forward(res_lat[idx], res_lng[idx])
+    d_lat, d_lng = f_lat - lat[idx], f_lng - lng[idx]
+    res_lat[idx] -= d_lat
+    res_lng[idx] -= d_lng
+    done = (np.abs(d_lat) < tol) & (np.abs(d_lng) < tol)
+    if isinstance(idx, slice):
+      active[done] = False
+    else:
+      active[idx[done]] = False
+  return res_lat, res_lng, ~active
+
+
+def _warn_not_converged(converged):
+  if n := (~converged).sum():
+    warnings.warn(f'{n}个坐标迭代未收敛，结果可能存在误差')
+
+
+def _gcj2wgs_exact_array(gcj_lat, gcj_lng):
+  lat, lng, converged = _inverse_array(_wgs2gcj_core, gcj_lat, gcj_lng)
+  _warn_not_converged(converged)
+  return lat, lng
+
+
+def _bd2gcj_exact_array(bd_lat, bd_lng):
+  lat, lng, converged = _inverse_array(_gcj2bd_core, bd_lat, bd_lng)
+  _warn_not_converged(converged)
+  return lat, lng
+
+
+def _bd2wgs_exact_array(bd_lat, bd_lng):
+  return _gcj2wgs_exact_array(*_bd2gcj_exact_array(bd_lat, bd_lng))
+
+
+_fn_mapping_array = {
+  (SRS.bd09, SRS.wgs84): _bd2wgs_array,
+  (SRS.gcj02, SRS.wgs84): _gcj2wgs_array,
+  (SRS.wgs84, SRS.bd09): _wgs2bd_array,
+  (SRS.gcj02, SRS.bd09): _gcj2bd_array,
+  (SRS.wgs84, SRS.gcj02): _wgs2gcj_array,
+  (SRS.bd09, SRS.gcj02): _bd2gcj_array,
+}
+# 逆向转换使用迭代求逆的高精度版本
+_fn_mapping_array_exact = {
+  **_fn_mapping_array,
+  (SRS.bd09, SRS.wgs84): _bd2wgs_exact_array,
+  (SRS.gcj02, SRS.wgs84): _gcj2wgs_exact_array,
+  (SRS.bd09, SRS.gcj02): _bd2gcj_exact_array,
+}
+
+
+def coord_transform_array(lng, lat,
+                          from_srs: (SRS, str),
+                          to_srs: (SRS, str),
+                          exact: bool = False):
+  """
+  坐标系批量转换，国外的坐标保持不变，经纬度有一个为空时结果均为空
+
+  Args:
+    lng: 输入的经度数组
+    lat: 输入的纬度数组
+    from_srs: 输入坐标的格式
+    to_srs: 输出坐标的格式
+    exact: 是否对逆向转换（转为wgs84，bd09转为gcj02）进行迭代求逆，
+      默认只做一次近似，误差可达数米；为True时误差在毫米以下，每个点通常需要
+      3次正向转换，耗时约为单次近似的3.1~3.4倍
+
+  Returns:
+    (经度数组, 纬度数组)
+  """
+  lng = np.asarray(lng, dtype=float)
+  lat = np.asarray(lat, dtype=float)
+  if from_srs == to_srs:
+    return lng, lat
+  key = (from_srs, to_srs)
+  if key not in _fn_mapping_array:
+    raise NotImplementedError(
+        'not support transformation from %s to %s' % (from_srs, to_srs))
+  mapping = _fn_mapping_array_exact if exact else _fn_mapping_array
+  invalid = np.isnan(lng) | np.isnan(lat)
+  with np.errstate(invalid='ignore'):
+    lat, lng = mapping[key](lat, lng)
+  if invalid.any():
+    lng, lat = np.where(invalid, np.nan, lng), np.where(invalid, np.nan, lat)
+  return lng, lat
+
+
 def _coord_transform(lng: float, lat: float, from_srs: (SRS, str),
                      to_srs: (SRS, str)):
   """
@@ -164,8 +372,15 @@ def coord_transform_geojson(obj: dict, from_srs: SRS, to_srs: SRS):
     from_srs: 输入坐标的格式
     to_srs: 输出坐标的格式
   """
-  return geojson.utils.map_tuples(
-      lambda c: _coord_transform(c[0], c[1], from_srs, to_srs), obj)
+  # 第一次遍历收集全部坐标，批量转换后按相同的顺序写回
+  coords = []
+  geojson.utils.map_tuples(lambda c: coords.append(c) or c, obj)
+  if not coords:
+    return geojson.utils.map_tuples(lambda c: c, obj)
+  xy = np.array([c[:2] for c in coords], dtype=float)
+  lng, lat = coord_transform_array(xy[:, 0], xy[:, 1], from_srs, to_srs)
+  res = iter(zip(lng.tolist(), lat.tolist()))
+  return geojson.utils.map_tuples(lambda c: next(res), obj)
 
 
 @check_null()
@@ -192,7 +407,8 @@ def coord_trans_x2y(df,
                     srs_from: (SRS, str),
                     srs_to: (SRS, str),
                     c_lng: str = 'lng',
-                    c_lat: str = 'lat'):
+                    c_lat: str = 'lat',
+                    exact: bool = False):
   """
   经纬度类型坐标坐标批量转换工具
 
@@ -202,21 +418,47 @@ def coord_trans_x2y(df,
     srs_to: 要转的坐标系，可选wgs84,bd09,gcj02
     c_lng: 经度列名
     c_lat: 纬度列名
+    exact: 是否对逆向转换进行迭代求逆，得到亚米级精度的结果
   """
   df = df.copy()
-  tqdm.pandas(desc=f'{srs_from}->{srs_to}')
-  df[[c_lng, c_lat]] = df.progress_apply(
-      lambda r: _coord_transform(r[c_lng], r[c_lat], srs_from, srs_to),
-      axis=1, result_type='expand'
+  df[c_lng], df[c_lat] = coord_transform_array(
+      df[c_lng], df[c_lat], srs_from, srs_to, exact=exact
   )
   return df
 
 
+def coord_trans_geoms(geoms,
+                      srs_from: (SRS, str),
+                      srs_to: (SRS, str),
+                      exact: bool = False):
+  """
+  shapely数组坐标批量转换，一次性提取全部顶点坐标转换后再写回，
+  支持Point, Line, Polygon, MultiPolygon等全部类型
+
+  Args:
+    geoms: shapely数组或Series
+    srs_from: 当前坐标系，可选wgs84,bd09,gcj02
+    srs_to: 要转的坐标系，可选wgs84,bd09,gcj02
+    exact: 是否对逆向转换进行迭代求逆，得到亚米级精度的结果
+
+  Returns:
+    转换后的shapely数组
+  """
+  geoms = np.array(geoms, dtype=object)
+  include_z = bool(shapely.has_z(geoms).any())
+  coords = shapely.get_coordinates(geoms, include_z=include_z)
+  coords[:, 0], coords[:, 1] = coord_transform_array(
+      coords[:, 0], coords[:, 1], srs_from, srs_to, exact=exact
+  )
+  return shapely.set_coordinates(geoms, coords)
+
+
 def coord_trans_geom(df,
                      srs_from: (SRS, str),
                      srs_to: (SRS, str),
                      c_geometry: str = 'geometry',
-                     geometry_format=None):
+                     geometry_format=None,
+                     exact: bool = False):
   """
   geometry类型坐标批量转换工具
 
@@ -226,20 +468,21 @@ def coord_trans_geom(df,
     srs_to: 要转的坐标系，可选wgs84,bd09,gcj02
     c_geometry: 要转换的geometry列名
     geometry_format: 指定要输出的geometry格式，默认返回和原来相同的geometry格式
+    exact: 是否对逆向转换进行迭代求逆，得到亚米级精度的结果
   """
 
   assert c_geometry in df
-  df = df.copy()
   if not geometry_format:
     geometry_format = infer_geom_format(df[c_geometry])
-  df_temp = ensure_geometry(df)
-  tqdm.pandas(desc=f'{srs_from}->{srs_to}')
-  df_temp[c_geometry] = df_temp[c_geometry].progress_apply(
-      lambda x: _coord_transform_geometry(x, srs_from, srs_to)
-  )
-  del df[c_geometry]
-  df = df.join(df_temp[[c_geometry]], how='left')
-  return shapely2x(df, geometry_format=geometry_format, geometry=c_geometry)
+  geoms = auto2shapely(df[[c_geometry]], geometry=c_geometry)[c_geometry]
+  geoms = coord_trans_geoms(geoms.values, srs_from, srs_to, exact=exact)
+  # 浅拷贝后直接替换geometry列，不修改原数据
+  df = df.copy(deep=False)
+  if geometry_format == 'shapely':
+    df[c_geometry] = GeometryArray(geoms)
+    return gpd.GeoDataFrame(df, geometry=c_geometry, crs=4326)
+  df[c_geometry] = dumps_array(geoms, geometry_format)
+  return df
 
 
 def coord_transformer(df,
@@ -248,7 +491,8 @@ def coord_transformer(df,
                       c_lng: str = 'lng',
                       c_lat: str = 'lat',
                       c_geometry: str = 'geometry',
-                      geometry_format=None):
+                      geometry_format=None,
+                      exact: bool = False):
   """
   坐标转换工具，优先转geometry列
 
@@ -260,10 +504,12 @@ def coord_transformer(df,
     c_lat: 纬度列名
     c_geometry: 要转换的geometry列名
     geometry_format: 指定要输出的geometry格式，默认返回和原来相同的geometry格式
+    exact: 是否对逆向转换进行迭代求逆，得到亚米级精度的结果
   """
   if c_geometry in df:
-    return coord_trans_geom(df, srs_from, srs_to, c_geometry, geometry_format)
+    return coord_trans_geom(df, srs_from, srs_to, c_geometry, geometry_format,
+                            exact=exact)
   elif c_lat in df and c_lng in df:
-    return coord_trans_x2y(df, srs_from, srs_to, c_lng, c_lat)
+    return coord_trans_x2y(df, srs_from, srs_to, c_lng, c_lat, exact=exact)
   else:
     raise KeyError(f'文件中必须有经纬度列或"{c_geometry}"列')
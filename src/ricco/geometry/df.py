@@ -1,35 +1,62 @@
+import os
 import sys
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from typing import Union
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import shapely
+from geopandas.array import GeometryArray
+from geopandas.array import GeometryDtype
 from shapely.geometry import Polygon
+from shapely.geometry.base import BaseGeometry
 
 from ..base import agg_parser
 from ..base import ensure_list
 from ..base import warn_
+from ..etl.transformer import df_iter
 from ..etl.transformer import dict2df
 from ..etl.transformer import split_list_to_row
 from ..util.assertion import assert_not_null
 from ..util.assertion import assert_series_unique
 from ..util.decorator import progress
 from ..util.decorator import timer
-from ..util.kdtree import kdtree_nearest
+from ..util.kdtree import BUCKET_FUNCS
+from ..util.kdtree import PointIndex
+from ..util.kdtree import bucket_csr
+from ..util.kdtree import concat_csr
+from ..util.kdtree import csr_to_lists
+from ..util.kdtree import kdtree_nearest_csr
+from ..util.kdtree import radius_masks
+from ..util.kdtree import reduce_buckets
+from ..util.kdtree import reduce_csr
+from ..util.kdtree import reorder_csr
 from ..util.util import first_notnull_value
+from .agg import GroupAccumulator
+from .cache import get_geometry_cache
+from .codec import dumps_array
+from .codec import geom_format_mix
+from .codec import is_empty_array
+from .codec import loads_array
+from .codec import loads_mixed
+from .tagger import PolygonTagger
+from .util import AUTO_PARTITION
+from .util import DISTANCE_METHODS
+from .util import EARTH_RADIUS
 from .util import GEOM_FORMATS
 from .util import auto_loads
 from .util import epsg_from_lnglat
-from .util import geojson_dumps
-from .util import geojson_loads
 from .util import get_epsg
+from .util import get_transformer
 from .util import infer_geom_format
+from .util import lnglat_distance
+from .util import project_lnglat
 from .util import split_multi_geoms
-from .util import st_is_empty
-from .util import wkb_loads
-from .util import wkt_loads
+from .util import utm_epsg_array
 
 
 def geom_empty2null(df, c_geometry='geometry'):
@@ -38,7 +65,7 @@ def geom_empty2null(df, c_geometry='geometry'):
   if isinstance(df, gpd.GeoDataFrame):
     df.loc[df[c_geometry].is_empty, c_geometry] = None
   else:
-    df.loc[df[c_geometry].apply(st_is_empty), c_geometry] = None
+    df.loc[is_empty_array(df[c_geometry]), c_geometry] = None
   return df
 
 
@@ -60,15 +87,42 @@ def projection(
     c_geometry: geometry的列名
   """
   df = auto2shapely(df, geometry=c_geometry)
+  cache, key = get_geometry_cache(), None
+  if cache is not None and not shapely.has_z(df[c_geometry].values).any():
+    geoms = np.array(df[c_geometry].values, dtype=object)
+    coords = shapely.get_coordinates(geoms)
+    key = ('projection', str(df.crs), cache.fingerprint_geoms(geoms, coords))
   if not epsg and not crs:
     if city:
       epsg = get_epsg(city)
+    elif key and (cached := cache.get(key, 'auto_epsg')) is not None:
+      epsg = int(cached[0])
     else:
       df_temp = df.bounds
       lng = df_temp[['minx', 'maxx']].mean(axis=1).median()
       epsg = epsg_from_lnglat(lng)
       print(f'从数据集中自动获取的epsg code为：{epsg}')
-  return df.to_crs(epsg=epsg, crs=crs)
+      if key:
+        cache.put(key, 'auto_epsg', [epsg])
+  if not key:
+    return df.to_crs(epsg=epsg, crs=crs)
+  # 开启缓存时，复用同一数据集投影到同一坐标系后的坐标，
+  # 未命中时直接转换计算指纹时已提取的坐标
+  kind = f'crs:{crs}' if crs is not None else f'epsg:{epsg}'
+  if (projected := cache.get(key, kind)) is None:
+    from pyproj import CRS
+
+    crs_to = (
+        CRS.from_user_input(crs) if crs is not None else CRS.from_epsg(epsg)
+    )
+    transformer = get_transformer(df.crs, crs_to)
+    projected = np.column_stack(
+        transformer.transform(coords[:, 0], coords[:, 1])
+    )
+    cache.put(key, kind, projected)
+  df = df.copy()
+  df[c_geometry] = GeometryArray(shapely.set_coordinates(geoms, projected))
+  return df.set_crs(epsg=epsg, crs=crs, allow_override=True)
 
 
 @timer()
@@ -87,67 +141,151 @@ def projection_lnglat(
     crs: 投影坐标系，第二优先级
   """
   df = df.copy()
-  df_temp = lnglat2shapely(df[['lng', 'lat']])
-  df_temp = projection(df_temp, epsg=epsg, city=city, crs=crs)
-  df_temp = shapely2lnglat(df_temp[['geometry']])[['lng', 'lat']]
-  df.update(df_temp)
+  crs_to = _projection_crs(df['lng'], epsg=epsg, city=city, crs=crs)
+  x, y = project_lnglat(df['lng'], df['lat'], crs_to=crs_to)
+  valid = ~np.isnan(x)
+  df.loc[valid, 'lng'], df.loc[valid, 'lat'] = x[valid], y[valid]
   if 'geometry' in df:
     warnings.warn('仅对lng, lat列进行投影变换，未对geometry进行投影变换')
   return df
 
 
-@progress
+def _projection_crs(lng, epsg=None, city=None, crs=None):
+  """确定投影坐标系，未指定时根据城市或经度的中位数获取"""
+  if crs is not None:
+    return crs
+  if epsg:
+    return epsg
+  if city:
+    return get_epsg(city)
+  epsg = epsg_from_lnglat(pd.Series(lng).dropna().median())
+  print(f'从数据集中自动获取的epsg code为：{epsg}')
+  return epsg
+
+
+def _zone_groups(lng, lat) -> dict:
+  """按 UTM 区域对点位分组，返回 {epsg: 行号数组}，经纬度为空的行不参与分组"""
+  zones = utm_epsg_array(lng, lat)
+  return {
+    int(z): np.flatnonzero(zones == z) for z in np.unique(zones[zones > 0])
+  }
+
+
+def _map_zones(func, groups: dict) -> list:
+  """对每个 UTM 区域执行 func(epsg, 行号数组)，多个区域时使用线程池并行处理"""
+  if len(groups) <= 1:
+    return [func(*item) for item in groups.items()]
+  max_workers = min(len(groups), os.cpu_count() or 1)
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    return list(executor.map(lambda item: func(*item), groups.items()))
+
+
+def _map_utm_partitions(df: gpd.GeoDataFrame, func) -> pd.Series:
+  """
+  按每行所在的 UTM 区域分组投影后分别执行 func(投影后的数据, epsg)，
+  结果按原索引顺序拼接，geometry为空的行结果为空
+  """
+  bounds = shapely.bounds(np.asarray(df.geometry.values, dtype=object))
+  groups = _zone_groups(
+      (bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2
+  )
+  results = _map_zones(
+      lambda epsg, pos: func(
+          projection(df.iloc[pos], epsg=epsg, c_geometry=df.geometry.name),
+          epsg,
+      ),
+      groups,
+  )
+  if not results:
+    return pd.Series(index=df.index, dtype=float)
+  res = pd.concat(results)
+  return res[~res.index.duplicated()].reindex(df.index)
+
+
+def _loads_column(series: pd.Series, geom_format: str, empty2null=True):
+  """批量转换geometry列，转换失败的行汇总后统一警告"""
+  geoms, failed = loads_array(series, geom_format, empty2null=empty2null)
+  # 抽样未覆盖到的其他格式，按实际格式重新转换
+  if failed.any():
+    geoms[failed], failed[failed] = loads_mixed(series[failed])
+  if n_failed := failed.sum():
+    examples = series[failed].head(3).tolist()
+    warn_(f'{geom_format}转换失败{n_failed}行，已置为空，如：{examples}')
+  return GeometryArray(geoms)
+
+
 def wkb2shapely(df,
                 geometry='geometry',
                 epsg_code: int = 4326) -> gpd.GeoDataFrame:
   """将wkb格式的geometry列转换为shapely格式"""
   df = df.copy()
-  df = geom_empty2null(df, c_geometry=geometry)
-  df[geometry] = df[geometry].progress_apply(wkb_loads)
+  df[geometry] = _loads_column(df[geometry], 'wkb')
   return gpd.GeoDataFrame(df, geometry=geometry, crs=epsg_code)
 
 
-def shapely2wkb(df, geometry='geometry'):
-  """将shapely格式的geometry列转换为wkb格式"""
-  df = gpd.GeoDataFrame(df, geometry=geometry).copy()
-  df = geom_empty2null(df, c_geometry=geometry)
-  return df.to_wkb(hex=True)
+def _dumps_column(df, geometry, geom_format, all_geometry=False,
+                  **kwargs) -> pd.DataFrame:
+  """
+  批量转换shapely格式的geometry列，空的geometry置为None
+
+  Args:
+    df: 要转换的数据
+    geometry: geometry列名
+    geom_format: 输出的地理格式
+    all_geometry: 是否同时转换其他geometry类型（GeometryDtype）的列
+  """
+  df = pd.DataFrame(df).copy()
+  columns = [geometry]
+  if all_geometry:
+    columns += [
+      c for c in df.columns
+      if c != geometry and isinstance(df[c].dtype, GeometryDtype)
+    ]
+  for c in columns:
+    df[c] = dumps_array(df[c], geom_format, **kwargs)
+  return df
+
+
+def shapely2wkb(df, geometry='geometry', hex=True, precision: int = None):
+  """将shapely格式的geometry列转换为wkb格式，其他geometry类型的列一并转换"""
+  return _dumps_column(df, geometry, 'wkb', all_geometry=True,
+                       hex=hex, precision=precision)
 
 
-@progress
 def wkt2shapely(df,
                 geometry='geometry',
                 epsg_code: int = 4326) -> gpd.GeoDataFrame:
   """将wkt格式的geometry列转换为shapely格式"""
   df = df.copy()
-  df = geom_empty2null(df, c_geometry=geometry)
-  df[geometry] = df[geometry].progress_apply(wkt_loads)
+  df[geometry] = _loads_column(df[geometry], 'wkt')
   return gpd.GeoDataFrame(df, geometry=geometry, crs=epsg_code)
 
 
-def shapely2wkt(df: gpd.GeoDataFrame, geometry='geometry'):
-  """将shapely格式的geometry列转换为wkt格式"""
-  df = gpd.GeoDataFrame(df, geometry=geometry).copy()
-  df = geom_empty2null(df, c_geometry=geometry)
-  return df.to_wkt()
+def shapely2wkt(df: gpd.GeoDataFrame, geometry='geometry',
+                precision: int = None):
+  """
+  将shapely格式的geometry列转换为wkt格式，默认保留6位小数，
+  其他geometry类型的列一并转换
+  """
+  return _dumps_column(df, geometry, 'wkt', all_geometry=True,
+                       precision=precision)
 
 
-@progress
 def geojson2shapely(df,
                     geometry='geometry',
                     epsg_code: int = 4326) -> gpd.GeoDataFrame:
   """将geojson格式的geometry列转换为shapely格式"""
   df = df.copy()
-  df[geometry] = df[geometry].progress_apply(geojson_loads)
+  df[geometry] = _loads_column(df[geometry], 'geojson', empty2null=False)
   return gpd.GeoDataFrame(df, geometry=geometry, crs=epsg_code)
 
 
-@progress
-def shapely2geojson(df, geometry='geometry'):
-  """将shapely格式的geometry列转换为geojson格式"""
-  df = pd.DataFrame(df).copy()
-  df[geometry] = df[geometry].progress_apply(geojson_dumps)
-  return df
+def shapely2geojson(df, geometry='geometry', precision: int = None):
+  """
+  将shapely格式的geometry列转换为geojson格式，输出为不含空格的紧凑文本，
+  如'{"type":"Point","coordinates":[121.0,31.0]}'
+  """
+  return _dumps_column(df, geometry, 'geojson', precision=precision)
 
 
 @progress
@@ -268,13 +406,68 @@ def shapely2central_shapely(df, geometry='geometry', within=False):
   return gpd.GeoDataFrame(df, geometry=geometry)
 
 
-def auto2shapely(df, geometry='geometry') -> gpd.GeoDataFrame:
+def mixed2shapely(df,
+                  geometry='geometry',
+                  epsg_code: int = 4326) -> gpd.GeoDataFrame:
+  """将多种格式混合的geometry列按格式分组后转换为shapely格式"""
+  df = df.copy()
+  geoms, failed = loads_mixed(df[geometry])
+  if n_failed := failed.sum():
+    examples = df[geometry][failed].head(3).tolist()
+    warn_(f'geometry转换失败{n_failed}行，已置为空，如：{examples}')
+  df[geometry] = GeometryArray(geoms)
+  return gpd.GeoDataFrame(df, geometry=geometry, crs=epsg_code)
+
+
+def _cache_key(series: pd.Series):
+  """开启geometry缓存且为文本格式时，返回缓存及列的标识"""
+  cache = get_geometry_cache()
+  if cache is None or isinstance(series.dtype, GeometryDtype):
+    return None, None
+  if isinstance(first_notnull_value(series), BaseGeometry):
+    return None, None
+  try:
+    return cache, cache.fingerprint(series)
+  except TypeError:
+    # dict格式的geojson等不可哈希的值不参与缓存
+    return None, None
+
+
+def auto2shapely(df, geometry='geometry',
+                 sample: int = 1000) -> gpd.GeoDataFrame:
+  """
+  自动识别地理格式并转换为shapely格式，开启geometry缓存时复用已解析的结果
+
+  Args:
+    df: 要转换的Dataframe
+    geometry: geometry列的列名，默认为“geometry”
+    sample: 推断格式时的抽样个数，抽样中存在多种格式时按格式分组转换
+  """
+  if geometry in df:
+    cache, key = _cache_key(df[geometry])
+    if cache is None:
+      return _auto2shapely(df, geometry=geometry, sample=sample)
+    if (geoms := cache.get(key)) is not None:
+      df = df.copy()
+      df[geometry] = GeometryArray(geoms)
+      return gpd.GeoDataFrame(df, geometry=geometry, crs=4326)
+    df = _auto2shapely(df, geometry=geometry, sample=sample)
+    cache.put(key, 'geometry', df[geometry].values)
+    return df
+  return _auto2shapely(df, geometry=geometry, sample=sample)
+
+
+def _auto2shapely(df, geometry='geometry', sample: int = 1000):
   """自动识别地理格式并转换为shapely格式"""
   if geometry in df:
     if df[geometry].isna().all():
       warn_(f'{geometry}列全为空，返回GeoDataframe', mode='logging')
       return gpd.GeoDataFrame(df, geometry=geometry)
-    geom_format = infer_geom_format(df[geometry])
+    mix = geom_format_mix(df[geometry], sample=sample)
+    if len(mix) > 1:
+      warn_(f'{geometry}列存在多种地理格式：{mix}', mode='logging')
+      return mixed2shapely(df, geometry=geometry)
+    geom_format = next(iter(mix))
     assert geom_format in GEOM_FORMATS, '未知的地理格式'
     if geom_format == 'shapely':
       return gpd.GeoDataFrame(df, geometry=geometry)
@@ -289,7 +482,8 @@ def auto2shapely(df, geometry='geometry') -> gpd.GeoDataFrame:
 
 def shapely2x(df: (gpd.GeoDataFrame, pd.DataFrame),
               geometry_format: str,
-              geometry='geometry'):
+              geometry='geometry',
+              precision: int = None):
   """
   将shapely转为指定的格式
 
@@ -297,15 +491,16 @@ def shapely2x(df: (gpd.GeoDataFrame, pd.DataFrame),
     df: 要转换的GeoDataFrame
     geometry_format: 支持wkb,wkt,shapely,geojson
     geometry: geometry列的列名，默认“geometry”
+    precision: 坐标保留的小数位数，默认不处理，wkt默认保留6位
   """
   assert geometry_format in GEOM_FORMATS, '未知的地理格式'
   if geometry_format == 'shapely':
     return gpd.GeoDataFrame(df, geometry=geometry)
-  return getattr(sys.modules[__name__],
-                 f'shapely2{geometry_format}')(df, geometry=geometry)
+  return _dumps_column(df, geometry, geometry_format, precision=precision)
 
 
-def auto2x(df, geometry_format: str, geometry='geometry'):
+def auto2x(df, geometry_format: str, geometry='geometry',
+           precision: int = None):
   """
   将geometry转为指定格式
 
@@ -313,6 +508,7 @@ def auto2x(df, geometry_format: str, geometry='geometry'):
     df: 要转换的Dataframe
     geometry_format: 要转换为的geometry类型，支持shapely,wkb,wkt,geojson
     geometry: geometry列的列名，默认为“geometry”
+    precision: 坐标保留的小数位数，仅在需要转换格式时生效
   """
   assert geometry_format in GEOM_FORMATS, '未知的地理格式'
   # 当geometry列全部为空时，只转换Dataframe格式
@@ -322,10 +518,12 @@ def auto2x(df, geometry_format: str, geometry='geometry'):
       return gpd.GeoDataFrame(df, geometry=geometry)
     else:
       return pd.DataFrame(df)
-  if infer_geom_format(df[geometry]) == geometry_format:
+  # 按全部非空值判断格式，仅在全部为目标格式时直接返回，混合格式的列需要转换
+  if list(geom_format_mix(df[geometry], sample=None)) == [geometry_format]:
     return df
   df = auto2shapely(df, geometry=geometry)
-  return shapely2x(df, geometry_format=geometry_format, geometry=geometry)
+  return shapely2x(df, geometry_format=geometry_format, geometry=geometry,
+                   precision=precision)
 
 
 def norm_geometry(df,
@@ -385,6 +583,183 @@ def distance_gdf(df: gpd.GeoDataFrame, df_target: gpd.GeoDataFrame,
   ).drop(['index_right'], axis=1)
 
 
+def _distance_inputs(lnglats: list, method: str,
+                     epsg=None, city=None, crs=None):
+  """
+  距离计算的预处理，投影方法下将全部经纬度投影到同一坐标系
+
+  Returns:
+    处理后的坐标数组列表，以及对应的距离计算函数
+  """
+  assert method in DISTANCE_METHODS, f'method可选值为{DISTANCE_METHODS}'
+  lnglats = [
+    (np.asarray(lng, dtype=float), np.asarray(lat, dtype=float))
+    for lng, lat in lnglats
+  ]
+  if method != 'projection':
+    return lnglats, lambda *args: lnglat_distance(*args, method=method)
+  crs_to = _projection_crs(
+      np.concatenate([lng for lng, _ in lnglats]), epsg=epsg, city=city, crs=crs
+  )
+  lnglats = [project_lnglat(lng, lat, crs_to=crs_to) for lng, lat in lnglats]
+  return lnglats, lambda x1, y1, x2, y2: np.hypot(x2 - x1, y2 - y1)
+
+
+def distance_pairs(df: pd.DataFrame,
+                   p1_cols=('lng', 'lat'),
+                   p2_cols=('lng_2', 'lat_2'),
+                   c_dst: str = 'distance',
+                   method: str = 'haversine',
+                   epsg: int = None,
+                   city: str = None,
+                   crs=None) -> pd.DataFrame:
+  """
+  按行计算两组经纬度之间的距离，单位：米
+
+  Args:
+    df: 数据集
+    p1_cols: 点位1的经度、纬度列名
+    p2_cols: 点位2的经度、纬度列名
+    c_dst: 保存距离的列名
+    method: 计算方法，可选值如下：
+      - 'haversine': 球面距离，默认
+      - 'geodesic': WGS84椭球面测地线距离，最精确，速度较慢
+      - 'projection': 投影后的平面距离，与 distance 方法的结果一致
+    epsg: 投影的epsg代码，仅method为'projection'时有效
+    city: 所在城市，用于投影，仅method为'projection'时有效
+    crs: 投影坐标系，仅method为'projection'时有效
+  """
+  (p1, p2), fn = _distance_inputs(
+      [(df[p1_cols[0]], df[p1_cols[1]]), (df[p2_cols[0]], df[p2_cols[1]])],
+      method, epsg=epsg, city=city, crs=crs,
+  )
+  df = df.copy()
+  df[c_dst] = fn(*p1, *p2)
+  return df
+
+
+def od_distance(df_o: pd.DataFrame,
+                df_d: pd.DataFrame,
+                method: str = 'haversine',
+                top_k: int = None,
+                max_distance: float = None,
+                lng: str = 'lng',
+                lat: str = 'lat',
+                c_dst: str = 'distance',
+                max_cells: int = 2_000_000,
+                epsg: int = None,
+                city: str = None,
+                crs=None) -> pd.DataFrame:
+  """
+  计算起点集合到终点集合的距离（OD矩阵），单位：米。
+
+  按起点分块计算，每块最多计算max_cells个起终点对，结果以长表返回，
+  配合top_k或max_distance使用时无需生成完整的距离矩阵。
+
+  Args:
+    df_o: 起点数据集
+    df_d: 终点数据集
+    method: 计算方法，可选'haversine'、'geodesic'、'projection'，
+      参考 distance_pairs
+    top_k: 每个起点仅保留距离最近的k个终点
+    max_distance: 仅保留距离不超过该值的起终点对
+    lng: 经度列名，起终点数据集相同
+    lat: 纬度列名，起终点数据集相同
+    c_dst: 保存距离的列名
+    max_cells: 每块计算的起终点对数量上限，用于控制内存
+    epsg: 投影的epsg代码，仅method为'projection'时有效
+    city: 所在城市，用于投影，仅method为'projection'时有效
+    crs: 投影坐标系，仅method为'projection'时有效
+
+  Returns:
+    包含起点索引（origin）、终点索引（destination）及距离的DataFrame，
+    按起点顺序排列，同一起点内按距离升序排列，经纬度为空的点位不参与计算
+  """
+  assert top_k is None or top_k > 0, 'top_k必须大于0'
+  ((o_x, o_y), (d_x, d_y)), fn = _distance_inputs(
+      [(df_o[lng], df_o[lat]), (df_d[lng], df_d[lat])],
+      method, epsg=epsg, city=city, crs=crs,
+  )
+  key_fn, key_max = _od_rank_key(method, o_x, o_y, d_x, d_y, fn, max_distance)
+  n_o, n_d = len(o_x), len(d_x)
+  k = min(top_k, n_d) if top_k else None
+  step = max(1, max_cells // max(n_d, 1))
+  o_parts, d_parts, dist_parts = [], [], []
+  for start in range(0, n_o if n_d else 0, step):
+    rows = np.arange(start, min(start + step, n_o))
+    key = key_fn(rows)
+    key[np.isnan(key)] = np.inf
+    if k:
+      idx = np.argpartition(key, k - 1, axis=1)[:, :k]
+      key = np.take_along_axis(key, idx, axis=1).ravel()
+      mask = np.isfinite(key) if key_max is None else key <= key_max
+      o_idx, d_idx = np.repeat(rows, k)[mask], idx.ravel()[mask]
+    else:
+      mask = np.isfinite(key) if key_max is None else key <= key_max
+      o_local, d_idx = np.nonzero(mask)
+      o_idx = rows[o_local]
+    # 仅对筛选后的起终点对计算精确距离
+    dist = fn(o_x[o_idx], o_y[o_idx], d_x[d_idx], d_y[d_idx])
+    if max_distance is not None:
+      mask = dist <= max_distance
+      o_idx, d_idx, dist = o_idx[mask], d_idx[mask], dist[mask]
+    order = np.lexsort((dist, o_idx))
+    o_parts.append(o_idx[order])
+    d_parts.append(d_idx[order])
+    dist_parts.append(dist[order])
+  o_idx, d_idx, dist = (
+    np.concatenate(i) if i else np.array([], dtype=int)
+    for i in (o_parts, d_parts, dist_parts)
+  )
+  return pd.DataFrame({
+    'origin': df_o.index[o_idx],
+    'destination': df_d.index[d_idx],
+    c_dst: dist.astype(float),
+  })
+
+
+def _od_rank_key(method, o_x, o_y, d_x, d_y, fn, max_distance=None):
+  """
+  OD矩阵中用于排序和筛选的键，与距离单调一致且计算更快
+
+  Returns:
+    按起点行号计算键矩阵的函数，以及max_distance对应的键的上限
+  """
+  if method == 'haversine':
+    # 单位球面上的弦长与球面距离单调递增，按坐标差计算弦长的平方，
+    # 不使用点积：点积在1附近的精度只有约0.1米，近距离时会排错顺序
+    def unit_vectors(lng, lat):
+      lng, lat = np.radians(lng), np.radians(lat)
+      return np.column_stack([
+        np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)
+      ])
+
+    o_vec, d_vec = unit_vectors(o_x, o_y).T, unit_vectors(d_x, d_y).T
+
+    def chord2(rows):
+      key, diff = None, None
+      for o, d in zip(o_vec[:, rows], d_vec):
+        diff = np.subtract(o[:, None], d[None, :], out=diff)
+        diff *= diff
+        key = diff.copy() if key is None else np.add(key, diff, out=key)
+      return key
+
+    key_max = None
+    if max_distance is not None:
+      angle = min(max_distance / EARTH_RADIUS, np.pi)
+      key_max = (2 * np.sin(angle / 2)) ** 2 * (1 + 1e-9)
+    return chord2, key_max
+  if method == 'projection':
+    key_max = None if max_distance is None else max_distance ** 2 * (1 + 1e-9)
+    return lambda rows: (
+        (o_x[rows, None] - d_x[None, :]) ** 2
+        + (o_y[rows, None] - d_y[None, :]) ** 2
+    ), key_max
+  return lambda rows: fn(
+      o_x[rows, None], o_y[rows, None], d_x[None, :], d_y[None, :]
+  ), max_distance
+
+
 def split_grids(df: gpd.GeoDataFrame, step: int, geometry_format='wkb'):
   """
   根据所给边界划分固定边长的栅格
@@ -451,12 +826,18 @@ def ensure_geometry(df,
     if lng in df and lat in df:
       if not df[df[lng].notna() & df[geometry].isna()].empty:
         warn_(f'存在“{geometry}”为空但经纬度不为空的行', warning)
+    cache, key = _cache_key(df[geometry])
     df = auto2shapely(df[[geometry]], geometry=geometry)[[geometry]]
     if ensure_point:
       geom = first_notnull_value(df[geometry])
       if geom.geom_type not in ['point', 'Point']:
         warn_('非点数据，提取面内点', warning)
+        if cache and (points := cache.get(key, 'within')) is not None:
+          df[geometry] = GeometryArray(points)
+          return df
         df = shapely2central_shapely(df, within=True, geometry=geometry)
+        if cache:
+          cache.put(key, 'within', df[geometry].values)
     return df
   if lng in df and lat in df:
     return lnglat2shapely(
@@ -474,15 +855,20 @@ def ensure_lnglat(df, lng='lng', lat='lat', geometry='geometry'):
   if lng in df and lat in df:
     return df
   if geometry in df:
-    df_temp = auto2shapely(df[[geometry]])
-    df_temp = shapely2lnglat(df_temp, within=True)
-    return df.join(df_temp[[lng, lat]])
+    cache, key = _cache_key(df[geometry])
+    if cache is None or (points := cache.get(key, 'within')) is None:
+      df_temp = auto2shapely(df[[geometry]], geometry=geometry)
+      points = df_temp[geometry].representative_point().values
+      if cache:
+        cache.put(key, 'within', points)
+    points = gpd.GeoSeries(points, index=df.index)
+    return df.join(pd.DataFrame({lng: points.x, lat: points.y}))
   raise AssertionError('无可转为经纬度的列')
 
 
 def mark_tags_v2(
     df: pd.DataFrame,
-    polygon_df: pd.DataFrame,
+    polygon_df: (pd.DataFrame, PolygonTagger),
     c_tags: (list, str) = None,
     col_list=None,
     *,
@@ -494,14 +880,19 @@ def mark_tags_v2(
     c_lat='lat',
     c_geometry='geometry',
     c_polygon_geometry='geometry',
-    ensure_point=True
+    ensure_point=True,
+    chunk_size: int = None,
+    n_jobs: int = 1,
+    first_match: bool = False,
+    c_priority: str = None,
 ):
   """
   使用面数据通过空间关联（sjoin）给数据打标签
 
   Args:
     df: 要打标签的数据，一般为点数据，如为面数据，则会自动提取面内点计算
-    polygon_df: 标签列所在的数据集，一般为面数据
+    polygon_df: 标签列所在的数据集，一般为面数据；也可以传入预先构建的 PolygonTagger，
+      多批数据使用同一套面数据打标签时无需重复解析面数据和构建空间索引
     c_tags: 面数据中要关联到结果中的标签字段名，若为空则全部关联
     col_list: (已弃用)，同c_tags
     predicate: 关联方法，默认 'intersects'
@@ -513,21 +904,62 @@ def mark_tags_v2(
     c_geometry: 指定点数据的geometry列名
     c_polygon_geometry: 指定面数据的geometry列名
     ensure_point: point_df是否强制转换为点数据
+    chunk_size: 分块处理的行数，指定时按块打标签，各块共用同一个空间索引，
+      结果与不分块时一致，可降低内存占用
+    n_jobs: 并行处理的线程数，大于1时按块并行，未指定chunk_size时平均分为n_jobs块
+    first_match: 是否每条数据最多匹配一个面，面数据存在重叠时不会产生重复行，
+      适用于面数据基本不重叠的场景，速度更快
+    c_priority: 面数据的优先级列，值越小越优先，仅first_match为True时有效，
+      为空时面积越小越优先
   """
-  if df.empty or polygon_df.empty:
+  tagger = polygon_df if isinstance(polygon_df, PolygonTagger) else None
+  if df.empty or (polygon_df.empty if tagger is None else not len(tagger)):
     warn_('存在空的数据集，请检查', warning)
     return df
   if col_list:
     warnings.warn('“col_list”即将弃用，请使用“c_tags”代替', DeprecationWarning)
     c_tags = c_tags or col_list
+  if chunk_size or n_jobs > 1:
+    return _mark_tags_chunked(
+        df, polygon_df, c_tags,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        warning=warning,
+        predicate=predicate,
+        drop_geometry=drop_geometry,
+        geometry_format=geometry_format,
+        c_lng=c_lng,
+        c_lat=c_lat,
+        c_geometry=c_geometry,
+        c_polygon_geometry=c_polygon_geometry,
+        ensure_point=ensure_point,
+        first_match=first_match,
+        c_priority=c_priority,
+    )
+  if first_match and tagger is None:
+    return mark_tags_v2(
+        df, _build_tagger(polygon_df, c_tags, c_priority, c_polygon_geometry),
+        c_tags,
+        predicate=predicate,
+        drop_geometry=drop_geometry,
+        geometry_format=geometry_format,
+        warning=warning,
+        c_lng=c_lng,
+        c_lat=c_lat,
+        c_geometry=c_geometry,
+        ensure_point=ensure_point,
+        first_match=first_match,
+        c_priority=c_priority,
+    )
 
   df = df.copy()
   assert df.index.is_unique, 'point_df索引列必须唯一'
   if not c_tags:
-    c_tags = polygon_df.columns.to_list()
+    c_tags = polygon_df.columns.to_list() if tagger is None else tagger.c_tags
   else:
     c_tags = ensure_list(c_tags)
-    polygon_df = polygon_df[[*c_tags, c_polygon_geometry]]
+    if tagger is None:
+      polygon_df = polygon_df[[*c_tags, c_polygon_geometry]]
 
   if cols_mapping := {
     c: f'{c}_origin' for c in c_tags
@@ -545,12 +977,22 @@ def mark_tags_v2(
   # 转换为shapely格式
   _df = ensure_geometry(df, ensure_point, warning,
                         lng=c_lng, lat=c_lat, geometry=c_geometry)
-  polygon_df = auto2shapely(polygon_df, geometry=c_polygon_geometry)
   # 空间关联
-  _df = _df.sjoin(
-      polygon_df, how='left', predicate=predicate,
-  ).drop(['index_right'], axis=1)
-  del _df[c_geometry]
+  if tagger is not None:
+    tagger.check_crs(_df.crs, warning)
+    _df = tagger.join(
+        _df[c_geometry].values, _df.index,
+        c_tags=c_tags,
+        predicate=predicate,
+        first_match=first_match,
+        c_priority=c_priority,
+    )
+  else:
+    polygon_df = auto2shapely(polygon_df, geometry=c_polygon_geometry)
+    _df = _df.sjoin(
+        polygon_df, how='left', predicate=predicate,
+    ).drop(['index_right'], axis=1)
+    del _df[c_geometry]
   # 统一geometry输出格式、删除geometry、避免多次转换
   if c_geometry in df:
     if drop_geometry:
@@ -561,6 +1003,112 @@ def mark_tags_v2(
   return df.join(_df, how='left')
 
 
+def _build_tagger(polygon_df, c_tags, c_priority=None,
+                  c_polygon_geometry='geometry') -> PolygonTagger:
+  """构建 PolygonTagger，优先级列不在标签列中时一并保留"""
+  c_tags = ensure_list(c_tags)
+  if c_tags and c_priority and c_priority not in c_tags:
+    c_tags = [*c_tags, c_priority]
+  return PolygonTagger(
+      polygon_df, c_tags, c_polygon_geometry=c_polygon_geometry
+  )
+
+
+def _mark_tags_chunked(df, polygon_df, c_tags, *,
+                       chunk_size=None, n_jobs=1, warning=True, **kwargs):
+  """分块（并行）打标签，各块共用同一个 PolygonTagger，结果按原顺序拼接"""
+  assert df.index.is_unique, 'point_df索引列必须唯一'
+  start = time.perf_counter()
+  if not isinstance(polygon_df, PolygonTagger):
+    polygon_df = _build_tagger(
+        polygon_df, c_tags, kwargs['c_priority'], kwargs['c_polygon_geometry']
+    )
+  chunk_size = chunk_size or -(-len(df) // n_jobs)
+
+  def run(item):
+    i, chunk = item
+    return mark_tags_v2(
+        chunk, polygon_df, c_tags, warning=warning and i == 0, **kwargs
+    )
+
+  chunks = enumerate(df_iter(df, chunksize=chunk_size))
+  if n_jobs > 1:
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+      results = list(executor.map(run, chunks))
+  else:
+    results = [run(item) for item in chunks]
+  df = pd.concat(results)
+  cost = time.perf_counter() - start
+  warn_(f'mark_tags_v2: {len(df)}行，耗时{cost:.2f}秒，'
+        f'{len(df) / max(cost, 1e-9):.0f}行/秒', warning, mode='logging')
+  return df
+
+
+def _iter_file_chunks(filepath: str, chunk_size: int):
+  """按块读取文件，parquet和csv文件流式读取，其他格式读取后再分块"""
+  from ..etl.extract import rdf
+  from ..util.os import extension
+
+  ex = extension(filepath)
+  if ex in ('.pa', '.parquet'):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(filepath).iter_batches(batch_size=chunk_size):
+      yield batch.to_pandas()
+  elif ex == '.csv':
+    yield from pd.read_csv(filepath, chunksize=chunk_size)
+  else:
+    yield from df_iter(rdf(filepath), chunksize=chunk_size)
+
+
+def mark_tags_file(
+    filepath: str,
+    polygon_df: (pd.DataFrame, PolygonTagger),
+    dirpath: str,
+    c_tags: (list, str) = None,
+    *,
+    chunk_size: int = 1_000_000,
+    n_jobs: int = 1,
+    to_ext: str = '.parquet',
+    warning: bool = True,
+    **kwargs,
+):
+  """
+  对超出内存的点数据文件分块打标签，每块的结果分别保存为目录下的一个文件，
+  文件名为 part_000000{to_ext} 的格式，与 to_parts_file 一致
+
+  Args:
+    filepath: 点数据文件路径，parquet和csv文件按块流式读取
+    polygon_df: 面数据或预先构建的 PolygonTagger
+    dirpath: 结果保存的目录
+    c_tags: 面数据中要关联到结果中的标签字段名，若为空则全部关联
+    chunk_size: 每块的行数
+    n_jobs: 每块内并行处理的线程数
+    to_ext: 结果文件的扩展名
+    warning: 是否输出警告信息
+    **kwargs: mark_tags_v2 的其他参数
+  """
+  from ..etl.load import to_file
+
+  start, rows = time.perf_counter(), 0
+  if not isinstance(polygon_df, PolygonTagger):
+    polygon_df = _build_tagger(
+        polygon_df, c_tags,
+        c_priority=kwargs.get('c_priority'),
+        c_polygon_geometry=kwargs.get('c_polygon_geometry', 'geometry'),
+    )
+  for i, chunk in enumerate(_iter_file_chunks(filepath, chunk_size)):
+    chunk = mark_tags_v2(
+        chunk, polygon_df, c_tags,
+        n_jobs=n_jobs, warning=warning and i == 0, **kwargs
+    )
+    rows += len(chunk)
+    savefile = os.path.join(dirpath, f'part_{str(i).zfill(6)}{to_ext}')
+    to_file(chunk, savefile, log=False)
+  cost = time.perf_counter() - start
+  warn_(f'mark_tags_file: {rows}行，耗时{cost:.2f}秒，'
+        f'{rows / max(cost, 1e-9):.0f}行/秒', warning, mode='logging')
+
+
 def nearest_neighbor(
     df: pd.DataFrame,
     df_target: pd.DataFrame,
@@ -575,13 +1123,23 @@ def nearest_neighbor(
     df:
     df_target:
     c_dst: 输出最短距离的列名，默认为“min_distance”
-    epsg: 对于跨时区或不在同一个城市的可以指定epsg code，默认会根据经度中位数获取
+    epsg: 对于跨时区或不在同一个城市的可以指定epsg code，默认会根据经度中位数获取；
+      传入'auto-partition'时按 UTM 区域分组，每组将目标数据集投影到该组的区域后再查询
     r: 限制查询半径
   """
   # 将两个数据集都转为shapely格式
   assert df.index.is_unique, 'df索引列必须唯一'
   df_left = ensure_geometry(df)
   df_target = ensure_geometry(df_target)
+  if epsg == AUTO_PARTITION:
+    df_left[c_dst] = _map_utm_partitions(
+        df_left,
+        lambda df_zone, zone: df_zone.sjoin_nearest(
+            projection(df_target, epsg=zone),
+            how='left', distance_col=c_dst, max_distance=r,
+        )[c_dst],
+    )
+    return df.join(df_left[[c_dst]], how='left')
   # 投影
   df_left = projection(df_left, epsg=epsg)
   df_target = projection(df_target, epsg=epsg)
@@ -596,18 +1154,21 @@ def nearest_neighbor(
 @progress
 def nearest_kdtree(
     df: pd.DataFrame,
-    df_poi: pd.DataFrame,
+    df_poi: (pd.DataFrame, PointIndex),
     /, *,
     c_count: str = 'count',
     c_min_distance: str = 'min_distance',
     agg: dict = None,
     limit: int = None,
-    r: (int, float) = None,
+    r: (int, float, list) = None,
     keep_origin: bool = False,
-    leaf_size: int = 2,
+    leaf_size: (int, str) = 'auto',
     epsg: int = None,
     city=None,
     crs=None,
+    n_jobs: int = 1,
+    ring: bool = False,
+    metric: str = 'euclidean',
 ):
   """
   KDTree近邻分析，计算一个数据集中的元素到另一个数据集中全部元素的最短距离（单位：米）,
@@ -615,72 +1176,306 @@ def nearest_kdtree(
 
   Args:
     df: 基础数据集，统计该数据及周边的其他数据集的信息
-    df_poi: 被统计的数据集
+    df_poi: 被统计的数据集，也可以传入预先构建的 PointIndex，此时epsg/city/crs/leaf_size无效
     c_count: 计数列字段名，默认“count”
     c_min_distance: 最短距离字段名，默认“min_distance”
-    agg: 计算 df_poi 中的其他字段，格式如: {'面积': ['sum', 'mean']}，即计算面积的和、均值
+    agg: 计算 df_poi 中的其他字段，格式如: {'面积': ['sum', 'mean']}，即计算面积的和、均值；
+      sum、mean、max、min、count、std使用向量化计算，其他方法按 pandas.Series 的同名方法计算
     limit: 限制符合条件的 df_poi 中的个数，由近及远
-    r: 限制查询半径
-    keep_origin: 是否保留匹配后原始的索引信息
-    leaf_size: KDTree 叶子节点大小
-    epsg: 投影代码，用于投影，epsg/city/crs指定多个时以epsg为准
+    r: 限制查询半径，传入多个半径时只按最大的半径查询一次，数量列和 agg 计算的列
+      以半径作为后缀分别输出，如“count_500”，最短距离列及近邻列表按最大的半径计算
+    keep_origin: 是否保留匹配后原始的索引信息，为True时增加 ind_list（df_poi 的索引）
+      和 dist_list 两列列表
+    leaf_size: KDTree 叶子节点大小，为'auto'时自动选择
+    epsg: 投影代码，用于投影，epsg/city/crs指定多个时以epsg为准；
+      传入'auto-partition'时按 UTM 区域分组，每组将 df_poi 投影到该组的区域后再查询
     city: 城市，用于获取城市中心点，epsg/city/crs指定多个时以epsg为准
     crs: 数据集的 crs，epsg/city/crs指定多个时以epsg为准
+    n_jobs: 并行查询的线程数，大于1时将查询点分块，共用同一个索引并行查询
+    ring: 传入多个半径时是否按环形统计，为True时每个半径只统计与上一个半径之间的点，
+      否则统计半径内的全部点
+    metric: 距离度量，默认'euclidean'，投影后按平面距离计算；为'haversine'时不投影，
+      使用 BallTree 按球面距离计算，适用于跨多个UTM区域的数据，此时epsg/city/crs无效
   """
-  assert df.index.is_unique and df_poi.index.is_unique, '数据集索引必须唯一'
+  assert df.index.is_unique, '数据集索引必须唯一'
+  # 多个半径时按最大的半径查询，suffixes为各半径对应的列名后缀
+  suffixes = None
+  if isinstance(r, (list, tuple)):
+    assert r and len(set(r)) == len(r), '半径不能为空或重复'
+    r = sorted(r)
+    suffixes = [_radius_suffix(i) for i in r]
+  radii = r if suffixes else [r]
+  r = radii[-1]
   # 确保数据中有经纬度
   df_temp = ensure_lnglat(df)
-  df_poi = ensure_lnglat(df_poi)
-
   df_temp = df_temp[df_temp.lng.notna() & df_temp.lat.notna()]
-  df_poi = df_poi[df_poi.lng.notna() & df_poi.lat.notna()]
-  assert not df_temp.empty and not df_poi.empty, '筛选后数据集为空，请检查经纬度列'
-  # 投影
-  df_temp = projection_lnglat(
-      df_temp, epsg=epsg, city=city, crs=crs
-  )[['lng', 'lat']]
-  df_poi = projection_lnglat(df_poi, epsg=epsg, city=city, crs=crs)
-  # 计算（范围内）的一个点或多个点
-  data_tree = df_poi[['lng', 'lat']].values
-  data_query = df_temp[['lng', 'lat']].values
-  df_temp['ind_list'], df_temp['dist_list'] = kdtree_nearest(
-      data_tree, data_query, limit=limit, r=r, leaf_size=leaf_size,
-  )
-  # 统计数量
+  assert not df_temp.empty, '筛选后数据集为空，请检查经纬度列'
+  if epsg == AUTO_PARTITION:
+    assert not isinstance(df_poi, PointIndex), 'PointIndex不支持按UTM区域分组查询'
+    assert metric == 'euclidean', '按UTM区域分组查询时metric只能为euclidean'
+    assert df_poi.index.is_unique, '数据集索引必须唯一'
+    df_poi = ensure_lnglat(df_poi)
+    df_poi = df_poi[df_poi.lng.notna() & df_poi.lat.notna()]
+    assert not df_poi.empty, '筛选后数据集为空，请检查经纬度列'
+    ind, dist, offsets = _kdtree_nearest_by_zone(
+        df_temp, df_poi, limit=limit, r=r, leaf_size=leaf_size, n_jobs=n_jobs,
+        sort_results=keep_origin,
+    )
+    poi_index, poi_data = df_poi.index, df_poi
+  else:
+    # 投影并构建索引，查询数据投影到索引所在的坐标系
+    if not isinstance(df_poi, PointIndex):
+      df_poi = PointIndex.from_df(
+          df_poi, epsg=epsg, city=city, crs=crs, leaf_size=leaf_size,
+          metric=metric,
+      )
+    poi_index, poi_data = df_poi.index, df_poi.data
+    if not (agg or keep_origin):
+      # 仅统计数量和最短距离时无需获取每个点的近邻列表
+      counts, min_distance = _nearest_count_distance(
+          df_poi, df_poi.project(df_temp), limit=limit, radii=radii,
+          ring=ring, count=bool(c_count), distance=bool(c_min_distance),
+          n_jobs=n_jobs,
+      )
+      return df.join(_nearest_columns(
+          df, df_temp.index, c_count, counts, c_min_distance, min_distance,
+          suffixes,
+      ))
+    # 计算（范围内）的一个点或多个点
+    # 只有保留近邻列表时需要将结果由近及远排序
+    ind, dist, offsets = df_poi.query(
+        df_temp, limit=limit, r=r, n_jobs=n_jobs, sort_results=keep_origin,
+    )
+  min_distance = reduce_csr(dist, offsets, 'min')
+  n = len(offsets) - 1
+  # 多个半径时按距离划分结果，keys为每个元素所在的 (查询点, 半径) 分组
+  if suffixes:
+    keys = bucket_csr(dist, offsets, radii)
+    counts = reduce_buckets(keys, n, len(radii), ring=ring)
+  else:
+    counts = [np.diff(offsets)]
+  df_temp = pd.DataFrame(index=df_temp.index)
+  # 保留关联内容，索引列表为 df_poi 的索引
+  if keep_origin:
+    df_temp['ind_list'] = csr_to_lists(poi_index.values[ind], offsets)
+    df_temp['dist_list'] = csr_to_lists(dist, offsets)
+  df_temp = df_temp.join(_nearest_columns(
+      df, df_temp.index, c_count, counts, c_min_distance, min_distance,
+      suffixes,
+  ))
+  # 计算其他字段
+  masks = None
+  for c_src, func, c_dst in agg_parser(agg or {}):
+    assert poi_data is not None and c_src in poi_data, f'"{c_src}"列不存在'
+    values = poi_data[c_src].values[ind]
+    if not suffixes:
+      df_temp[c_dst] = reduce_csr(values, offsets, func)
+      continue
+    if func in BUCKET_FUNCS and pd.api.types.is_numeric_dtype(values):
+      res = reduce_buckets(keys, n, len(radii), func, values, ring=ring)
+    else:
+      masks = masks or radius_masks(dist, radii, ring=ring)
+      res = [reduce_csr(values, offsets, func, mask=m) for m in masks]
+    for suffix, values in zip(suffixes, res):
+      df_temp[f'{c_dst}_{suffix}'] = values
+  return df.join(df_temp)
+
+
+def _radius_suffix(r) -> str:
+  """半径作为列名的后缀，整数不带小数点"""
+  return str(int(r)) if float(r).is_integer() else str(r)
+
+
+def _nearest_columns(df, index, c_count, counts: list,
+                     c_min_distance, min_distance, suffixes=None):
+  """数量列及最短距离列，counts为各半径的数量，多个半径时数量列名带后缀"""
+  res = pd.DataFrame(index=index)
   if c_count:
-    assert c_count not in df, f'"{c_count}"已存在，请更换列名'
-    df_temp[c_count] = df_temp['ind_list'].progress_apply(lambda x: len(x))
-  # 计算最短距离
+    names = [f'{c_count}_{i}' for i in suffixes] if suffixes else [c_count]
+    for name, values in zip(names, counts):
+      assert name not in df, f'"{name}"已存在，请更换列名'
+      res[name] = values
   if c_min_distance:
     assert c_min_distance not in df, f'"{c_min_distance}"已存在，请更换列名'
-    df_temp[c_min_distance] = df_temp['dist_list'].progress_apply(
-        lambda x: min(x) if len(x) > 0 else None
+    res[c_min_distance] = min_distance
+  return res
+
+
+def _nearest_count_distance(index: PointIndex, xy, *, limit=None, radii=(None,),
+                            ring=False, count=True, distance=True, n_jobs=1):
+  """
+  只统计数量及最短距离，半径内的数量使用 count_radius 统计，
+  最短距离只查询最近的一个点，不生成近邻列表，也无需排序
+
+  Returns:
+    各半径的数量列表及最短距离，radii为从小到大排列的半径列表
+  """
+  counts, min_distance, r = [], None, radii[-1]
+  if count:
+    for radius in radii:
+      if radius:
+        c = index.count_radius(xy, radius, n_jobs=n_jobs)
+        counts.append(np.minimum(c, limit) if limit else c)
+      else:
+        counts.append(np.full(len(xy), min(limit or 1, len(index))))
+    if ring:
+      counts = [counts[0], *np.diff(counts, axis=0)]
+  if distance:
+    _, min_distance, _ = index.query(xy, limit=1, n_jobs=n_jobs)
+    if r:
+      min_distance = np.where(min_distance <= r, min_distance, np.nan)
+  return counts, min_distance
+
+
+def _kdtree_nearest_by_zone(df_query, df_tree, **kwargs):
+  """
+  按查询点所在的 UTM 区域分组进行KDTree查询，每组都将全部被查询点投影到该区域，
+  保证区域边界附近的查询结果不受分组影响，结果为CSR形式，参考 kdtree_nearest_csr
+  """
+  lng, lat = df_query['lng'].values, df_query['lat'].values
+  tree_lng, tree_lat = df_tree['lng'].values, df_tree['lat'].values
+
+  def query(zone, pos):
+    xy_tree = np.column_stack(project_lnglat(tree_lng, tree_lat, crs_to=zone))
+    xy_query = np.column_stack(
+        project_lnglat(lng[pos], lat[pos], crs_to=zone)
     )
-  # 计算其他字段
-  if agg:
-    for c_src, func, c_dst in agg_parser(agg):
-      df_temp[c_dst] = df_temp['ind_list'].progress_apply(
-          lambda x: getattr(df_poi.loc[x][c_src], func)()
-      )
-  # 保留关联内容
-  if not keep_origin:
-    del df_temp['ind_list'], df_temp['dist_list']
-  del df_temp['lng'], df_temp['lat']
-  return df.join(df_temp)
+    return pos, kdtree_nearest_csr(xy_tree, xy_query, **kwargs)
+
+  results = _map_zones(query, _zone_groups(lng, lat))
+  pos = np.concatenate([p for p, _ in results])
+  return reorder_csr(*concat_csr(r for _, r in results), np.argsort(pos))
+
+
+CONTIGUITY = ('queen', 'rook')
+
+
+def _neighbor_pairs(geoms, contiguity='queen', lengths=None):
+  """
+  使用STRtree批量查询相邻（touches）的面
+
+  Args:
+    geoms: shapely数组
+    contiguity: 相邻标准，'queen'为至少有一个公共点，'rook'为至少有一段公共边
+    lengths: 计算公共边长度使用的shapely数组，为None时不计算
+
+  Returns:
+    两个方向的行号对及公共边长度（不计算时为None），按行号排序
+  """
+  assert contiguity in CONTIGUITY, f'contiguity可选：{CONTIGUITY}'
+  geoms = np.asarray(geoms, dtype=object)
+  left, right = shapely.STRtree(geoms).query(geoms, predicate='touches')
+  # touches是对称的，只计算一个方向，再镜像得到另一个方向
+  left, right = left[left < right], right[left < right]
+  length = None
+  if contiguity == 'rook' or lengths is not None:
+    src = geoms if lengths is None else np.asarray(lengths, dtype=object)
+    boundary = shapely.boundary(src)
+    length = shapely.length(
+        shapely.intersection(boundary[left], boundary[right])
+    )
+    if contiguity == 'rook':
+      keep = length > 0
+      left, right, length = left[keep], right[keep], length[keep]
+    if lengths is None:
+      length = None
+  left, right = np.r_[left, right], np.r_[right, left]
+  order = np.lexsort((right, left))
+  left, right = left[order], right[order]
+  if length is not None:
+    length = np.r_[length, length][order]
+  return left, right, length
+
+
+def neighbor_edges(
+    df: (pd.DataFrame, gpd.GeoDataFrame),
+    key_col: str = None,
+    contiguity: str = 'queen',
+    border_length: bool = False,
+    epsg: int = None,
+    c_geometry: str = 'geometry',
+) -> pd.DataFrame:
+  """
+  获取面数据的邻接关系，以边列表的形式返回，每对相邻的面包含两个方向的两条边
+
+  Args:
+    df: 面数据
+    key_col: 关键列，必须唯一，默认使用索引
+    contiguity: 相邻标准，'queen'为至少有一个公共点且不重叠，'rook'为至少有一段公共边
+    border_length: 是否计算公共边的长度（单位：米），结果输出到“border_length”列
+    epsg: 计算公共边长度时的投影代码，默认根据经纬度获取
+    c_geometry: geometry列名
+
+  Returns:
+    包含source、target列的DataFrame，按 source、target 在 df 中的顺序排列
+  """
+  keys = df.index if key_col is None else df[key_col]
+  assert keys.is_unique, '关键列必须唯一'
+  assert keys.notna().all(), '关键列不能为空'
+  df = auto2shapely(df[[c_geometry]], geometry=c_geometry)
+  lengths = None
+  if border_length:
+    if df.crs is None:
+      df = df.set_crs('epsg:4326')
+    lengths = projection(
+        df, epsg=epsg, c_geometry=c_geometry
+    )[c_geometry].values
+  left, right, length = _neighbor_pairs(
+      df[c_geometry].values, contiguity=contiguity, lengths=lengths
+  )
+  keys = np.asarray(keys)
+  res = pd.DataFrame({'source': keys[left], 'target': keys[right]})
+  if border_length:
+    res['border_length'] = length
+  return res
+
+
+def neighbor_matrix(
+    df: (pd.DataFrame, gpd.GeoDataFrame),
+    contiguity: str = 'queen',
+    border_length: bool = False,
+    epsg: int = None,
+    c_geometry: str = 'geometry',
+):
+  """
+  获取面数据的邻接矩阵，行列均为 df 中的行号
+
+  Args:
+    df: 面数据
+    contiguity: 相邻标准，'queen'为至少有一个公共点且不重叠，'rook'为至少有一段公共边
+    border_length: 为True时矩阵的值为公共边的长度（单位：米），否则为1
+    epsg: 计算公共边长度时的投影代码，默认根据经纬度获取
+    c_geometry: geometry列名
+
+  Returns:
+    scipy.sparse.csr_matrix
+  """
+  from scipy.sparse import csr_matrix
+
+  n = len(df)
+  edges = neighbor_edges(
+      df.reset_index(drop=True), contiguity=contiguity,
+      border_length=border_length, epsg=epsg, c_geometry=c_geometry,
+  )
+  values = edges['border_length'] if border_length else np.ones(len(edges))
+  return csr_matrix((values, (edges['source'], edges['target'])), shape=(n, n))
 
 
 def get_neighbors(
     df: (pd.DataFrame, gpd.GeoDataFrame),
     key_col: str,
     res_type='dict',
+    contiguity: str = 'queen',
 ) -> (dict, pd.DataFrame):
   """
-  获取数据集中每个点的邻居面(相邻标准：至少有一个点相同且不重叠)
+  获取数据集中每个面的邻居面(相邻标准：至少有一个点相同且不重叠)，
+  邻接关系由 neighbor_edges 计算，没有邻居的面不输出
 
   Args:
     df:
     key_col: 关键列，必须唯一
     res_type: 返回类型，可返回dict或Dataframe
+    contiguity: 相邻标准，'queen'为至少有一个公共点，'rook'为至少有一段公共边
   """
   if not key_col:
     key_col = 'index'
@@ -689,22 +1484,17 @@ def get_neighbors(
   assert_not_null(df, key_col)
   if isinstance(res_type, str):
     res_type = res_type.lower()
-  res = {}
-  df = auto2shapely(df.copy())
-  for key in df[key_col].unique():
-    neighbors = []
-    v = df[df[key_col] == key].geometry.squeeze()
-    for _, row in df.iterrows():
-      if v.touches(row['geometry']):
-        neighbors.append(row[key_col])
-      if neighbors:
-        res[key] = neighbors
+  if res_type not in (dict, 'dict', pd.DataFrame, 'df', 'dataframe'):
+    raise ValueError(f'错误的res_type:{res_type}')
+  edges = neighbor_edges(df, key_col, contiguity=contiguity)
+  res = {
+    key: group.tolist()
+    for key, group in edges.groupby('source', sort=False)['target']
+  }
   if res_type in (dict, 'dict'):
     return res
-  if res_type in (pd.DataFrame, 'df', 'dataframe'):
-    df = dict2df(res)
-    return df.explode('value')
-  raise ValueError(f'错误的res_type:{res_type}')
+  df = dict2df(res)
+  return df.explode('value')
 
 
 def get_area(
@@ -718,13 +1508,19 @@ def get_area(
   Args:
     df: 要计算的面数据
     c_dst: 输出面积的列名，默认为“area”
-    epsg: 对于跨时区或不在同一个城市的可以指定epsg code，默认会根据经度中位数获取
+    epsg: 对于跨时区或不在同一个城市的可以指定epsg code，默认会根据经度中位数获取；
+      传入'auto-partition'时按每条数据所在的 UTM 区域分别投影
     decimals: 要保留的小数位数
   """
   # 将数据集转为shapely格式
   assert df.index.is_unique, 'df索引列必须唯一'
   assert c_dst not in df, f'"{c_dst}"列已存在，请指定不同的c_dst'
   df_left = ensure_geometry(df)
+  if epsg == AUTO_PARTITION:
+    df_left[c_dst] = _map_utm_partitions(
+        df_left, lambda df_zone, _: df_zone.area.round(decimals)
+    )
+    return df.join(df_left[[c_dst]], how='left')
   # 投影
   df_left = projection(df_left, epsg=epsg)
   # 计算面积
@@ -739,7 +1535,8 @@ def buffer(df: pd.DataFrame,
            geo_type: str = 'point',
            geometry: str = 'geometry',
            buffer_geometry: str = 'buffer_geometry',
-           geo_format='wkb') -> pd.DataFrame:
+           geo_format='wkb',
+           epsg: (int, str) = None) -> pd.DataFrame:
   """
   获得一定半径的缓冲区
 
@@ -751,6 +1548,8 @@ def buffer(df: pd.DataFrame,
     geometry: str, geometry字段名，默认"geometry"
     buffer_geometry: 输出的缓冲区geometry字段名，默认"buffer_geometry"
     geo_format: str, 输出的缓冲区geometry格式，支持wkb,wkt,shapely,geojson，默认wkb
+    epsg: 投影的epsg代码，优先于city；传入'auto-partition'时按每条数据所在的
+      UTM 区域分别投影
   Returns:
     包含缓冲区geometry的DataFrame
   """
@@ -763,35 +1562,75 @@ def buffer(df: pd.DataFrame,
   else:
     raise ValueError('geo_type必须为point，line或polygon')
   crs = df_buffer.crs
-  df_buffer = projection(df_buffer, city=city)
-  df_buffer[buffer_geometry] = df_buffer.buffer(radius)
-  df_buffer = gpd.GeoDataFrame(
-      df_buffer[[buffer_geometry]], geometry=buffer_geometry
-  )
-  df_buffer = projection(df_buffer, crs=crs, c_geometry=buffer_geometry)
+  if epsg == AUTO_PARTITION:
+    df_buffer = gpd.GeoDataFrame({
+      buffer_geometry: _map_utm_partitions(
+          df_buffer, lambda df_zone, _: df_zone.buffer(radius).to_crs(crs)
+      )
+    }, geometry=buffer_geometry, crs=crs)
+  else:
+    df_buffer = projection(df_buffer, epsg=epsg, city=city)
+    df_buffer[buffer_geometry] = df_buffer.buffer(radius)
+    df_buffer = gpd.GeoDataFrame(
+        df_buffer[[buffer_geometry]], geometry=buffer_geometry
+    )
+    df_buffer = projection(df_buffer, crs=crs, c_geometry=buffer_geometry)
   df = df.join(df_buffer, how='left')
   return shapely2x(df, geo_format, geometry=buffer_geometry)
 
 
-def spatial_agg(df: pd.DataFrame,
-                polygon_df: pd.DataFrame,
+def spatial_agg(df: (pd.DataFrame, str),
+                polygon_df: (pd.DataFrame, PolygonTagger),
                 by: Union[str, List[str]],
                 agg: dict,
-                c_polygon_geometry: str = 'geometry') -> pd.DataFrame:
+                c_polygon_geometry: str = 'geometry',
+                *,
+                chunk_size: int = None,
+                predicate: str = 'intersects',
+                first_match: bool = False,
+                c_priority: str = None,
+                c_lng: str = 'lng',
+                c_lat: str = 'lat',
+                c_geometry: str = 'geometry',
+                warning: bool = True) -> pd.DataFrame:
   """
   对面数据覆盖范围内的点数据进行空间统计
 
   Args:
-    df: 点数据dataframe;
-    polygon_df: 面数据dataframe;
+    df: 点数据dataframe，也可以传入点数据文件路径或按块产生dataframe的迭代器，
+      此时按块流式统计;
+    polygon_df: 面数据dataframe，也可以传入预先构建的 PolygonTagger;
     by: 空间统计单位字段；
     agg: 空间统计操作。格式为{'被统计字段名': '操作名', ...}的字典。如{'poi':'sum'};
     c_polygon_geometry: 面数据geometry字段名，默认"geometry";
+    chunk_size: 流式统计时每块的行数，指定时不再给每个点关联标签，而是逐块查询
+      空间索引并累计每个统计单位的统计量，内存占用与点数据量无关。
+      流式统计支持的操作为 count、sum、mean、min、max 及近似去重计数 nunique_approx;
+    predicate: 空间关系，默认 'intersects'，仅流式统计时有效;
+    first_match: 每个点是否最多统计到一个面中，仅流式统计时有效;
+    c_priority: 面数据的优先级列，仅first_match为True时有效;
+    c_lng: 点数据的经度列名，仅流式统计时有效;
+    c_lat: 点数据的纬度列名，仅流式统计时有效;
+    c_geometry: 点数据的geometry列名，仅流式统计时有效;
+    warning: 是否输出警告信息;
   Returns:
     pd.DataFrame, 包含空间统计单位字段和被统计字段和面数据geometry的DataFrame
   """
-
-  polygon_df = polygon_df[[by, c_polygon_geometry]]
+  if chunk_size or not isinstance(df, pd.DataFrame):
+    return _spatial_agg_streaming(
+        df, polygon_df, by, agg,
+        chunk_size=chunk_size or 1_000_000,
+        predicate=predicate,
+        first_match=first_match,
+        c_priority=c_priority,
+        c_lng=c_lng,
+        c_lat=c_lat,
+        c_geometry=c_geometry,
+        c_polygon_geometry=c_polygon_geometry,
+        warning=warning,
+    )
+  if not isinstance(polygon_df, PolygonTagger):
+    polygon_df = polygon_df[[*ensure_list(by), c_polygon_geometry]]
   df = mark_tags_v2(
       df=df,
       polygon_df=polygon_df,
@@ -802,6 +1641,56 @@ def spatial_agg(df: pd.DataFrame,
   return df_grouped
 
 
+def _spatial_agg_streaming(df, polygon_df, by, agg, *, chunk_size,
+                           predicate, first_match, c_priority,
+                           c_lng, c_lat, c_geometry, c_polygon_geometry,
+                           warning):
+  """按块查询空间索引并累计统计量，结果与 spatial_agg 的非流式结果一致"""
+  by = ensure_list(by)
+  if isinstance(df, pd.DataFrame):
+    chunks = df_iter(df, chunksize=chunk_size)
+  elif isinstance(df, str):
+    chunks = _iter_file_chunks(df, chunk_size)
+  else:
+    chunks = df
+  tagger = polygon_df
+  if not isinstance(tagger, PolygonTagger):
+    tagger = _build_tagger(polygon_df, by, c_priority, c_polygon_geometry)
+  # 统计单位编号，与groupby(sort=True)的顺序一致，统计单位为空的面编号为-1
+  codes = tagger.tags.groupby(by, sort=True).ngroup()
+  codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+  keys = tagger.tags.loc[codes >= 0, by].assign(_code=codes[codes >= 0])
+  keys = keys.drop_duplicates('_code').sort_values('_code')[by]
+  acc = GroupAccumulator(len(keys), agg)
+  cols = list(agg)
+
+  start, rows = time.perf_counter(), 0
+  for i, chunk in enumerate(chunks):
+    if chunk.empty:
+      continue
+    _df = ensure_geometry(chunk, True, warning and i == 0,
+                          lng=c_lng, lat=c_lat, geometry=c_geometry)
+    if i == 0:
+      tagger.check_crs(_df.crs, warning)
+    idx_geom, idx_poly = tagger.match(
+        _df[c_geometry].values, predicate,
+        first_match=first_match, c_priority=c_priority,
+    )
+    acc.update(codes[idx_poly], chunk[cols].iloc[idx_geom])
+    rows += len(chunk)
+  cost = time.perf_counter() - start
+  warn_(f'spatial_agg: {rows}行，耗时{cost:.2f}秒，'
+        f'{rows / max(cost, 1e-9):.0f}行/秒', warning, mode='logging')
+
+  # 只输出有数据的统计单位，列名与groupby(...).agg(agg)的结果一致
+  groups = np.flatnonzero(acc.size > 0)
+  multi = any(isinstance(v, (list, tuple)) for v in agg.values())
+  res = {(c, '') if multi else c: keys[c].to_numpy()[groups] for c in by}
+  for (c, func), values in acc.result(groups).items():
+    res[(c, func) if multi else c] = values
+  return pd.DataFrame(res)
+
+
 def split_multi_to_rows(df, geometry='geometry', geometry_format=None):
   """将多部件要素拆解为多行的单部件要素"""
 
@@ -836,6 +1725,17 @@ def get_projection_xy(
   """
   assert df.index.is_unique, '数据索引必须唯一'
   df_temp = auto2shapely(df)
+  geoms = np.asarray(df_temp.geometry.values, dtype=object)
+  if (shapely.get_type_id(geoms) <= 0).all():
+    # 点数据直接对坐标进行批量投影
+    lng, lat = shapely.get_x(geoms), shapely.get_y(geoms)
+    x, y = project_lnglat(
+        lng, lat,
+        crs_from=df_temp.crs or 4326,
+        crs_to=_projection_crs(lng, epsg=epsg, city=city, crs=crs),
+    )
+    df_temp = pd.DataFrame({c_x: x, c_y: y}, index=df_temp.index)
+    return df.join(df_temp)
   df_temp = projection(df_temp, epsg=epsg, city=city, crs=crs)
   df_temp[c_x] = df_temp.centroid.x
   df_temp[c_y] = df_temp.centroid.y
@@ -0,0 +1,525 @@
+"""
+可复用、可持久化的面数据打标签索引
+
+同一套面数据（行政区、板块等）反复给不同批次的点数据打标签时，每次调用 mark_tags_v2
+都会重新解析面数据并重建空间索引。PolygonTagger 只在创建时解析一次面数据并构建
+STRtree，之后可直接传给 mark_tags_v2、spatial_agg 代替 polygon_df，每批数据只需进行
+点位查询。对于行政区、街镇等固定的面数据，GridIndex 进一步预先计算栅格索引，
+大部分点位通过数组查找即可确定所在的面：
+
+Examples:
+  >>> tagger = PolygonTagger(polygon_df, c_tags='板块')  # doctest: +SKIP
+  >>> tagger.save('板块.tagger')  # doctest: +SKIP
+  >>> tagger = PolygonTagger.load('板块.tagger')  # doctest: +SKIP
+  >>> df = mark_tags_v2(df, tagger)  # doctest: +SKIP
+  >>> grid = GridIndex(Rc.street(), c_tags='街镇')  # doctest: +SKIP
+  >>> grid.save('街镇.npz')  # doctest: +SKIP
+  >>> df = mark_tags_v2(df, GridIndex.load('街镇.npz'))  # doctest: +SKIP
+"""
+import numpy as np
+import pandas as pd
+import shapely
+
+from ..base import ensure_list
+from ..base import warn_
+
+# predicate(a, b) 与 predicate(b, a) 的对应关系，用于以预处理过的面数据作为主体进行判断
+_REVERSED_PREDICATES = {
+  'intersects': 'intersects',
+  'within': 'contains',
+  'contains': 'within',
+  'covered_by': 'covers',
+  'covers': 'covered_by',
+  'touches': 'touches',
+  'crosses': 'crosses',
+  'overlaps': 'overlaps',
+}
+
+
+class PolygonTagger:
+  """
+  面数据打标签索引，持有解析后的面数据、标签及STRtree
+
+  Args:
+    polygon_df: 面数据
+    c_tags: 要关联的标签列，为空时为除geometry列外的全部列
+    c_polygon_geometry: 面数据的geometry列名
+  """
+
+  def __init__(self,
+               polygon_df: pd.DataFrame,
+               c_tags: (list, str) = None,
+               c_polygon_geometry: str = 'geometry'):
+    from .df import auto2shapely
+
+    polygon_df = auto2shapely(polygon_df, geometry=c_polygon_geometry)
+    c_tags = ensure_list(c_tags) or [
+      c for c in polygon_df.columns if c != c_polygon_geometry
+    ]
+    self._init(
+        geoms=polygon_df[c_polygon_geometry].values,
+        tags=polygon_df[c_tags],
+        crs=polygon_df.crs,
+    )
+
+  def _init(self, geoms, tags: pd.DataFrame, crs=None):
+    self.geoms = np.asarray(geoms, dtype=object)
+    self.tags = pd.DataFrame(tags).reset_index(drop=True)
+    self.c_tags = self.tags.columns.to_list()
+    self.crs = crs
+    self._rank_cache = {}
+    shapely.prepare(self.geoms)
+    self.tree = shapely.STRtree(self.geoms)
+
+  def __len__(self):
+    return len(self.geoms)
+
+  def _query(self, geoms, predicate: str = 'intersects'):
+    """查询满足空间关系的几何对象及面数据的行号，结果未排序"""
+    geoms = np.asarray(geoms, dtype=object)
+    if reversed_predicate := _REVERSED_PREDICATES.get(predicate):
+      # STRtree只对查询的几何对象做预处理，先按外接矩形筛选，
+      # 再以预处理过的面数据为主体判断空间关系
+      idx_geom, idx_poly = self.tree.query(geoms)
+      mask = getattr(shapely, reversed_predicate)(
+          self.geoms[idx_poly], geoms[idx_geom]
+      )
+      return idx_geom[mask], idx_poly[mask]
+    return self.tree.query(geoms, predicate=predicate)
+
+  def query(self, geoms, predicate: str = 'intersects'):
+    """
+    查询与面数据满足空间关系的几何对象，空间关系为 predicate(geoms, 面数据)，
+    与 sjoin 中 predicate 的含义一致
+
+    Args:
+      geoms: 要查询的几何对象数组，一般为点数据
+      predicate: 空间关系，默认 'intersects'
+
+    Returns:
+      匹配到的几何对象的行号数组及面数据的行号数组，按几何对象的行号排序。
+      同一几何对象的多个匹配结果与 sjoin 的顺序相同：按STRtree的查询顺序排列，
+      predicate为'within'时 sjoin 以面数据查询点数据，按面数据的行号排列
+    """
+    idx_geom, idx_poly = self._query(geoms, predicate)
+    if predicate == 'within':
+      order = np.lexsort((idx_poly, idx_geom))
+    else:
+      order = np.argsort(idx_geom, kind='stable')
+    return idx_geom[order], idx_poly[order]
+
+  def _ranks(self, c_priority: str = None) -> np.ndarray:
+    """面数据的优先级排名，值越小越优先，未指定优先级列时面积越小越优先"""
+    if (ranks := self._rank_cache.get(c_priority)) is None:
+      if c_priority:
+        assert c_priority in self.tags, f'优先级列“{c_priority}”不在标签列中'
+        key = self.tags[c_priority]
+      else:
+        key = pd.Series(shapely.area(self.geoms))
+      ranks = key.rank(method='first', na_option='bottom').to_numpy()
+      self._rank_cache[c_priority] = ranks
+    return ranks
+
+  def first(self,
+            geoms,
+            c_priority: str = None,
+            predicate: str = 'intersects') -> np.ndarray:
+    """
+    每个几何对象最多匹配一个面，匹配到多个面时按优先级选取
+
+    Args:
+      geoms: 要查询的几何对象数组，一般为点数据
+      c_priority: 优先级列，值越小越优先，为空时面积越小越优先
+      predicate: 空间关系，默认 'intersects'
+
+    Returns:
+      每个几何对象匹配到的面数据的行号，未匹配到时为-1
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    idx_geom, idx_poly = self._query(geoms, predicate)
+    res = np.full(len(geoms), -1)
+    if not len(idx_geom):
+      return res
+    order = np.lexsort((self._ranks(c_priority)[idx_poly], idx_geom))
+    idx_geom, idx_poly = idx_geom[order], idx_poly[order]
+    first = np.r_[True, idx_geom[1:] != idx_geom[:-1]]
+    res[idx_geom[first]] = idx_poly[first]
+    return res
+
+  def match(self,
+            geoms,
+            predicate: str = 'intersects',
+            first_match: bool = False,
+            c_priority: str = None):
+    """
+    查询匹配到的几何对象及面数据的行号，未匹配到的几何对象不出现在结果中
+
+    Args:
+      geoms: 要查询的几何对象数组，一般为点数据
+      predicate: 空间关系，默认 'intersects'
+      first_match: 是否仅匹配一个面，参考 first 方法
+      c_priority: 优先级列，仅first_match为True时有效
+
+    Returns:
+      匹配到的几何对象的行号数组及面数据的行号数组，按几何对象的行号排序
+    """
+    if first_match:
+      polys = self.first(geoms, c_priority=c_priority, predicate=predicate)
+      rows = np.flatnonzero(polys >= 0)
+      return rows, polys[rows]
+    return self.query(geoms, predicate=predicate)
+
+  def join(self,
+           geoms,
+           index: pd.Index = None,
+           c_tags: (list, str) = None,
+           predicate: str = 'intersects',
+           first_match: bool = False,
+           c_priority: str = None) -> pd.DataFrame:
+    """
+    以左连接的方式获取每个几何对象关联到的标签：匹配到多个面时返回多行，
+    顺序参考 query 方法，未匹配到时返回一行空值
+
+    Args:
+      geoms: 要查询的几何对象数组，一般为点数据
+      index: 结果使用的索引，长度与geoms相同，默认为行号
+      c_tags: 要关联的标签列，默认为全部标签列
+      predicate: 空间关系，默认 'intersects'
+      first_match: 是否仅匹配一个面，为True时结果与geoms一一对应，参考 first 方法
+      c_priority: 优先级列，仅first_match为True时有效
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    index = pd.RangeIndex(len(geoms)) if index is None else index
+    c_tags = ensure_list(c_tags) or self.c_tags
+    if first_match:
+      polys = self.first(geoms, c_priority=c_priority, predicate=predicate)
+      return self._take_tags(np.arange(len(geoms)), polys, index, c_tags)
+    idx_geom, idx_poly = self.query(geoms, predicate=predicate)
+    return self._left_join(len(geoms), idx_geom, idx_poly, index, c_tags)
+
+  def _take_tags(self, rows, polys, index, c_tags) -> pd.DataFrame:
+    """按面数据的行号取出标签，行号为-1时为空值，结果使用 index[rows] 作为索引"""
+    result = self.tags[c_tags].reindex(polys)
+    result.index = index[rows]
+    return result
+
+  def _left_join(self, n, idx_geom, idx_poly, index, c_tags) -> pd.DataFrame:
+    """
+    将匹配结果组织为左连接的形式，未匹配到的行保留一行空值
+
+    Args:
+      n: 几何对象的个数
+      idx_geom: 匹配到的几何对象的行号，需已按几何对象的行号排序
+      idx_poly: 匹配到的面数据的行号
+      index: 结果使用的索引
+      c_tags: 要关联的标签列
+    """
+    unmatched = np.flatnonzero(np.bincount(idx_geom, minlength=n) == 0)
+    rows = np.concatenate([idx_geom, unmatched])
+    polys = np.concatenate([idx_poly, np.full(len(unmatched), -1)])
+    order = np.argsort(rows, kind='stable')
+    return self._take_tags(rows[order], polys[order], index, c_tags)
+
+  def check_crs(self, crs, warning=True):
+    """检查点数据与面数据的坐标系是否一致"""
+    if self.crs is not None and crs is not None and self.crs != crs:
+      warn_(f'坐标系不一致：{crs} 与 {self.crs}', warning)
+
+  def save(self, filepath):
+    """
+    保存到文件，仅保存面数据的WKB及标签，加载时重新构建STRtree
+
+    Args:
+      filepath: 文件路径，支持pandas.to_pickle的压缩格式后缀，如“.gz”
+    """
+    pd.to_pickle({
+      'wkb': shapely.to_wkb(self.geoms),
+      'tags': self.tags,
+      'crs': self.crs.to_wkt() if self.crs is not None else None,
+    }, filepath)
+
+  @classmethod
+  def load(cls, filepath) -> 'PolygonTagger':
+    """从文件加载"""
+    from pyproj import CRS
+    data = pd.read_pickle(filepath)
+    tagger = cls.__new__(cls)
+    tagger._init(
+        geoms=shapely.from_wkb(data['wkb']),
+        tags=data['tags'],
+        crs=CRS.from_user_input(data['crs']) if data['crs'] else None,
+    )
+    return tagger
+
+
+# 栅格的取值：面数据的行号，或以下两种特殊值
+_CELL_EMPTY = -1  # 不与任何面相交
+_CELL_BOUNDARY = -2  # 位于面的边界上或与多个面相交，需精确判断
+# 点位于栅格内部时，以下空间关系可直接由栅格确定
+_GRID_PREDICATES = ('intersects', 'within', 'covered_by')
+
+
+class GridIndex(PolygonTagger):
+  """
+  面数据的栅格索引，适用于行政区、街镇等固定不变的面数据。
+
+  将面数据的范围划分为等大的栅格，完全位于某个面内部的栅格直接记录该面的行号，
+  点位落在这类栅格中时通过数组查找即可确定所在的面；只有落在边界栅格中的点位
+  才需要进行精确的空间关系判断。可以代替 PolygonTagger 传给 mark_tags_v2、
+  spatial_agg，结果与 PolygonTagger 一致。
+
+  Args:
+    polygon_df: 面数据
+    c_tags: 要关联的标签列，为空时为除geometry列外的全部列
+    cell_size: 栅格的边长，单位与面数据的坐标系一致，为空时根据max_cells自动确定
+    max_cells: 自动确定栅格大小时栅格数量的上限
+    c_polygon_geometry: 面数据的geometry列名
+  """
+
+  def __init__(self,
+               polygon_df: pd.DataFrame,
+               c_tags: (list, str) = None,
+               cell_size: float = None,
+               max_cells: int = 4_000_000,
+               c_polygon_geometry: str = 'geometry'):
+    super().__init__(polygon_df, c_tags, c_polygon_geometry)
+    self._build_grid(cell_size, max_cells)
+
+  def _build_grid(self, cell_size=None, max_cells=4_000_000):
+    """
+    构建栅格。从粗到细逐级划分：整块为空或完全位于一个面内部时直接填充，
+    否则将其四等分后继续判断，只有边界附近的栅格会被细分到最小尺寸
+    """
+    minx, miny, maxx, maxy = shapely.total_bounds(self.geoms)
+    assert np.isfinite(minx), '面数据为空，无法构建栅格'
+    width, height = max(maxx - minx, 1e-9), max(maxy - miny, 1e-9)
+    cell_size = cell_size or np.sqrt(width * height / max_cells)
+    nx = int(np.ceil(width / cell_size))
+    ny = int(np.ceil(height / cell_size))
+    self.origin = np.array([minx, miny])
+    self.cell_size = float(cell_size)
+
+    # 面的全部边界（含内环）拆分为线段，与线段相交的栅格块即为边界
+    rings = shapely.get_rings(shapely.get_parts(self.geoms))
+    coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+    same = ring_idx[1:] == ring_idx[:-1]
+    edges = np.stack([coords[:-1][same], coords[1:][same]], axis=1)
+    edge_tree = shapely.STRtree(shapely.linestrings(edges))
+
+    size = 2 ** max(0, int(np.ceil(np.log2(max(nx, ny) / 64))))
+    # 栅格的行列数补齐为最大块的整数倍，便于按块整体填充
+    grid = np.full(
+        (-(-ny // size) * size, -(-nx // size) * size), _CELL_EMPTY,
+        dtype=np.int32,
+    )
+    rows, cols = (
+      i.ravel() for i in np.meshgrid(
+        np.arange(0, ny, size), np.arange(0, nx, size), indexing='ij')
+    )
+    while len(rows):
+      labels = self._classify_blocks(rows, cols, size, edges, edge_tree)
+      blocks = grid.reshape(grid.shape[0] // size, size, -1, size)
+      inner = labels >= 0
+      blocks[rows[inner] // size, :, cols[inner] // size, :] = (
+        labels[inner, None, None]
+      )
+      boundary = labels == _CELL_BOUNDARY
+      rows, cols = rows[boundary], cols[boundary]
+      if size == 1:
+        grid[rows, cols] = _CELL_BOUNDARY
+        break
+      size //= 2
+      rows = np.concatenate([rows, rows, rows + size, rows + size])
+      cols = np.concatenate([cols, cols + size, cols, cols + size])
+      keep = (rows < ny) & (cols < nx)
+      rows, cols = rows[keep], cols[keep]
+    self.grid = np.ascontiguousarray(grid[:ny, :nx])
+
+  def _classify_blocks(self, rows, cols, size, edges, edge_tree,
+                       batch=200_000) -> np.ndarray:
+    """
+    判断栅格块的取值：与面的边界相交时为边界，否则栅格块整体位于面的内部或外部，
+    由中心点所在的面确定，中心点位于多个重叠的面中时也视为边界
+    """
+    labels = np.empty(len(rows), dtype=np.int64)
+    # 将栅格块略微放大，避免点位恰好落在栅格边线上时因浮点误差出错
+    eps = self.cell_size * 1e-6
+    length = size * self.cell_size
+    for start in range(0, len(rows), batch):
+      sl = slice(start, start + batch)
+      x0 = self.origin[0] + cols[sl] * self.cell_size - eps
+      y0 = self.origin[1] + rows[sl] * self.cell_size - eps
+      x1, y1 = x0 + length + 2 * eps, y0 + length + 2 * eps
+      # 外接矩形相交的线段中，栅格块的四个角不全在线段同一侧的才与栅格块相交
+      idx_cell, idx_edge = edge_tree.query(shapely.box(x0, y0, x1, y1))
+      (ax, ay), (bx, by) = edges[idx_edge, 0].T, edges[idx_edge, 1].T
+      side = [
+        np.sign((bx - ax) * (y[idx_cell] - ay) - (by - ay) * (x[idx_cell] - ax))
+        for x, y in ((x0, y0), (x0, y1), (x1, y0), (x1, y1))
+      ]
+      crossed = np.abs(sum(side)) < 4
+      on_edge = np.bincount(
+          idx_cell[crossed], minlength=len(x0)
+      ) > 0
+      res = np.full(len(x0), _CELL_BOUNDARY)
+      inner = np.flatnonzero(~on_edge)
+      idx_point, idx_poly = self._query(shapely.points(
+          x0[inner] + eps + length / 2, y0[inner] + eps + length / 2
+      ))
+      count = np.bincount(idx_point, minlength=len(inner))
+      res[inner[count == 0]] = _CELL_EMPTY
+      single = count[idx_point] == 1
+      res[inner[idx_point[single]]] = idx_poly[single]
+      labels[sl] = res
+    return labels
+
+  @property
+  def boundary_ratio(self) -> float:
+    """需要精确判断的边界栅格占全部非空栅格的比例"""
+    boundary = (self.grid == _CELL_BOUNDARY).sum()
+    return boundary / max((self.grid != _CELL_EMPTY).sum(), 1)
+
+  def _cell_labels(self, lng, lat) -> np.ndarray:
+    """查询点位所在栅格的取值，超出范围或经纬度为空时为-1"""
+    lng, lat = np.asarray(lng, dtype=float), np.asarray(lat, dtype=float)
+    col = np.floor((lng - self.origin[0]) / self.cell_size)
+    row = np.floor((lat - self.origin[1]) / self.cell_size)
+    ny, nx = self.grid.shape
+    valid = (col >= 0) & (col < nx) & (row >= 0) & (row < ny)
+    labels = np.full(lng.shape, _CELL_EMPTY, dtype=np.int64)
+    labels[valid] = self.grid[row[valid].astype(int), col[valid].astype(int)]
+    return labels
+
+  def _geom_labels(self, geoms) -> np.ndarray:
+    """查询几何对象所在栅格的取值，非点数据需精确判断"""
+    labels = self._cell_labels(shapely.get_x(geoms), shapely.get_y(geoms))
+    labels[shapely.get_type_id(geoms) > 0] = _CELL_BOUNDARY
+    return labels
+
+  def lookup(self,
+             lng,
+             lat,
+             c_priority: str = None,
+             predicate: str = 'intersects') -> np.ndarray:
+    """
+    批量查询经纬度所在的面，每个点位最多匹配一个面，参考 PolygonTagger.first
+
+    Args:
+      lng: 经度数组
+      lat: 纬度数组
+      c_priority: 优先级列，值越小越优先，为空时面积越小越优先
+      predicate: 空间关系，默认 'intersects'
+
+    Returns:
+      每个点位匹配到的面数据的行号，未匹配到时为-1
+    """
+    lng, lat = np.asarray(lng, dtype=float), np.asarray(lat, dtype=float)
+    if predicate not in _GRID_PREDICATES:
+      return self.first(shapely.points(lng, lat), c_priority, predicate)
+    labels = self._cell_labels(lng, lat)
+    if len(sub := np.flatnonzero(labels == _CELL_BOUNDARY)):
+      labels[sub] = self.first(
+          shapely.points(lng[sub], lat[sub]), c_priority, predicate
+      )
+    return labels
+
+  def join(self,
+           geoms,
+           index: pd.Index = None,
+           c_tags: (list, str) = None,
+           predicate: str = 'intersects',
+           first_match: bool = False,
+           c_priority: str = None) -> pd.DataFrame:
+    """以左连接的方式获取每个几何对象关联到的标签，参考 PolygonTagger.join"""
+    if predicate not in _GRID_PREDICATES:
+      return super().join(
+          geoms, index, c_tags, predicate, first_match, c_priority
+      )
+    geoms = np.asarray(geoms, dtype=object)
+    index = pd.RangeIndex(len(geoms)) if index is None else index
+    c_tags = ensure_list(c_tags) or self.c_tags
+    if first_match:
+      labels = self._first_labels(geoms, c_priority, predicate)
+      return self._take_tags(np.arange(len(geoms)), labels, index, c_tags)
+    idx_geom, idx_poly = self.match(geoms, predicate)
+    return self._left_join(len(geoms), idx_geom, idx_poly, index, c_tags)
+
+  def _first_labels(self, geoms, c_priority=None, predicate='intersects'):
+    """每个几何对象最多匹配一个面，边界栅格中的几何对象精确判断"""
+    labels = self._geom_labels(geoms)
+    sub = np.flatnonzero(labels == _CELL_BOUNDARY)
+    labels[sub] = self.first(geoms[sub], c_priority, predicate)
+    return labels
+
+  def match(self,
+            geoms,
+            predicate: str = 'intersects',
+            first_match: bool = False,
+            c_priority: str = None):
+    """查询匹配到的几何对象及面数据的行号，参考 PolygonTagger.match"""
+    if predicate not in _GRID_PREDICATES:
+      return super().match(geoms, predicate, first_match, c_priority)
+    geoms = np.asarray(geoms, dtype=object)
+    if first_match:
+      labels = self._first_labels(geoms, c_priority, predicate)
+      rows = np.flatnonzero(labels >= 0)
+      return rows, labels[rows]
+    # 内部栅格中的点位只匹配一个面，边界栅格中的点位按精确判断的结果匹配
+    labels = self._geom_labels(geoms)
+    sub = np.flatnonzero(labels == _CELL_BOUNDARY)
+    inner = np.flatnonzero(labels >= 0)
+    idx_geom, idx_poly = self.query(geoms[sub], predicate)
+    rows = np.concatenate([inner, sub[idx_geom]])
+    polys = np.concatenate([labels[inner], idx_poly])
+    order = np.argsort(rows, kind='stable')
+    return rows[order], polys[order]
+
+  def save(self, filepath):
+    """
+    保存为numpy的.npz文件，包括栅格、面数据的WKB及标签，加载时重新构建STRtree
+
+    Args:
+      filepath: 文件路径，扩展名为“.npz”
+    """
+    wkb = shapely.to_wkb(self.geoms)
+    sizes = np.array([len(i) if i is not None else -1 for i in wkb])
+    np.savez_compressed(
+        filepath,
+        grid=self.grid,
+        origin=self.origin,
+        cell_size=self.cell_size,
+        wkb=np.frombuffer(b''.join(i for i in wkb if i is not None), np.uint8),
+        wkb_sizes=sizes,
+        tags=self.tags.to_json(orient='split', force_ascii=False),
+        crs=self.crs.to_wkt() if self.crs is not None else '',
+    )
+
+  @classmethod
+  def load(cls, filepath) -> 'GridIndex':
+    """从.npz文件加载"""
+    from io import StringIO
+    from pyproj import CRS
+
+    with np.load(filepath) as data:
+      sizes = data['wkb_sizes']
+      offsets = np.r_[0, np.cumsum(np.maximum(sizes, 0))]
+      buffer = data['wkb'].tobytes()
+      wkb = np.array([
+        buffer[offsets[i]:offsets[i + 1]] if size >= 0 else None
+        for i, size in enumerate(sizes)
+      ], dtype=object)
+      tags = pd.read_json(
+          StringIO(str(data['tags'])), orient='split',
+          dtype=False, convert_dates=False,
+      )
+      crs = str(data['crs'])
+      index = cls.__new__(cls)
+      index._init(
+          geoms=shapely.from_wkb(wkb),
+          tags=tags,
+          crs=CRS.from_user_input(crs) if crs else None,
+      )
+      index.grid = data['grid']
+      index.origin = data['origin']
+      index.cell_size = float(data['cell_size'])
+    return index
@@ -1,11 +1,11 @@
 import warnings
-from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from shapely.errors import ShapelyDeprecationWarning
-from shapely.geometry import MultiPolygon
-from tqdm import tqdm
 
 from ..util.assertion import assert_not_null
 from ..util.assertion import assert_subset
@@ -22,109 +22,197 @@ _desc = '''
 '''
 
 
-def is_topology_valid(df: gpd.GeoDataFrame, c_geometry='geometry'):
+def _overlap_pairs(geoms):
+  """
+  使用STRtree批量查询内部相交（不含仅边界接触）的面
+
+  Returns:
+    行号对 (left, right)，left < right，按行号排序
+  """
+  geoms = np.asarray(geoms, dtype=object)
+  left, right = shapely.STRtree(geoms).query(geoms, predicate='intersects')
+  keep = left < right
+  left, right = left[keep], right[keep]
+  # 外包矩形仅边界接触的两个面内部不可能相交，先排除以减少relate的计算量
+  bounds = shapely.bounds(geoms)
+  lo = np.maximum(bounds[left, :2], bounds[right, :2])
+  hi = np.minimum(bounds[left, 2:], bounds[right, 2:])
+  keep = (hi > lo).all(axis=1)
+  left, right = left[keep], right[keep]
+  keep = shapely.relate_pattern(geoms[left], geoms[right], 'T********')
+  left, right = left[keep], right[keep]
+  order = np.lexsort((right, left))
+  return left[order], right[order]
+
+
+def is_topology_valid(df: gpd.GeoDataFrame,
+                      c_geometry='geometry',
+                      report: bool = False):
   """
   判断整列geometry是否规范, 仅支持面数据，
     * 检查geometry是否有空值，
     * 检查每个geometry是否存在拓扑问题，
-    * 检查整列geometry之间是否存在拓扑问题
+    * 检查整列geometry之间是否存在重叠（内部相交，仅边界接触的不算）
 
   Args:
     df: 需要进行拓扑修复的GeoDataFrame
     c_geometry: geometry列名
+    report: 是否返回问题明细，为True时返回包含 left、right、overlap_area 列的DataFrame，
+      left、right为重叠的两个面的索引，overlap_area为重叠面积（单位与坐标一致）；
+      自身不合法的面以 left、right 相同、overlap_area 为空的行输出
 
   Returns:
-    geometry数据是否规范
+    geometry数据是否规范，report为True时返回问题明细
   """
   df = auto2shapely(df, geometry=c_geometry)
   assert_not_null(df, c_geometry)
   assert_subset(df.geom_type.unique(), {'Polygon', 'MultiPolygon'})
 
-  if not all(df.is_valid):
+  geoms = np.asarray(df[c_geometry].values, dtype=object)
+  valid = shapely.is_valid(geoms)
+  if not report and not valid.all():
     return False
+  if not valid.all():
+    geoms = geoms.copy()
+    geoms[~valid] = shapely.make_valid(geoms[~valid])
+  left, right = _overlap_pairs(geoms)
+  if not report:
+    return not len(left)
+
+  invalid = np.flatnonzero(~valid)
+  area = shapely.area(shapely.intersection(geoms[left], geoms[right]))
+  return pd.DataFrame({
+    'left': df.index[np.r_[invalid, left]],
+    'right': df.index[np.r_[invalid, right]],
+    'overlap_area': np.r_[np.full(len(invalid), np.nan), area],
+  })
+
+
+def _gather_csr(ind, offsets, rows):
+  """取出CSR结构中指定行的全部元素，返回元素及其所属的行在rows中的位置"""
+  counts = offsets[rows + 1] - offsets[rows]
+  owner = np.repeat(np.arange(len(rows)), counts)
+  start = np.repeat(offsets[rows] - np.cumsum(counts) + counts, counts)
+  return ind[start + np.arange(counts.sum())], owner
+
+
+def _union_groups(geoms, owner, distance: float = 0):
+  """
+  按owner分组合并面（合并前各自缓冲distance），owner须已排序
+
+  Returns:
+    非空分组的编号及对应的合并结果
+  """
+  groups, owner = np.unique(owner, return_inverse=True)
+  collections = shapely.geometrycollections(geoms, indices=owner)
+  return groups, shapely.buffer(collections, distance)
 
-  n = df.shape[0]
-  for x, y in tqdm(combinations(df.geometry, 2), total=n * (n - 1) / 2,
-                   desc='topology check'):
-    if x.intersects(y):
-      return False
-  return True
+
+def _repair_overlaps(geoms, nbr_ind, nbr_offsets, members,
+                     fill_intersects=True, keep_contains=True):
+  """
+  修复一组面之间的重叠，members须包含若干个完整的重叠连通分量
+
+  Args:
+    geoms: 全部的面
+    nbr_ind: CSR形式的重叠关系，nbr_ind[nbr_offsets[i]:nbr_offsets[i+1]]为与第i个面重叠的面
+    nbr_offsets: CSR形式的偏移量
+    members: 要修复的面的行号，升序排列
+
+  Returns:
+    行号及修复后的面
+  """
+  res_pos, res_geom = [], []
+  while len(members):
+    in_set = np.zeros(len(geoms), dtype=bool)
+    in_set[members] = True
+    nbr, owner = _gather_csr(nbr_ind, nbr_offsets, members)
+    keep = in_set[nbr]
+    nbr, owner = nbr[keep], owner[keep]
+
+    contained = np.zeros(len(members), dtype=bool)
+    if keep_contains and len(nbr):
+      groups, union = _union_groups(geoms[nbr], owner)
+      contained[groups] = shapely.contains(union, geoms[members[groups]])
+
+    # fill_intersects 时重叠的部分保留在更靠后的面内，即跳过已处理的面
+    rank = np.searchsorted(members, nbr)
+    skip = fill_intersects & ~contained[rank] & (rank < owner)
+    sub = ~contained[owner] & ~skip
+    kept = np.flatnonzero(~contained)
+    res = geoms[members[kept]].copy()
+    if sub.any():
+      groups, union = _union_groups(geoms[nbr[sub]], owner[sub], 1e-7)
+      pos = np.searchsorted(kept, groups)
+      res[pos] = shapely.difference(res[pos], union)
+    res_pos.append(members[kept])
+    res_geom.append([filter_polygon_from_collection(g) for g in res])
+
+    if contained.all():
+      raise ValueError('mutual inclusion geometry')
+    # 被包含的面在下一轮中单独修复
+    members = members[contained]
+  return np.concatenate(res_pos), np.concatenate(res_geom)
 
 
 def _fix_topology(series: pd.Series,
                   fill_intersects=True,
-                  keep_contains=True):
+                  keep_contains=True,
+                  n_jobs: int = 1):
   """
   Args:
     series: series的index不能重复, 如果keep_contains=True,geometry不能相互包含
     fill_intersects: 是否填满相交的区域，如果为True的话，两个面相交的区域会分配到更靠后的面内
     keep_contains: fill_intersects为True时才有效，即是否强制保留被包含的面
+    n_jobs: 并行修复的线程数，按重叠关系的连通分量分组
   """
-
-  def ser_intersect(geo_ser: pd.Series):
-    intersect_info = {index: {'intersect_list': [], 'is_contains': False}
-                      for index in geo_ser.index}
-    size = geo_ser.shape[0]
-    for index_x, index_y in tqdm(combinations(geo_ser.index, 2),
-                                 total=size * (size - 1) / 2,
-                                 desc='intersect info'):
-      geo_x = geo_ser.loc[index_x]
-      geo_y = geo_ser.loc[index_y]
-      if geo_x.intersects(geo_y):
-        intersect_info[index_x]['intersect_list'].append(index_y)
-        intersect_info[index_y]['intersect_list'].append(index_x)
-
-    for index, info in tqdm(intersect_info.items(),
-                            total=len(intersect_info.keys()),
-                            desc='contains info'):
-      intersect_list = info['intersect_list']
-      polygon = MultiPolygon()
-      for i in intersect_list:
-        polygon = polygon.union(series.loc[i])
-      intersect_info[index]['is_contains'] = polygon.contains(series.loc[index])
-    return intersect_info
-
-  def fix_intersects(geo_ser: pd.Series):
-    intersect_info = ser_intersect(geo_ser)
-    res_geo = []
-    res_index = []
-    contains_geo = []
-    contains_index = []
-    for index, geo in tqdm(geo_ser.items(),
-                           desc='fix_intersects',
-                           total=len(geo_ser)):
-      info = intersect_info.get(index)
-      intersect_list = info.get('intersect_list')
-      if info.get('is_contains') and keep_contains:
-        contains_geo.append(geo)
-        contains_index.append(index)
-      else:
-        for i in intersect_list:
-          if fill_intersects and i in res_index:
-            continue
-          geo = geo.difference(geo_ser.loc[i].buffer(1e-7))
-        res_geo.append(filter_polygon_from_collection(geo))
-        res_index.append(index)
-    intersect_res = pd.Series(res_geo, index=res_index)
-    if contains_index:
-      if set(contains_index) == set(geo_ser.index):
-        raise ValueError('mutual inclusion geometry')
-      contains_res = fix_intersects(pd.Series(contains_geo,
-                                              index=contains_index))
-      return pd.concat([intersect_res, contains_res])
-    else:
-      return intersect_res
+  from scipy.sparse import csr_matrix
+  from scipy.sparse.csgraph import connected_components
 
   assert series.is_unique, 'duplicated index'
-  series = series.apply(ensure_valid_polygon)
-  res = fix_intersects(series)
-  return res
+  geoms = np.asarray(series.values, dtype=object).copy()
+  invalid = np.flatnonzero(~shapely.is_valid(geoms))
+  geoms[invalid] = [ensure_valid_polygon(geoms[i]) for i in invalid]
+  n = len(geoms)
+  left, right = _overlap_pairs(geoms)
+  graph = csr_matrix(
+      (np.ones(2 * len(left)), (np.r_[left, right], np.r_[right, left])),
+      shape=(n, n),
+  )
+  graph.sort_indices()
+  _, labels = connected_components(graph, directed=False)
+
+  res = geoms.copy()
+  members = np.flatnonzero(np.diff(graph.indptr) > 0)
+  if not len(members):
+    return pd.Series(res, index=series.index)
+  # 按连通分量分组，同一分量的面在同一组内修复，各组之间互不影响
+  order = members[np.argsort(labels[members], kind='stable')]
+  n_batches = n_jobs * 4 if n_jobs > 1 else 1
+  comp_start = np.r_[True, labels[order][1:] != labels[order][:-1]]
+  batch = np.arange(len(order)) * n_batches // len(order)
+  batch = np.maximum.accumulate(np.where(comp_start, batch, 0))
+  batches = [np.sort(order[batch == i]) for i in np.unique(batch)]
+
+  def repair(rows):
+    return _repair_overlaps(geoms, graph.indices, graph.indptr, rows,
+                            fill_intersects, keep_contains)
+
+  if n_jobs > 1:
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+      results = list(executor.map(repair, batches))
+  else:
+    results = [repair(rows) for rows in batches]
+  for pos, fixed in results:
+    res[pos] = fixed
+  return pd.Series(res, index=series.index)
 
 
 def fix_topology(df: gpd.GeoDataFrame,
                  c_geometry='geometry',
                  fill_intersects=False,
-                 keep_contains=False) -> gpd.GeoDataFrame:
+                 keep_contains=False,
+                 n_jobs: int = 1) -> gpd.GeoDataFrame:
   """
   修复面地理数据的拓扑问题,index不能重复
 
@@ -133,6 +221,7 @@ def fix_topology(df: gpd.GeoDataFrame,
     c_geometry: geometry列列名
     fill_intersects: 是否填满相交的区域，如果为True的话，两个面相交的区域会随机分配到其中一个面内
     keep_contains: fill_intersects为True时才有效，即是否强制保留被包含的面
+    n_jobs: 并行修复的线程数，互相重叠的面会分到同一组内修复
 
   Returns:
     修复完拓扑问题的GeoDataFrame
@@ -142,5 +231,6 @@ def fix_topology(df: gpd.GeoDataFrame,
     return df
   df[c_geometry] = _fix_topology(df[c_geometry],
                                  fill_intersects,
-                                 keep_contains)
+                                 keep_contains,
+                                 n_jobs=n_jobs)
   return gpd.GeoDataFrame(df, crs=4326, geometry=c_geometry)
@@ -1,5 +1,6 @@
 import re
 import sys
+import threading
 import warnings
 from ast import literal_eval
 from functools import lru_cache
@@ -34,8 +35,12 @@ from ..util.decorator import check_str
 from ..util.district import norm_city_name
 from ..util.util import is_hex
 from ..util.util import isinstances
+from .cache import get_geometry_cache
 
 GEOM_FORMATS = ('wkb', 'wkt', 'shapely', 'geojson')
+DISTANCE_METHODS = ('haversine', 'geodesic', 'projection')
+EARTH_RADIUS = 6371008.8
+AUTO_PARTITION = 'auto-partition'
 
 
 def crs_sh2000():
@@ -59,15 +64,18 @@ def is_polygon(x: BaseGeometry):
   return isinstance(x, (Polygon, MultiPolygon))
 
 
+#: 文本形式的空geometry
+EMPTY_GEOM_STRINGS = (
+  '010700000000000000',
+  '0107000020E610000000000000',
+  'GEOMETRYCOLLECTION EMPTY',
+)
+
+
 def st_is_empty(x):
   """判断是否为空"""
-  _s = [
-    '010700000000000000',
-    '0107000020E610000000000000',
-    'GEOMETRYCOLLECTION EMPTY'
-  ]
   if isinstance(x, str):
-    if x in _s:
+    if x in EMPTY_GEOM_STRINGS:
       return True
   return is_empty(x)
 
@@ -86,6 +94,21 @@ def epsg_from_lnglat(lng, lat=0):
   return int(f'326{utm_band}' if lat >= 0 else f'327{utm_band}')
 
 
+def utm_epsg_array(lng, lat=None) -> np.ndarray:
+  """
+  向量化计算每个点所在的 UTM 区域 EPSG 代码，经纬度为空时为0
+
+  Args:
+    lng: 经度数组
+    lat: 纬度数组，为空时均按北半球处理
+  """
+  lng = np.asarray(lng, dtype=float)
+  lat = np.zeros_like(lng) if lat is None else np.asarray(lat, dtype=float)
+  valid = ~(np.isnan(lng) | np.isnan(lat))
+  zone = (np.floor((np.where(valid, lng, 0) + 180) / 6) % 60 + 1).astype(int)
+  return np.where(valid, np.where(lat >= 0, 32600, 32700) + zone, 0)
+
+
 def lng_from_city(city: str):
   """获取城市所在的经度"""
   from ..resource.epsg_code import CITY_POINT
@@ -103,12 +126,100 @@ def get_epsg(city: str):
   return epsg_from_lnglat(lng_from_city(city))
 
 
-def _projection_lnglat(lnglat: (tuple, list), crs_from, crs_to):
-  """对经纬度进行投影"""
+_transformer_local = threading.local()
+
+
+def _crs_key(crs):
+  """将crs转换为可哈希的键，dict格式的crs按键值排序后转为元组"""
+  if isinstance(crs, dict):
+    return tuple(sorted((k, str(v)) for k, v in crs.items()))
+  return crs
+
+
+def _crs_name(crs) -> str:
+  """坐标系的统一名称，如4326、'epsg:4326'均为'EPSG:4326'"""
+  from pyproj import CRS
+  return CRS.from_user_input(crs).to_string()
+
+
+def get_transformer(crs_from, crs_to, always_xy: bool = True):
+  """
+  获取坐标系转换器，按 (crs_from, crs_to, always_xy) 缓存复用。
+
+  pyproj的Transformer不能在线程间共享，因此缓存是线程级的：每个线程持有各自的缓存，
+  新线程首次调用时会重新创建转换器。
+
+  Args:
+    crs_from: 原坐标系
+    crs_to: 目标坐标系
+    always_xy: 是否始终按（经度，纬度）/（x，y）的顺序输入输出
+  """
   from pyproj import Transformer
+  pool = getattr(_transformer_local, 'pool', None)
+  if pool is None:
+    pool = _transformer_local.pool = {}
+  key = (_crs_key(crs_from), _crs_key(crs_to), always_xy)
+  if (transformer := pool.get(key)) is None:
+    transformer = pool[key] = Transformer.from_crs(
+        crs_from, crs_to, always_xy=always_xy
+    )
+  return transformer
+
+
+def project_lnglat(lng, lat, crs_from=4326, crs_to=None, city: str = None):
+  """
+  批量对经纬度进行投影
+
+  Args:
+    lng: 经度数组
+    lat: 纬度数组
+    crs_from: 原坐标系
+    crs_to: 投影坐标系，为空时根据城市获取，城市也为空时根据经度的中位数获取
+    city: 所在城市，用于获取投影坐标系
+
+  Returns:
+    投影后的x、y数组，经纬度为空的位置为nan；开启geometry缓存时复用相同输入的投影结果
+  """
+  lng = np.atleast_1d(np.asarray(lng, dtype=float))
+  lat = np.atleast_1d(np.asarray(lat, dtype=float))
+  assert lng.shape == lat.shape, '经纬度数组的长度必须相同'
+  valid = ~(np.isnan(lng) | np.isnan(lat))
+  x, y = np.full(lng.shape, np.nan), np.full(lat.shape, np.nan)
+  if not valid.any():
+    return x, y
+  if crs_to is None:
+    crs_to = get_epsg(city) if city else epsg_from_lnglat(
+        np.median(lng[valid])
+    )
+  cache, key = get_geometry_cache(), None
+  if cache is not None and lng.ndim == 1:
+    # 经纬度有一个为空时结果均为空，统一置为空后再计算指纹
+    key = ('project_lnglat', cache.fingerprint_arrays(
+        np.where(valid, lng, np.nan), np.where(valid, lat, np.nan)
+    ))
+    kind = f'lnglat:{_crs_name(crs_from)}>{_crs_name(crs_to)}'
+    if (xy := cache.get(key, kind)) is not None:
+      return xy[:, 0], xy[:, 1]
+  transformer = get_transformer(crs_from, crs_to)
+  if valid.sum() == 1:
+    # pyproj会将长度为1的数组按标量处理，此处直接传入标量
+    x[valid], y[valid] = transformer.transform(lng[valid][0], lat[valid][0])
+  else:
+    x[valid], y[valid] = transformer.transform(lng[valid], lat[valid])
+  if key:
+    cache.put(key, kind, np.column_stack([x, y]))
+  return x, y
+
+
+def _projection_lnglat(lnglat: (tuple, list), crs_from, crs_to):
+  """
+  对经纬度进行投影，输入及输出均按坐标系定义的轴顺序，
+  如目标坐标系为纬度在前的EPSG:4490时返回（纬度，经度）；
+  批量投影请使用 project_lnglat，其输入输出始终为（x，y）的顺序
+  """
   if any([is_empty(i) for i in lnglat]):
     return np.nan, np.nan
-  transformer = Transformer.from_crs(crs_from, crs_to)
+  transformer = get_transformer(crs_from, crs_to, always_xy=False)
   return transformer.transform(xx=lnglat[1], yy=lnglat[0])
 
 
@@ -237,9 +348,22 @@ def _infer_geom_format(x):
 
 
 @check_null(default_rv='unknown')
-def infer_geom_format(series: (str, list, tuple, pd.Series, BaseGeometry)):
-  """推断geometry格式"""
+def infer_geom_format(series: (str, list, tuple, pd.Series, BaseGeometry),
+                      sample: int = None):
+  """
+  推断geometry格式
+
+  Args:
+    series: 单个geometry或geometry列
+    sample: 按列推断时的抽样个数，默认仅解析第一个非空值；
+      指定时通过前缀和字节特征判断抽样值的格式，返回占比最高的格式
+  """
   assert isinstance(series, (str, list, tuple, pd.Series, BaseGeometry))
+  if sample and isinstance(series, (list, tuple, pd.Series)):
+    from .codec import geom_format_mix
+    if mix := geom_format_mix(series, sample=sample):
+      return next(iter(mix))
+    return 'unknown'
   if isinstance(series, (list, tuple, pd.Series)):
     for i in series:
       if pd.notna(i):
@@ -354,6 +478,68 @@ def ensure_lnglat(lnglat) -> tuple:
   raise ValueError(f'未知的地理类型:{lnglat}')
 
 
+def haversine_distance(lng1, lat1, lng2, lat2):
+  """
+  按球面（半正矢公式）计算经纬度之间的距离，单位：米，支持数组广播
+
+  Args:
+    lng1: 起点经度
+    lat1: 起点纬度
+    lng2: 终点经度
+    lat2: 终点纬度
+  """
+  lng1, lat1, lng2, lat2 = (
+    np.radians(np.asarray(i, dtype=float)) for i in (lng1, lat1, lng2, lat2)
+  )
+  a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(
+      (lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+@lru_cache()
+def _wgs84_geod():
+  from pyproj import Geod
+  return Geod(ellps='WGS84')
+
+
+def geodesic_distance(lng1, lat1, lng2, lat2):
+  """
+  按WGS84椭球计算经纬度之间的测地线距离，单位：米，支持数组广播
+
+  Args:
+    lng1: 起点经度
+    lat1: 起点纬度
+    lng2: 终点经度
+    lat2: 终点纬度
+  """
+  arrays = np.broadcast_arrays(
+      *(np.asarray(i, dtype=float) for i in (lng1, lat1, lng2, lat2))
+  )
+  dist = np.full(arrays[0].shape, np.nan)
+  valid = ~np.isnan(sum(arrays))
+  if valid.any():
+    *_, dist[valid] = _wgs84_geod().inv(*(i[valid] for i in arrays))
+  return dist
+
+
+def lnglat_distance(lng1, lat1, lng2, lat2, method: str = 'haversine'):
+  """
+  向量化计算经纬度之间的距离，单位：米，支持数组广播
+
+  Args:
+    lng1: 起点经度
+    lat1: 起点纬度
+    lng2: 终点经度
+    lat2: 终点纬度
+    method: 计算方法，'haversine'为球面距离，'geodesic'为椭球面测地线距离
+  """
+  if method == 'haversine':
+    return haversine_distance(lng1, lat1, lng2, lat2)
+  if method == 'geodesic':
+    return geodesic_distance(lng1, lat1, lng2, lat2)
+  raise ValueError(f'不支持的距离计算方法：{method}')
+
+
 def distance(
     p1: (tuple, str),
     p2: (tuple, str),
@@ -369,13 +555,15 @@ def distance(
     city: 所在城市，用于投影
     epsg_from: epsg代码
     epsg_to: 投影epsg代码
+
+  批量计算请使用 ricco.geometry.df.distance_pairs 或 od_distance
   """
   p1, p2 = ensure_lnglat(p1), ensure_lnglat(p2)
-  if not epsg_to:
-    epsg_to = get_epsg(city) if city else epsg_from_lnglat([p1[0], p2[0]])
-  p1 = _projection_lnglat(p1, epsg_from, epsg_to)
-  p2 = _projection_lnglat(p2, epsg_from, epsg_to)
-  return Point(p1).distance(Point(p2))
+  x, y = project_lnglat(
+      [p1[0], p2[0]], [p1[1], p2[1]],
+      crs_from=epsg_from, crs_to=epsg_to or None, city=city,
+  )
+  return float(np.hypot(x[1] - x[0], y[1] - y[0]))
 
 
 @check_null(default_rv=[])
@@ -1,5 +1,16 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ..base import ensure_list
 from .decorator import timer
 
+CSR_FUNCS = ('sum', 'mean', 'max', 'min', 'count', 'std')
+BUCKET_FUNCS = ('count', 'sum', 'mean')
+
 
 def filter_by_dist(ind, dist, r):
   """通过距离列表筛选出距离小于r的点的位置"""
@@ -73,17 +84,568 @@ def kdtree_nearest(xy_tree,
                    limit: int = None,
                    r: float = None,
                    leaf_size=2):
-  """使用kdtree查询最近点"""
-  if limit or not (r or limit):
-    return kdtree_query(
-        xy_tree=xy_tree,
-        xy_query=xy_query,
-        limit=limit,
-        r=r,
-        leaf_size=leaf_size)
-  return kdtree_query_radius(
-      xy_tree=xy_tree,
-      xy_query=xy_query,
-      r=r,
-      limit=limit,
-      leaf_size=leaf_size)
+  """使用kdtree查询最近点，结果为每个查询点的索引列表及距离列表"""
+  ind, dist, offsets = kdtree_nearest_csr(
+      xy_tree, xy_query, limit=limit, r=r, leaf_size=leaf_size
+  )
+  return csr_to_lists(ind, offsets), csr_to_lists(dist, offsets)
+
+
+def kdtree_nearest_csr(xy_tree,
+                       xy_query,
+                       limit: int = None,
+                       r: float = None,
+                       leaf_size=2,
+                       n_jobs: int = 1,
+                       executor=None,
+                       sort_results: bool = True):
+  """
+  使用kdtree查询最近点，结果以压缩行（CSR）的形式返回，
+  第i个查询点的结果为 ind[offsets[i]:offsets[i+1]]，由近及远排序
+
+  Args:
+    xy_tree: 要构造数的点集
+    xy_query: 查询的点集
+    limit: 数量限制
+    r: 半径限制
+    leaf_size: kdtree叶子节点的大小，为'auto'时参考 auto_leaf_size 自动选择
+    n_jobs: 并行查询的线程数
+    executor: 执行并行查询的线程池，参考 kdtree_query_csr
+    sort_results: 按半径查询时是否将结果由近及远排序，不需要顺序时关闭可大幅提升速度
+
+  Returns:
+    扁平的索引数组、距离数组及长度为查询点个数+1的偏移量数组
+  """
+  from sklearn.neighbors import KDTree
+  if leaf_size == 'auto':
+    leaf_size = auto_leaf_size(xy_tree)
+  tree = KDTree(xy_tree, leaf_size=leaf_size)
+  return kdtree_query_csr(
+      tree, xy_query, limit=limit, r=r, n_jobs=n_jobs, executor=executor,
+      sort_results=sort_results,
+  )
+
+
+def kdtree_query_csr(tree,
+                     xy_query,
+                     limit: int = None,
+                     r: float = None,
+                     n_jobs: int = 1,
+                     executor=None,
+                     sort_results: bool = True):
+  """
+  在已构建的树上查询最近点，参考 kdtree_nearest_csr
+
+  Args:
+    tree: sklearn的 KDTree 或 BallTree
+    xy_query: 查询的点集
+    limit: 数量限制
+    r: 半径限制
+    n_jobs: 并行查询的线程数，大于1时将查询点分块，各块共用同一棵树并行查询，
+      结果按原顺序拼接。sklearn查询时会释放GIL，因此使用线程即可并行
+    executor: 执行并行查询的线程池，指定时使用该线程池，不再新建
+    sort_results: 按半径查询时是否将结果由近及远排序，按数量查询时结果总是有序的
+  """
+  if n_jobs > 1 or executor is not None:
+    return concat_csr(map_query_chunks(
+        lambda xy: kdtree_query_csr(
+            tree, xy, limit=limit, r=r, sort_results=sort_results),
+        xy_query, n_jobs=n_jobs, executor=executor,
+    ))
+  if limit or not r:
+    dist, ind = tree.query(xy_query, k=limit or 1, return_distance=True)
+    if r:
+      mask = dist <= r
+      return ind[mask], dist[mask], _counts_to_offsets(mask.sum(axis=1))
+    offsets = np.arange(0, ind.size + 1, ind.shape[1])
+    return ind.ravel(), dist.ravel(), offsets
+  ind, dist = tree.query_radius(
+      xy_query, r=r, return_distance=True, sort_results=sort_results
+  )
+  offsets = _counts_to_offsets([len(i) for i in ind])
+  if not len(ind):
+    return np.zeros(0, dtype=np.intp), np.zeros(0), offsets
+  return np.concatenate(ind), np.concatenate(dist), offsets
+
+
+def map_query_chunks(func, xy_query, n_jobs: int = 1, executor=None) -> list:
+  """
+  将查询点按行分块，使用线程池对每块执行func，结果按原顺序返回
+
+  Args:
+    func: 对每块查询点执行的函数
+    xy_query: 查询的点集
+    n_jobs: 线程数，未指定executor时新建线程池使用
+    executor: 线程池，指定时使用该线程池
+  """
+  xy_query = np.asarray(xy_query, dtype=float)
+  # 每个线程分配多个块，避免各块耗时不均时部分线程空闲
+  n_chunks = min(len(xy_query), max(n_jobs, 1) * 4)
+  if n_chunks <= 1 or (executor is None and n_jobs <= 1):
+    return [func(xy_query)]
+  chunks = np.array_split(xy_query, n_chunks)
+  if executor is not None:
+    return list(executor.map(func, chunks))
+  with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+    return list(executor.map(func, chunks))
+
+
+def _counts_to_offsets(counts) -> np.ndarray:
+  """每个查询点的结果个数转换为偏移量"""
+  return np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+
+
+def csr_to_lists(values, offsets) -> list:
+  """将CSR形式的结果拆分为每个查询点一个列表"""
+  return [i.tolist() for i in np.split(values, offsets[1:-1])]
+
+
+def concat_csr(parts):
+  """
+  按顺序拼接多段CSR形式的查询结果
+
+  Args:
+    parts: (ind, dist, offsets) 的列表，每段对应一组连续的查询点
+  """
+  parts = list(parts)
+  ind = np.concatenate([p[0] for p in parts])
+  dist = np.concatenate([p[1] for p in parts])
+  counts = np.concatenate([np.diff(p[2]) for p in parts])
+  return ind, dist, _counts_to_offsets(counts)
+
+
+def reorder_csr(ind, dist, offsets, order):
+  """
+  按查询点重新排列CSR形式的结果
+
+  Args:
+    ind: 扁平的索引数组
+    dist: 扁平的距离数组
+    offsets: 偏移量数组
+    order: 新的第i个查询点为原来的第order[i]个查询点
+  """
+  counts = np.diff(offsets)[order]
+  new_offsets = _counts_to_offsets(counts)
+  # 每个元素在原数组中的位置：所在查询点的起始位置 + 在查询点内的序号
+  within = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1], counts)
+  pos = np.repeat(offsets[:-1][order], counts) + within
+  return ind[pos], dist[pos], new_offsets
+
+
+def radius_masks(dist, radii, ring: bool = False) -> list:
+  """
+  按距离将CSR形式的结果划分到多个半径中
+
+  Args:
+    dist: 扁平的距离数组
+    radii: 从小到大排列的半径列表
+    ring: 是否按环形划分，为True时第i个半径只包含距离在 (radii[i-1], radii[i]] 内的点，
+      否则包含距离不超过 radii[i] 的全部点
+
+  Returns:
+    每个半径对应的布尔数组，可作为 reduce_csr 的mask参数
+  """
+  masks = [dist <= r for r in radii]
+  if ring:
+    masks = [masks[0], *[b & ~a for a, b in zip(masks[:-1], masks[1:])]]
+  return masks
+
+
+def bucket_csr(dist, offsets, radii) -> np.ndarray:
+  """
+  计算每个元素所在的 (查询点, 半径) 分组编号，用于 reduce_buckets
+
+  Args:
+    dist: 扁平的距离数组
+    offsets: 偏移量数组
+    radii: 从小到大排列的半径列表
+
+  Returns:
+    分组编号数组：查询点的序号 * 半径个数 + 距离不超过的最小半径的序号
+  """
+  n_radii = len(radii)
+  groups = np.repeat(np.arange(len(offsets) - 1) * n_radii, np.diff(offsets))
+  return groups + np.searchsorted(np.asarray(radii, dtype=float), dist)
+
+
+def reduce_buckets(keys, n: int, n_radii: int, func: str = 'count',
+                   values=None, ring: bool = False) -> list:
+  """
+  按 bucket_csr 的分组编号一次性计算每个半径的 count、sum 或 mean
+
+  Args:
+    keys: bucket_csr 计算的分组编号
+    n: 查询点的个数
+    n_radii: 半径的个数
+    func: 聚合方法，支持 count、sum、mean
+    values: 扁平的数值数组，func为count且为空时统计元素个数
+    ring: 是否按环形统计，参考 radius_masks
+
+  Returns:
+    每个半径对应的聚合结果
+  """
+  assert func in BUCKET_FUNCS, f'不支持的聚合方法：{func}'
+  if values is not None:
+    values = np.asarray(values)
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+      valid = ~np.isnan(values)
+      keys, values = keys[valid], values[valid]
+
+  def accumulate(weights=None):
+    res = np.bincount(keys, weights=weights, minlength=n * n_radii)
+    res = res.reshape(n, n_radii)
+    return (res if ring else res.cumsum(axis=1)).T
+
+  counts = accumulate()
+  if func == 'count':
+    return list(counts)
+  total = accumulate(values.astype(float))
+  if func == 'sum':
+    if values.dtype.kind in 'iub':
+      total = total.round().astype(np.int64)
+    return list(total)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return list(np.where(counts > 0, total / counts, np.nan))
+
+
+def reduce_csr(values, offsets, func: str, mask=None):
+  """
+  对CSR形式的每一段数据进行聚合，空值不参与计算，与pandas的聚合结果一致
+
+  Args:
+    values: 扁平的数据数组
+    offsets: 偏移量数组
+    func: 聚合方法，sum、mean、max、min、count、std使用向量化计算，
+      其他方法按 pandas.Series 的同名方法分组计算
+    mask: 参与计算的元素，为空时全部参与计算
+
+  Returns:
+    长度为查询点个数的聚合结果
+  """
+  counts = np.diff(offsets)
+  values = np.asarray(values)
+  if func not in CSR_FUNCS or not pd.api.types.is_numeric_dtype(values):
+    if mask is not None:
+      values, counts = values[mask], count_csr(offsets, mask)
+    return _reduce_csr_groupby(values, counts, func)
+  if values.dtype == bool:
+    values = values.astype(np.int64)
+  valid = mask
+  if values.dtype.kind == 'f' and np.isnan(values).any():
+    valid = ~np.isnan(values) if valid is None else valid & ~np.isnan(values)
+  if func in ('max', 'min') and valid is None:
+    # 不存在空值时直接使用reduceat
+    return _reduceat(getattr(np, f'{func}imum'), values, offsets, np.nan)
+  n_all = counts if valid is None else count_csr(offsets, valid)
+  if func == 'count':
+    return n_all
+  x = values if valid is None else np.where(valid, values, 0)
+  total = _reduceat(np.add, x, offsets, 0)
+  if func == 'sum':
+    return total
+  with np.errstate(invalid='ignore', divide='ignore'):
+    mean = np.where(n_all > 0, total / np.maximum(n_all, 1), np.nan)
+    if func == 'mean':
+      return mean
+    if func == 'std':
+      dev = values - np.repeat(mean, counts)
+      dev = dev * dev if valid is None else np.where(valid, dev * dev, 0)
+      var = _reduceat(np.add, dev, offsets, 0) / (n_all - 1)
+      return np.where(n_all > 1, np.sqrt(var), np.nan)
+  fill = -np.inf if func == 'max' else np.inf
+  x = np.where(valid, values, fill).astype(float)
+  res = _reduceat(getattr(np, f'{func}imum'), x, offsets, np.nan)
+  res[n_all == 0] = np.nan
+  return res
+
+
+def count_csr(offsets, mask=None) -> np.ndarray:
+  """每一段中满足mask的元素个数"""
+  if mask is None:
+    return np.diff(offsets)
+  return _reduceat(np.add, mask, offsets, 0, dtype=np.int64)
+
+
+def _reduceat(ufunc, values, offsets, empty, dtype=None):
+  """ufunc.reduceat的封装，结果为空的段取值为empty"""
+  counts = np.diff(offsets)
+  nonempty = counts > 0
+  res = ufunc.reduceat(values, offsets[:-1][nonempty], dtype=dtype) \
+    if nonempty.any() else np.zeros(0, dtype=dtype or np.asarray(values).dtype)
+  if nonempty.all():
+    return res
+  out = np.full(len(counts), empty, dtype=np.result_type(res, type(empty)))
+  out[nonempty] = res
+  return out
+
+
+def _reduce_csr_groupby(values, counts, func):
+  """使用pandas分组聚合，空的段使用空Series的聚合结果"""
+  values = pd.Series(values)
+  groups = np.repeat(np.arange(len(counts)), counts)
+  res = values.groupby(groups).agg(func)
+  if (counts == 0).any():
+    empty = getattr(values.iloc[:0], func)()
+    res = res.reindex(range(len(counts)), fill_value=empty)
+  return res.to_numpy()
+
+
+LEAF_SIZES = (4, 8, 16, 32, 64)
+METRICS = ('euclidean', 'haversine')
+
+
+def _tree_class(metric: str = 'euclidean'):
+  """欧氏距离使用KDTree，球面距离使用BallTree"""
+  from sklearn.neighbors import BallTree
+  from sklearn.neighbors import KDTree
+  assert metric in METRICS, f'metric可选：{METRICS}'
+  return KDTree if metric == 'euclidean' else BallTree
+
+
+def auto_leaf_size(xy, candidates=LEAF_SIZES, n_sample: int = 20_000,
+                   k: int = 8, metric: str = 'euclidean') -> int:
+  """
+  在点集的抽样上分别构建并查询KDTree，选择查询耗时最短的叶子节点大小
+
+  Args:
+    xy: 点集
+    candidates: 候选的叶子节点大小
+    n_sample: 抽样的点数
+    k: 测试查询的近邻个数
+    metric: 距离度量，'euclidean'或'haversine'
+  """
+  tree_class = _tree_class(metric)
+  rng = np.random.default_rng(0)
+  xy = np.asarray(xy, dtype=float)
+  if len(xy) > n_sample:
+    xy = xy[rng.choice(len(xy), n_sample, replace=False)]
+  query = xy[rng.choice(len(xy), min(2_000, len(xy)), replace=False)]
+  costs = []
+  for leaf_size in candidates:
+    tree = tree_class(xy, leaf_size=leaf_size, metric=metric)
+    start = time.perf_counter()
+    tree.query(query, k=min(k, len(xy)))
+    costs.append(time.perf_counter() - start)
+  return candidates[int(np.argmin(costs))]
+
+
+class PointIndex:
+  """
+  可复用、可持久化的点数据KDTree索引
+
+  同一份点数据（如POI底库）需要与不同批次的数据做近邻查询时，只需投影并构建一次，
+  之后可直接传给 nearest_kdtree 代替 df_poi，也可以保存到文件后在其他进程中加载。
+  metric为'haversine'时不投影，使用BallTree按球面距离查询，适用于跨多个投影带的数据
+
+  Args:
+    xy: 投影后的坐标数组，形状为(n, 2)；metric为'haversine'时为弧度制的[纬度, 经度]
+    index: 每个点的索引，默认为行号
+    data: 与xy一一对应的属性数据，nearest_kdtree 中的 agg 从中取值
+    crs: xy所在的投影坐标系，用于将查询数据的经纬度投影到同一坐标系
+    leaf_size: KDTree叶子节点的大小，为'auto'时通过小规模测试自动选择
+    metric: 距离度量，'euclidean'为投影坐标系下的欧氏距离，'haversine'为球面距离，
+      两种方式的查询半径及返回的距离单位均为米
+
+  Examples:
+    >>> index = PointIndex.from_df(df_poi, city='上海')  # doctest: +SKIP
+    >>> index.save('poi_index', mmap=True)  # doctest: +SKIP
+    >>> index = PointIndex.load('poi_index')  # doctest: +SKIP
+    >>> df = nearest_kdtree(df, index, r=1000)  # doctest: +SKIP
+  """
+
+  def __init__(self,
+               xy,
+               index=None,
+               data: pd.DataFrame = None,
+               crs=None,
+               leaf_size: (int, str) = 'auto',
+               metric: str = 'euclidean'):
+    tree_class = _tree_class(metric)
+    xy = np.asarray(xy, dtype=float)
+    assert xy.ndim == 2 and len(xy), 'xy必须为非空的二维数组'
+    assert data is None or len(data) == len(xy), 'data与xy的长度必须相同'
+    if leaf_size == 'auto':
+      leaf_size = auto_leaf_size(xy, metric=metric)
+    self.index = pd.RangeIndex(len(xy)) if index is None else pd.Index(index)
+    self.data = data
+    self.crs = crs
+    self.leaf_size = leaf_size
+    self.metric = metric
+    self.tree = tree_class(xy, leaf_size=leaf_size, metric=metric)
+
+  @classmethod
+  def from_df(cls,
+              df: pd.DataFrame,
+              epsg=None,
+              city=None,
+              crs=None,
+              leaf_size: (int, str) = 'auto',
+              columns: (list, str) = None,
+              metric: str = 'euclidean') -> 'PointIndex':
+    """
+    由经纬度数据构建索引，经纬度为空的行不参与构建
+
+    Args:
+      df: 包含lng、lat列或geometry列的数据
+      epsg: 投影代码，epsg/city/crs指定多个时以epsg为准
+      city: 城市，用于获取投影代码
+      crs: 投影坐标系
+      leaf_size: KDTree叶子节点的大小
+      columns: 保留的属性列，默认全部保留
+      metric: 距离度量，为'haversine'时不投影，epsg/city/crs无效
+    """
+    from ..geometry.df import _projection_crs
+    from ..geometry.df import ensure_lnglat
+    from ..geometry.util import project_lnglat
+
+    assert df.index.is_unique, '数据集索引必须唯一'
+    df = ensure_lnglat(df)
+    df = df[df['lng'].notna() & df['lat'].notna()]
+    assert not df.empty, '筛选后数据集为空，请检查经纬度列'
+    data = df if columns is None else df[ensure_list(columns)]
+    if metric == 'haversine':
+      crs_to = None
+      xy = np.radians(df[['lat', 'lng']].to_numpy(dtype=float))
+    else:
+      crs_to = _projection_crs(df['lng'], epsg=epsg, city=city, crs=crs)
+      xy = np.column_stack(project_lnglat(df['lng'], df['lat'], crs_to=crs_to))
+    return cls(xy, index=df.index, data=data, crs=crs_to, leaf_size=leaf_size,
+               metric=metric)
+
+  def __len__(self):
+    return len(self.index)
+
+  def project(self, df: pd.DataFrame) -> np.ndarray:
+    """
+    将数据的经纬度投影到索引所在的坐标系，返回形状为(n, 2)的数组，
+    metric为'haversine'时转换为弧度制的[纬度, 经度]
+    """
+    from ..geometry.df import ensure_lnglat
+    from ..geometry.util import project_lnglat
+
+    df = ensure_lnglat(df)
+    if self.metric == 'haversine':
+      return np.radians(df[['lat', 'lng']].to_numpy(dtype=float))
+    assert self.crs is not None, '索引未指定坐标系，请直接传入投影后的坐标'
+    return np.column_stack(
+        project_lnglat(df['lng'], df['lat'], crs_to=self.crs)
+    )
+
+  @property
+  def unit(self) -> float:
+    """树中的距离对应的米数，球面距离以弧度表示，需乘以地球半径"""
+    from ..geometry.util import EARTH_RADIUS
+    return EARTH_RADIUS if self.metric == 'haversine' else 1.0
+
+  def _xy(self, points) -> np.ndarray:
+    """查询点的坐标，DataFrame按经纬度投影，数组视为已投影的坐标"""
+    if isinstance(points, pd.DataFrame):
+      return self.project(points)
+    return np.asarray(points, dtype=float).reshape(-1, 2)
+
+  def query(self,
+            points,
+            limit: int = None,
+            r: float = None,
+            n_jobs: int = 1,
+            executor=None,
+            sort_results: bool = True):
+    """
+    查询最近点，参考 kdtree_nearest_csr
+
+    Args:
+      points: 包含经纬度的DataFrame或投影后的坐标数组
+      limit: 数量限制
+      r: 半径限制
+      n_jobs: 并行查询的线程数
+      executor: 执行并行查询的线程池
+      sort_results: 按半径查询时是否将结果由近及远排序
+
+    Returns:
+      CSR形式的结果：扁平的行号数组、距离数组（米）及偏移量数组
+    """
+    unit = self.unit
+    ind, dist, offsets = kdtree_query_csr(
+        self.tree, self._xy(points),
+        limit=limit, r=None if r is None else r / unit,
+        n_jobs=n_jobs, executor=executor,
+        sort_results=sort_results,
+    )
+    return ind, dist * unit if unit != 1 else dist, offsets
+
+  def query_knn(self, points, k: int = 1, r: float = None, **kwargs):
+    """查询最近的k个点，r不为空时只保留距离不超过r的点，结果为CSR形式"""
+    return self.query(points, limit=k, r=r, **kwargs)
+
+  def query_radius(self, points, r: float, limit: int = None, **kwargs):
+    """查询半径r内的点，由近及远排序，limit不为空时只保留最近的limit个，结果为CSR形式"""
+    return self.query(points, limit=limit, r=r, **kwargs)
+
+  def count_radius(self,
+                   points,
+                   r: float,
+                   n_jobs: int = 1,
+                   executor=None) -> np.ndarray:
+    """统计半径r内的点的个数"""
+    r = r / self.unit
+    return np.concatenate(map_query_chunks(
+        lambda xy: self.tree.query_radius(xy, r=r, count_only=True),
+        self._xy(points), n_jobs=n_jobs, executor=executor,
+    ))
+
+  def save(self, filepath, mmap: bool = False):
+    """
+    保存索引
+
+    Args:
+      filepath: 保存路径，mmap为True时为目录
+      mmap: 是否将KDTree的数组分别保存为.npy文件，加载时以内存映射的方式读取，
+        多个进程可共享同一份数据
+    """
+    meta = {
+      'index': self.index,
+      'data': self.data,
+      'crs': self.crs,
+      'leaf_size': self.leaf_size,
+      'metric': self.metric,
+    }
+    if not mmap:
+      pd.to_pickle({**meta, 'tree': self.tree}, filepath)
+      return
+    os.makedirs(filepath, exist_ok=True)
+    state = list(self.tree.__getstate__())
+    for i, item in enumerate(state):
+      if isinstance(item, np.ndarray):
+        np.save(os.path.join(filepath, f'tree_{i}.npy'), item)
+        state[i] = None
+    pd.to_pickle({**meta, 'state': state}, os.path.join(filepath, 'meta.pkl'))
+
+  @classmethod
+  def load(cls, filepath, mmap_mode: str = 'r') -> 'PointIndex':
+    """
+    加载 save 方法保存的索引
+
+    Args:
+      filepath: 文件或目录路径
+      mmap_mode: 目录形式保存时.npy文件的读取方式，参考 numpy.load
+    """
+    if os.path.isdir(filepath):
+      meta = pd.read_pickle(os.path.join(filepath, 'meta.pkl'))
+      meta.setdefault('metric', 'euclidean')
+      state = meta.pop('state')
+      for i, item in enumerate(state):
+        if item is None and os.path.exists(
+            path := os.path.join(filepath, f'tree_{i}.npy')):
+          state[i] = np.load(path, mmap_mode=mmap_mode)
+      tree_class = _tree_class(meta['metric'])
+      tree = tree_class.__new__(tree_class)
+      tree.__setstate__(tuple(state))
+    else:
+      meta = pd.read_pickle(filepath)
+      meta.setdefault('metric', 'euclidean')
+      tree = meta.pop('tree')
+    self = cls.__new__(cls)
+    self.tree = tree
+    for k, v in meta.items():
+      setattr(self, k, v)
+    return self
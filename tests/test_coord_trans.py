@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from shapely.geometry import MultiPolygon
+from shapely.geometry import Point
+from shapely.geometry import Polygon
+
+from ricco.geocode.util import gcj2xx
+from ricco.geometry.coord_trans import _coord_transform
+from ricco.geometry.coord_trans import _coord_transform_geometry
+from ricco.geometry.coord_trans import _fn_mapping
+from ricco.geometry.coord_trans import coord_trans_geom
+from ricco.geometry.coord_trans import coord_trans_x2y
+from ricco.geometry.coord_trans import coord_transform_geojson
+from ricco.geometry.coord_trans import coord_transform_array
+
+rng = np.random.default_rng(0)
+lngs = np.concatenate([rng.uniform(73, 135, 1000), [10.0, 121.5, np.nan]])
+lats = np.concatenate([rng.uniform(18, 53, 1000), [10.0, np.nan, 31.2]])
+
+
+def test_coord_transform_array():
+  for from_srs, to_srs in _fn_mapping:
+    lng, lat = coord_transform_array(lngs, lats, from_srs, to_srs)
+    for i in range(len(lngs)):
+      _lng, _lat = _coord_transform(lngs[i], lats[i], from_srs, to_srs)
+      if _lng is None:
+        assert np.isnan(lng[i]) or np.isnan(lat[i])
+      else:
+        assert abs(lng[i] - _lng) < 1e-9 and abs(lat[i] - _lat) < 1e-9
+    # 国外的坐标保持不变
+    assert lng[-3] == 10.0 and lat[-3] == 10.0
+
+
+def test_coord_trans_x2y():
+  df = pd.DataFrame({'lng': [121.5, None], 'lat': [31.2, 31.2], 'a': [1, 2]})
+  res = coord_trans_x2y(df, 'gcj02', 'wgs84')
+  lng, lat = _coord_transform(121.5, 31.2, 'gcj02', 'wgs84')
+  assert abs(res['lng'][0] - lng) < 1e-9 and abs(res['lat'][0] - lat) < 1e-9
+  # 经纬度有一个为空时两列均为空，与逐行转换一致
+  assert np.isnan(res['lng'][1]) and np.isnan(res['lat'][1])
+  assert res['a'].tolist() == [1, 2]
+  df = pd.DataFrame({'lng': [None, 121.5, 121.5], 'lat': [31.0, None, 31.2]})
+  for srs_from, srs_to in _fn_mapping:
+    res = coord_trans_x2y(df, srs_from, srs_to)
+    assert res[['lng', 'lat']][:2].isna().all().all()
+    assert res[['lng', 'lat']].iloc[2].notna().all()
+
+
+def test_gcj2xx():
+  lat, lng = gcj2xx(['121.5', '31.2'], 'wgs84')
+  _lng, _lat = _coord_transform(121.5, 31.2, 'gcj02', 'wgs84')
+  assert abs(lng - _lng) < 1e-9 and abs(lat - _lat) < 1e-9
+  assert gcj2xx([121.5, 31.2], 'gcj02') == (31.2, 121.5)
+
+
+def test_coord_trans_geom():
+  polygon = MultiPolygon([
+    Polygon([(121.4, 31.2), (121.5, 31.2), (121.5, 31.3), (121.4, 31.2)]),
+    Polygon([(120.4, 30.2), (120.5, 30.2), (120.5, 30.3), (120.4, 30.2)]),
+  ])
+  df = pd.DataFrame({
+    'a': [1, 2, 3],
+    'geometry': [polygon.wkt, Point(121.5, 31.2).wkt, None],
+  })
+  res = coord_trans_geom(df, 'gcj02', 'wgs84')
+  assert res.columns.tolist() == ['a', 'geometry']
+  assert res['geometry'][0].startswith('MULTIPOLYGON')
+  assert res['geometry'][2] is None
+  res = coord_trans_geom(df, 'gcj02', 'wgs84', geometry_format='shapely')
+  expected = _coord_transform_geometry(polygon, 'gcj02', 'wgs84')
+  assert res['geometry'][0].equals_exact(expected, 1e-9)
+  assert df['geometry'][1] == 'POINT (121.5 31.2)'
+
+
+def test_coord_transform_geojson():
+  obj = {
+    'type': 'FeatureCollection',
+    'features': [
+      {'type': 'Feature', 'properties': {},
+       'geometry': {'type': 'Point', 'coordinates': [121.5, 31.2]}},
+      {'type': 'Feature', 'properties': {},
+       'geometry': {'type': 'LineString',
+                    'coordinates': [[121.5, 31.2], [10.0, 10.0]]}},
+    ]
+  }
+  res = coord_transform_geojson(obj, 'gcj02', 'wgs84')
+  lng, lat = _coord_transform(121.5, 31.2, 'gcj02', 'wgs84')
+  assert res['features'][0]['geometry']['coordinates'] == (lng, lat)
+  assert res['features'][1]['geometry']['coordinates'] == [
+    (lng, lat), (10.0, 10.0)
+  ]
+
+
+def test_coord_transform_exact():
+  gcj_lng, gcj_lat = coord_transform_array(lngs, lats, 'wgs84', 'gcj02')
+  lng, lat = coord_transform_array(gcj_lng, gcj_lat, 'gcj02', 'wgs84')
+  assert np.nanmax(np.abs(lng - lngs)) > 1e-5
+  lng, lat = coord_transform_array(
+      gcj_lng, gcj_lat, 'gcj02', 'wgs84', exact=True)
+  assert np.nanmax(np.abs(lng - lngs)) < 1e-7
+  assert np.nanmax(np.abs(lat - lats)) < 1e-7
+  # 经纬度有一个为空时结果均为空
+  invalid = np.isnan(lngs) | np.isnan(lats)
+  assert (np.isnan(lng) == invalid).all() and (np.isnan(lat) == invalid).all()
+
+  bd_lng, bd_lat = coord_transform_array(lngs, lats, 'wgs84', 'bd09')
+  lng, lat = coord_transform_array(bd_lng, bd_lat, 'bd09', 'wgs84', exact=True)
+  assert np.nanmax(np.abs(lng - lngs)) < 1e-7
+  assert np.nanmax(np.abs(lat - lats)) < 1e-7
+
+  df = pd.DataFrame({'lng': gcj_lng[:10], 'lat': gcj_lat[:10]})
+  res = coord_trans_x2y(df, 'gcj02', 'wgs84', exact=True)
+  assert np.abs(res['lng'] - lngs[:10]).max() < 1e-7
@@ -1,20 +1,62 @@
 import warnings
 
+import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from pandas.testing import assert_frame_equal
 from shapely.geometry import MultiPolygon
 from shapely.geometry import Point
 from shapely.geometry import Polygon
 
+from ricco.geometry.cache import GeometryCache
+from ricco.geometry.cache import geometry_cache
+from ricco.geometry.cache import get_geometry_cache
+from ricco.geometry.codec import classify_geom_formats
+from ricco.geometry.codec import dumps_array
+from ricco.geometry.codec import geom_format_mix
+from ricco.geometry.codec import is_empty_array
+from ricco.geometry.codec import loads_array
+from ricco.geometry.df import auto2shapely
+from ricco.geometry.df import auto2x
+from ricco.geometry.df import distance_pairs
+from ricco.geometry.df import ensure_geometry
+from ricco.geometry.df import ensure_lnglat
+from ricco.geometry.df import get_area
+from ricco.geometry.df import get_neighbors
+from ricco.geometry.df import get_projection_xy
+from ricco.geometry.df import mark_tags_file
 from ricco.geometry.df import mark_tags_v2
+from ricco.geometry.df import nearest_kdtree
+from ricco.geometry.df import nearest_neighbor
+from ricco.geometry.df import neighbor_edges
+from ricco.geometry.df import neighbor_matrix
+from ricco.geometry.df import od_distance
+from ricco.geometry.df import projection
+from ricco.geometry.df import projection_lnglat
+from ricco.geometry.df import shapely2geojson
+from ricco.geometry.df import shapely2wkb
+from ricco.geometry.df import shapely2wkt
+from ricco.geometry.df import spatial_agg
+from ricco.geometry.df import wkb2shapely
+from ricco.geometry.df import wkt2shapely
+from ricco.geometry.tagger import GridIndex
+from ricco.geometry.tagger import PolygonTagger
+from ricco.geometry.util import _projection_lnglat
+from ricco.geometry.util import crs_sh2000
+from ricco.geometry.util import distance
 from ricco.geometry.util import epsg_from_lnglat
 from ricco.geometry.util import get_epsg
+from ricco.geometry.util import get_transformer
 from ricco.geometry.util import infer_geom_format
 from ricco.geometry.util import is_geojson
 from ricco.geometry.util import is_shapely
 from ricco.geometry.util import is_wkb
 from ricco.geometry.util import is_wkt
+from ricco.geometry.util import lnglat_distance
+from ricco.geometry.util import project_lnglat
 from ricco.geometry.util import st_is_empty
+from ricco.geometry.util import utm_epsg_array
 
 point_name = '点位A'
 point_lng = 121.505563
@@ -298,3 +340,544 @@ def test_st_is_empty():
   assert st_is_empty(Point()) is True
   assert st_is_empty(Polygon()) is True
   assert st_is_empty(Point(1, 1)) is False
+
+
+def test_loads_array():
+  values = [point_wkb, None, 'abc', '010700000000000000', polygon_wkb]
+  geoms, failed = loads_array(values, 'wkb')
+  assert geoms[0].equals(point_shapely)
+  assert geoms[4].equals(polygon_shapely)
+  assert geoms[1] is None and geoms[2] is None and geoms[3] is None
+  assert failed.tolist() == [False, False, True, False, False]
+
+  geoms, failed = loads_array(['POINT (1 1)', 1, np.nan], 'wkt')
+  assert geoms[0].equals(Point(1, 1)) and geoms[1] is None
+  assert failed.tolist() == [False, True, False]
+
+  geoms, failed = loads_array([
+    '{"type": "Point", "coordinates": [1.0, 1.0]}',
+    "{'type': 'Point', 'coordinates': [2.0, 2.0]}",
+    {'type': 'Point', 'coordinates': [3.0, 3.0]},
+    '{"type": "FeatureCollection", "features": ['
+    '{"type": "Feature", "properties": {}, "geometry": '
+    '{"type": "Point", "coordinates": [4.0, 4.0]}}]}',
+  ], 'geojson')
+  assert [g.x for g in geoms] == [1.0, 2.0, 3.0, 4.0]
+  assert not failed.any()
+
+
+def test_wkb2shapely():
+  df = pd.DataFrame({'geometry': [point_wkb, None, 'abc']})
+  with warnings.catch_warnings(record=True) as w:
+    warnings.simplefilter('always')
+    res = wkb2shapely(df)
+    assert len(w) == 1
+  assert res.geometry[0].equals(point_shapely)
+  assert res.geometry[1:].isna().all()
+  res = wkt2shapely(pd.DataFrame({'geometry': [polygon_wkt, None]}))
+  assert res.geometry[0].equals(polygon_shapely)
+  assert res.geometry[1] is None
+
+
+def test_dumps_array():
+  geoms = [point_shapely, None, Point(), polygon_shapely]
+  res = dumps_array(geoms, 'wkb')
+  assert res.tolist() == [point_wkb, None, None, polygon_wkb]
+  res = dumps_array(geoms, 'wkt', precision=2)
+  assert res[0] == 'POINT (121.51 31.31)'
+  assert res[1] is None and res[2] is None
+  res = dumps_array([Point(1.126, 1)], 'geojson', precision=2)
+  assert is_geojson(res[0]) and '1.13' in res[0]
+  assert isinstance(dumps_array([Point(1, 1)], 'wkb', hex=False)[0], bytes)
+
+
+def test_shapely2wkt_all_geometry():
+  df = gpd.GeoDataFrame(
+    {'geometry': [point_shapely, Point()], 'other': [None, polygon_shapely]},
+    crs=4326)
+  df['other'] = gpd.GeoSeries(df['other'], crs=4326)
+  res = shapely2wkt(df, precision=2)
+  assert res['geometry'].tolist() == ['POINT (121.51 31.31)', None]
+  assert res['other'][0] is None and res['other'][1].startswith('MULTIPOLYGON')
+  res = shapely2wkb(df)
+  assert res['geometry'].tolist() == [point_wkb, None]
+  assert res['other'].tolist() == [None, polygon_wkb]
+  res = shapely2geojson(pd.DataFrame({'geometry': [Point(1.5, 2)]}))
+  assert res['geometry'][0] == '{"type":"Point","coordinates":[1.5,2.0]}'
+
+
+def test_is_empty_array():
+  values = [None, np.nan, Point(), Point(1, 1),
+            'GEOMETRYCOLLECTION EMPTY', point_wkb]
+  assert is_empty_array(values).tolist() == [
+    True, True, True, False, True, False
+  ]
+
+
+def test_classify_geom_formats():
+  values = [point_wkb, polygon_wkt, '{"type": "Point", "coordinates": [1, 1]}',
+            point_shapely, None, '123456', 'abc']
+  assert classify_geom_formats(values).tolist() == [
+    'wkb', 'wkt', 'geojson', 'shapely', None, 'unknown', 'unknown'
+  ]
+  assert geom_format_mix([point_wkb, None, point_wkb, polygon_wkt]) == {
+    'wkb': 2 / 3, 'wkt': 1 / 3
+  }
+  assert geom_format_mix([None]) == {}
+  assert infer_geom_format(
+      pd.Series([None, polygon_wkt, point_wkb, point_wkb]), sample=10) == 'wkb'
+
+
+def test_auto2shapely_mixed():
+  df = pd.DataFrame({'geometry': [point_wkb, polygon_wkt, None]})
+  res = auto2shapely(df)
+  assert res.geometry[0].equals(point_shapely)
+  assert res.geometry[1].equals(polygon_shapely)
+  assert res.geometry[2] is None
+  # 抽样未覆盖到的格式
+  df = pd.DataFrame({'geometry': [point_wkb] * 5 + [polygon_wkt]})
+  res = auto2shapely(df, sample=1)
+  assert res.geometry[5].equals(polygon_shapely)
+
+
+def test_auto2x_mixed():
+  df = pd.DataFrame({'geometry': ['POINT (1 2)', Point(3, 4).wkb_hex, None]})
+  res = auto2x(df, 'wkt')
+  assert res['geometry'].tolist() == ['POINT (1 2)', 'POINT (3 4)', None]
+  df = pd.DataFrame({'geometry': ['POINT (1 2)', None]})
+  assert auto2x(df, 'wkt') is df
+
+
+def test_geometry_cache():
+  df = pd.DataFrame({'geometry': [polygon_wkb, point_wkb]})
+  assert get_geometry_cache() is None
+  with geometry_cache(maxsize=2) as cache:
+    res1 = auto2shapely(df)
+    res2 = auto2shapely(df.copy())
+    assert cache.stats()['hits'] == {'geometry': 1}
+    assert res1.geometry.geom_equals(res2.geometry).all()
+    ensure_geometry(df, ensure_point=True)
+    res3 = ensure_lnglat(df)
+    assert cache.stats()['hits'] == {'geometry': 2, 'within': 1}
+    assert res3['lng'][1] == point_lng
+    # 内容变化时不命中
+    auto2shapely(df.iloc[:1])
+    assert cache.stats()['misses']['geometry'] == 2
+    # 不可哈希的dict格式geojson不缓存，结果与关闭缓存时一致
+    df_dict = pd.DataFrame({'geometry': [
+      {'type': 'Point', 'coordinates': [point_lng, 31.0]},
+    ]})
+    stats = cache.stats()
+    res4 = auto2shapely(df_dict)
+    assert res4.geometry[0].x == point_lng
+    assert cache.stats() == stats
+  assert get_geometry_cache() is None
+
+
+def test_geometry_cache_lru():
+  cache = GeometryCache(maxsize=2)
+  for i in range(3):
+    cache.put(('k', i), 'geometry', [None] * (i + 1))
+  assert ('k', 0) not in cache and len(cache) == 2
+  cache.get(('k', 1))
+  cache.put(('k', 3), 'geometry', [None])
+  assert ('k', 1) in cache and ('k', 2) not in cache
+  cache = GeometryCache(maxsize=10, max_rows=3)
+  for i in range(3):
+    cache.put(('k', i), 'geometry', [None] * 2)
+  assert len(cache) == 1 and cache.rows == 2
+
+
+def test_projection_cache():
+  df = pd.DataFrame({'geometry': [polygon_wkb, None]})
+  expected = get_area(df)
+  with geometry_cache() as cache:
+    res1 = get_area(df)
+    res2 = get_area(df, c_dst='area2')
+    res3 = get_projection_xy(df, epsg=32651)
+    stats = cache.stats()
+  assert_frame_equal(res1, expected)
+  assert res2['area2'].equals(expected['area'])
+  assert stats['misses']['epsg:32651'] == 1
+  assert stats['hits']['epsg:32651'] == 2
+  assert stats['hits']['auto_epsg'] == 1
+  assert_frame_equal(res3, get_projection_xy(df, epsg=32651))
+
+  # 经纬度直接投影的方法共用 project_lnglat 的缓存
+  df = pd.DataFrame({'lng': [121.1, 121.2, None], 'lat': [31.1, 31.2, 31.3]})
+  expected = projection_lnglat(df, epsg=32651)
+  with geometry_cache() as cache:
+    res1 = projection_lnglat(df, epsg=32651)
+    res2 = get_projection_xy(df, epsg=32651)
+    nearest_kdtree(df.dropna(), df, epsg=32651)
+    stats = cache.stats()
+  assert_frame_equal(res1, expected)
+  assert np.allclose(res2[['x', 'y']].dropna(), expected[['lng', 'lat']][:2])
+  assert stats['misses'] == {'lnglat:EPSG:4326>EPSG:32651': 2}
+  assert stats['hits'] == {'lnglat:EPSG:4326>EPSG:32651': 2}
+
+
+def test_project_lnglat():
+  assert get_transformer(4326, 32651) is get_transformer(4326, 32651)
+  assert get_transformer(4326, crs_sh2000()) is get_transformer(
+      4326, crs_sh2000())
+  lng = [121.4, 121.5, np.nan, 121.6]
+  lat = [31.2, 31.3, 31.4, None]
+  x, y = project_lnglat(lng, lat, crs_to=32651)
+  assert np.isnan(x[2:]).all() and np.isnan(y[2:]).all()
+  for i in range(2):
+    assert np.allclose(
+        (x[i], y[i]), _projection_lnglat((lng[i], lat[i]), 4326, 32651))
+  assert np.allclose(_projection_lnglat((121.5, 31.2), 4326, 32651),
+                     (357093.0258, 3452736.4850))
+  assert np.isnan(_projection_lnglat((None, 31.2), 4326, 32651)).all()
+  # 按目标坐标系的轴顺序输出，EPSG:4490为（纬度，经度）
+  assert np.allclose(_projection_lnglat((121.5, 31.2), 4326, 4490),
+                     (31.2, 121.5))
+  assert np.allclose(project_lnglat(lng[:2], lat[:2])[0], x[:2])
+  x, y = project_lnglat(lng[:2], lat[:2], crs_to=crs_sh2000())
+  expected = ensure_geometry(pd.DataFrame({
+    'lng': lng[:2], 'lat': lat[:2]
+  })).to_crs(crs_sh2000()).geometry
+  assert np.allclose(x, expected.x) and np.allclose(y, expected.y)
+  d = distance((121.4, 31.2), (121.5, 31.3))
+  assert abs(d - np.hypot(x[1] - x[0], y[1] - y[0])) < 50
+  assert np.isnan(distance((121.4, 31.2), (np.nan, 31.3)))
+
+
+def test_projection_lnglat():
+  df = pd.DataFrame({
+    'lng': [121.4, 121.5, None],
+    'lat': [31.2, 31.3, 31.4],
+  })
+  res = projection_lnglat(df, epsg=32651)
+  expected = projection(
+      ensure_geometry(df.iloc[:2]), epsg=32651).geometry
+  assert np.allclose(res['lng'][:2], expected.x)
+  assert np.allclose(res['lat'][:2], expected.y)
+  assert pd.isna(res['lng'][2])
+  res = get_projection_xy(ensure_geometry(df.iloc[:2]), epsg=32651)
+  assert np.allclose(res['x'], expected.x)
+  assert np.allclose(res['y'], expected.y)
+
+
+def test_distance_pairs():
+  df = pd.DataFrame({
+    'lng': [121.4, 121.5, None],
+    'lat': [31.2, 31.3, 31.2],
+    'lng_2': [121.5, 121.5, 121.5],
+    'lat_2': [31.3, 31.3, 31.3],
+  })
+  res = distance_pairs(df)
+  assert abs(res['distance'][0] - 14617) < 50
+  assert res['distance'][1] == 0 and np.isnan(res['distance'][2])
+  res = distance_pairs(df, method='geodesic')
+  assert abs(res['distance'][0] - 14617.233) < 0.01
+  res = distance_pairs(df, method='projection', epsg=32651)
+  assert res['distance'][0] == distance(
+      (121.4, 31.2), (121.5, 31.3), epsg_to=32651)
+  assert np.isnan(lnglat_distance(121.4, np.nan, 121.5, 31.3))
+
+
+def test_od_distance():
+  rng = np.random.default_rng(0)
+  df_o = pd.DataFrame({
+    'lng': rng.uniform(121, 122, 30), 'lat': rng.uniform(31, 32, 30)
+  }, index=range(100, 130))
+  df_d = pd.DataFrame({
+    'lng': rng.uniform(121, 122, 20), 'lat': rng.uniform(31, 32, 20)
+  })
+  df_d.loc[3, 'lng'] = None
+  full = lnglat_distance(
+      df_o['lng'].values[:, None], df_o['lat'].values[:, None],
+      df_d['lng'].values[None, :], df_d['lat'].values[None, :],
+  )
+  res = od_distance(df_o, df_d, max_cells=50)
+  assert len(res) == 30 * 19
+  res = od_distance(df_o, df_d, top_k=3, max_cells=50)
+  assert len(res) == 90
+  for i, (o, group) in enumerate(res.groupby('origin', sort=True)):
+    assert o == df_o.index[i]
+    expected = np.sort(full[i][~np.isnan(full[i])])[:3]
+    assert np.allclose(group['distance'], expected)
+  res = od_distance(df_o, df_d, max_distance=20000)
+  assert (res['distance'] <= 20000).all()
+  assert len(res) == (full <= 20000).sum()
+  res = od_distance(df_o, df_d, method='projection', top_k=1)
+  assert len(res) == 30
+
+  # 厘米级的近距离也能按距离正确排序
+  df_o = pd.DataFrame({'lng': [121.5], 'lat': [31.2]})
+  lat = 31.2 + np.array([10, 3, 5]) * 1e-7
+  df_d = pd.DataFrame({'lng': 121.5, 'lat': lat})
+  res = od_distance(df_o, df_d, top_k=1)
+  assert res['destination'].tolist() == [1]
+  res = od_distance(df_o, df_d, top_k=2, max_distance=0.1)
+  assert res['destination'].tolist() == [1, 2]
+
+
+def test_auto_partition():
+  lng = [87.6, 121.4, 119.99, -70.6, np.nan]
+  lat = [43.8, 31.2, 31.0, -33.4, 31.0]
+  expected = [
+    epsg_from_lnglat(i, j) if not np.isnan(i) else 0 for i, j in zip(lng, lat)
+  ]
+  assert utm_epsg_array(lng, lat).tolist() == expected
+  # 新疆和上海的面积应分别在各自的UTM区域投影后计算
+  polygons = [
+    Polygon([(87.6, 43.8), (87.61, 43.8), (87.61, 43.81), (87.6, 43.81)]),
+    Polygon([(121.4, 31.2), (121.41, 31.2), (121.41, 31.21), (121.4, 31.21)]),
+    None,
+  ]
+  df = pd.DataFrame({
+    'geometry': dumps_array(np.array(polygons, dtype=object), 'wkb')
+  }, index=[3, 1, 2])
+  res = get_area(df, epsg='auto-partition')
+  assert res.index.tolist() == [3, 1, 2]
+  assert abs(res['area'][3] - 894072) < 1000
+  assert abs(res['area'][1] - 1056612) < 1000
+  assert np.isnan(res['area'][2])
+  # 位于区域边界两侧的点位
+  df = pd.DataFrame({'lng': [119.99, 87.6], 'lat': [31.0, 43.8]})
+  df_poi = pd.DataFrame({'lng': [120.01, 87.62], 'lat': [31.0, 43.8]})
+  expected = lnglat_distance(df['lng'], df['lat'], df_poi['lng'], df_poi['lat'])
+  res = nearest_kdtree(df, df_poi, epsg='auto-partition')
+  assert np.allclose(res['min_distance'], expected, rtol=0.005)
+  assert res['count'].tolist() == [1, 1]
+  res = nearest_neighbor(df, df_poi, epsg='auto-partition')
+  assert np.allclose(res['min_distance'], expected, rtol=0.005)
+
+
+def _tagging_data(n=200):
+  rng = np.random.default_rng(0)
+  df = pd.DataFrame({
+    'name': [f'p{i}' for i in range(n)],
+    'lng': rng.uniform(121, 122, n),
+    'lat': rng.uniform(31, 32, n),
+    'value': rng.integers(0, 100, n),
+  }, index=rng.permutation(n) + 10)
+  df.loc[df.index[:3], ['lng', 'lat']] = None
+  # 存在相互重叠以及未覆盖的区域
+  boxes = [
+    (121, 31, 121.5, 31.5), (121.4, 31.4, 121.9, 31.9),
+    (121.5, 31, 122, 31.3), (121.2, 31.6, 121.3, 31.7),
+  ]
+  polygon_df = pd.DataFrame({
+    'region': ['a', 'b', 'c', 'd'],
+    'level': [1, 2, 2, 1],
+    'geometry': dumps_array(
+        np.array([Polygon.from_bounds(*b) for b in boxes]), 'wkb'),
+  })
+  return df, polygon_df
+
+
+def test_polygon_tagger(tmp_path):
+  df, polygon_df = _tagging_data()
+  tagger = PolygonTagger(polygon_df, c_tags=['region', 'level'])
+  assert len(tagger) == 4 and tagger.c_tags == ['region', 'level']
+  filepath = tmp_path / 'region.tagger'
+  tagger.save(filepath)
+  loaded = PolygonTagger.load(filepath)
+  assert loaded.crs == tagger.crs
+  for c_tags in ('region', ['region', 'level'], None):
+    expected = mark_tags_v2(df, polygon_df, c_tags)
+    assert_frame_equal(mark_tags_v2(df, tagger, c_tags), expected)
+    assert_frame_equal(mark_tags_v2(df, loaded, c_tags), expected)
+  expected = mark_tags_v2(df, polygon_df, 'region', predicate='within')
+  assert_frame_equal(
+      mark_tags_v2(df, tagger, 'region', predicate='within'), expected)
+  assert_frame_equal(
+      spatial_agg(df, tagger, 'region', {'value': 'sum'}),
+      spatial_agg(df, polygon_df, 'region', {'value': 'sum'}),
+  )
+
+
+def test_mark_tags_chunked(tmp_path):
+  df, polygon_df = _tagging_data()
+  expected = mark_tags_v2(df, polygon_df, 'region')
+  assert_frame_equal(
+      mark_tags_v2(df, polygon_df, 'region', chunk_size=7), expected)
+  assert_frame_equal(
+      mark_tags_v2(df, polygon_df, 'region', n_jobs=3), expected)
+  tagger = PolygonTagger(polygon_df, 'region')
+  assert_frame_equal(
+      mark_tags_v2(df, tagger, chunk_size=30, n_jobs=4), expected)
+
+  filepath = str(tmp_path / 'points.csv')
+  df.to_csv(filepath, index=False)
+  mark_tags_file(filepath, polygon_df, str(tmp_path / 'res'), 'region',
+                 chunk_size=60, n_jobs=2, to_ext='.csv')
+  res = pd.concat([
+    pd.read_csv(tmp_path / 'res' / f'part_00000{i}.csv') for i in range(4)
+  ], ignore_index=True)
+  assert_frame_equal(res, expected.reset_index(drop=True))
+
+
+def test_mark_tags_order():
+  rng = np.random.default_rng(0)
+  x, y = rng.uniform(0, 0.8, 40), rng.uniform(0, 0.8, 40)
+  polygon_df = pd.DataFrame({
+    'region': [f'r{i}' for i in range(40)],
+    'geometry': dumps_array(
+        shapely.box(121 + x, 31 + y, 121.3 + x, 31.3 + y), 'wkb'),
+  })
+  df = pd.DataFrame({'lng': 121 + rng.uniform(0, 1, 12),
+                     'lat': 31 + rng.uniform(0, 1, 12)})
+  # 改用 PolygonTagger 之前 mark_tags_v2（sjoin）的结果，
+  # 匹配到多个面时按STRtree的查询顺序排列
+  baseline = [
+    '-', 'r17 r31', 'r31', 'r9 r12 r5 r27 r38 r33 r37', 'r19 r15',
+    'r12 r5 r33 r37', 'r17 r10 r12 r33', 'r10 r9 r12 r5 r27 r38 r37',
+    'r11 r3 r20 r32 r2', 'r8 r6 r22 r29', 'r10 r9 r12 r5 r27 r38 r37',
+    'r9 r12 r5 r27 r38 r37',
+  ]
+
+  def tags(res):
+    return res['region'].fillna('-').groupby(level=0).agg(' '.join).tolist()
+
+  tagger = PolygonTagger(polygon_df, 'region')
+  grid = GridIndex(polygon_df, 'region', max_cells=10_000)
+  for kwargs in [{}, {'chunk_size': 5}, {'n_jobs': 2}]:
+    assert tags(mark_tags_v2(df, polygon_df, 'region', **kwargs)) == baseline
+  for index in (tagger, grid):
+    assert tags(mark_tags_v2(df, index)) == baseline
+    # within 在 sjoin 中以面数据查询点数据，按面数据的行号排列
+    res = tags(mark_tags_v2(df, index, predicate='within'))
+    assert res == [' '.join(sorted(i.split(), key=lambda r: int(r[1:])))
+                   if i != '-' else i for i in baseline]
+
+
+def test_mark_tags_first_match():
+  df, polygon_df = _tagging_data()
+  geoms, _ = loads_array(polygon_df['geometry'], 'wkb')
+  polygon_df['area'] = shapely.area(geoms)
+  all_matches = mark_tags_v2(df, polygon_df, ['region', 'level', 'area'])
+  assert all_matches.index.duplicated().any()
+  for c_priority in ('level', 'area', None):
+    expected = all_matches.sort_values(
+        c_priority or 'area', kind='stable').groupby(level=0).head(1)
+    expected = expected.reindex(df.index)[[*df.columns, 'region']]
+    res = mark_tags_v2(
+        df, polygon_df, 'region', first_match=True, c_priority=c_priority)
+    assert_frame_equal(res, expected)
+    res = mark_tags_v2(
+        df, polygon_df, 'region', first_match=True, c_priority=c_priority,
+        chunk_size=50)
+    assert_frame_equal(res, expected)
+
+
+def test_grid_index(tmp_path):
+  df, polygon_df = _tagging_data(2000)
+  rng = np.random.default_rng(1)
+  circles = shapely.buffer(
+      shapely.points(rng.uniform(121, 122, 30), rng.uniform(31, 32, 30)),
+      rng.uniform(0.02, 0.1, 30))
+  polygon_df = pd.concat([polygon_df, pd.DataFrame({
+    'region': [f'circle{i}' for i in range(30)],
+    'level': rng.integers(0, 3, 30),
+    'geometry': dumps_array(circles, 'wkb'),
+  })], ignore_index=True)
+  # 加入恰好位于面的顶点上的点位
+  vertices = shapely.get_coordinates(circles)[::7]
+  df = pd.concat([df, pd.DataFrame({
+    'lng': vertices[:, 0], 'lat': vertices[:, 1], 'value': 1,
+  }, index=range(5000, 5000 + len(vertices)))])
+  tagger = PolygonTagger(polygon_df, ['region', 'level'])
+  grid = GridIndex(polygon_df, ['region', 'level'], max_cells=20000)
+  assert 0 < grid.boundary_ratio < 1
+  filepath = tmp_path / 'grid.npz'
+  grid.save(filepath)
+  loaded = GridIndex.load(filepath)
+  assert (loaded.grid == grid.grid).all()
+  assert_frame_equal(loaded.tags, grid.tags)
+  for predicate in ('intersects', 'within', 'touches'):
+    expected = mark_tags_v2(df, tagger, predicate=predicate)
+    assert_frame_equal(mark_tags_v2(df, grid, predicate=predicate), expected)
+    assert_frame_equal(
+        mark_tags_v2(df, loaded, predicate=predicate), expected)
+  expected = mark_tags_v2(df, tagger, first_match=True, c_priority='level')
+  assert_frame_equal(
+      mark_tags_v2(df, grid, first_match=True, c_priority='level'), expected)
+  points = shapely.points(df['lng'], df['lat'])
+  assert (grid.lookup(df['lng'], df['lat']) == tagger.first(points)).all()
+
+
+def test_spatial_agg_streaming(tmp_path):
+  df, polygon_df = _tagging_data(2000)
+  df['half'] = df['value'] * 0.5
+  df.loc[df.index[5:40], 'half'] = None
+  agg = {'value': ['sum', 'mean', 'min', 'max'], 'half': ['count', 'min']}
+  for by, tagger in [
+    ('region', polygon_df),
+    ('region', PolygonTagger(polygon_df)),
+    (['level', 'region'], GridIndex(polygon_df)),
+  ]:
+    expected = spatial_agg(df, polygon_df, by, agg)
+    res = spatial_agg(df, tagger, by, agg, chunk_size=300, warning=False)
+    assert_frame_equal(res, expected, check_dtype=by == 'region')
+  expected = spatial_agg(df, polygon_df, 'region', {'value': 'sum'})
+  filepath = tmp_path / 'points.csv'
+  df.to_csv(filepath, index=False)
+  res = spatial_agg(str(filepath), polygon_df, 'region', {'value': 'sum'},
+                    chunk_size=300, warning=False)
+  assert_frame_equal(res, expected)
+  # 近似去重计数
+  res = spatial_agg(df, polygon_df, 'region', {'name': 'nunique_approx'},
+                    chunk_size=300, warning=False)
+  expected = spatial_agg(df, polygon_df, 'region', {'name': 'nunique'})
+  assert np.allclose(res['name'], expected['name'], rtol=0.05)
+
+
+def test_nearest_kdtree_agg():
+  rng = np.random.default_rng(0)
+  df = pd.DataFrame({'lng': rng.uniform(121, 121.05, 100),
+                     'lat': rng.uniform(31, 31.05, 100)})
+  df_poi = pd.DataFrame({
+    'lng': rng.uniform(121, 121.05, 300),
+    'lat': rng.uniform(31, 31.05, 300),
+    'value': rng.integers(0, 10, 300),
+  }, index=rng.permutation(300) + 1000)
+  agg = {'value': ['sum', 'mean', 'max', 'std', 'median']}
+  for kwargs in [{'r': 300}, {'limit': 3}]:
+    res = nearest_kdtree(df, df_poi, agg=agg, keep_origin=True, epsg=32651,
+                         **kwargs)
+    assert (res['count'] == res['ind_list'].str.len()).all()
+    assert np.allclose(res['min_distance'],
+                       res['dist_list'].apply(lambda x: min(x, default=None)),
+                       equal_nan=True)
+    for func in agg['value']:
+      # 索引列表为 df_poi 的索引
+      expected = res['ind_list'].apply(
+          lambda x: getattr(df_poi.loc[x, 'value'], func)())
+      assert np.allclose(res[f'value_{func}'], expected, equal_nan=True)
+
+
+def test_get_neighbors():
+  # 3x3 的网格，外加一个孤立的面
+  step = 0.01
+  cells = [shapely.box(121 + i * step, 31 + j * step,
+                       121 + (i + 1) * step, 31 + (j + 1) * step)
+           for j in range(3) for i in range(3)]
+  cells.append(shapely.box(122, 32, 122.01, 32.01))
+  df = pd.DataFrame({'name': [f'c{i}' for i in range(10)],
+                     'geometry': cells})
+  expected = {}
+  for i, a in enumerate(cells):
+    neighbors = [f'c{j}' for j, b in enumerate(cells) if a.touches(b)]
+    if neighbors:
+      expected[f'c{i}'] = neighbors
+  assert get_neighbors(df, 'name') == expected
+  res = get_neighbors(df, 'name', res_type='df')
+  assert len(res) == 40 and res['key'].iloc[0] == 'c0'
+
+  rook = get_neighbors(df, 'name', contiguity='rook')
+  assert rook['c4'] == ['c1', 'c3', 'c5', 'c7']
+  assert sum(len(v) for v in rook.values()) == 24
+
+  edges = neighbor_edges(df, 'name', contiguity='rook', border_length=True,
+                         epsg=32651)
+  assert len(edges) == 24 and edges['border_length'].between(900, 1200).all()
+  matrix = neighbor_matrix(df, border_length=True, epsg=32651)
+  assert matrix.shape == (10, 10) and matrix.nnz == 40
+  assert np.allclose(matrix.toarray(), matrix.toarray().T)
+  assert matrix[0, 4] == 0 and matrix[0, 1] > 0
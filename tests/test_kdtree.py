@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ricco.geometry.df import nearest_kdtree
+from ricco.geometry.util import lnglat_distance
+from ricco.util.kdtree import LEAF_SIZES
+from ricco.util.kdtree import PointIndex
+from ricco.util.kdtree import concat_csr
+from ricco.util.kdtree import csr_to_lists
+from ricco.util.kdtree import kdtree_nearest
+from ricco.util.kdtree import kdtree_nearest_csr
+from ricco.util.kdtree import reduce_csr
+from ricco.util.kdtree import reorder_csr
+
+
+def _points(n, seed):
+  return np.random.default_rng(seed).uniform(0, 1000, (n, 2))
+
+
+def test_kdtree_nearest_csr():
+  xy_tree, xy_query = _points(500, 0), _points(100, 1)
+  for kwargs in [{}, {'limit': 5}, {'r': 50}, {'limit': 3, 'r': 50}]:
+    ind, dist, offsets = kdtree_nearest_csr(xy_tree, xy_query, **kwargs)
+    assert len(offsets) == len(xy_query) + 1 and offsets[-1] == len(ind)
+    ind_list, dist_list = kdtree_nearest(xy_tree, xy_query, **kwargs)
+    assert csr_to_lists(ind, offsets) == ind_list
+    for i, (p, d) in enumerate(zip(ind_list, dist_list)):
+      expected = np.hypot(*(xy_tree[p] - xy_query[i]).T)
+      assert np.allclose(d, expected) and (np.diff(d) >= 0).all()
+      if 'r' in kwargs:
+        assert (np.asarray(d) <= kwargs['r']).all()
+  # 分段拼接及重新排序
+  ind, dist, offsets = kdtree_nearest_csr(xy_tree, xy_query, r=50)
+  parts = [kdtree_nearest_csr(xy_tree, xy_query[s], r=50)
+           for s in (slice(0, 30), slice(30, 100))]
+  for a, b in zip(concat_csr(parts), (ind, dist, offsets)):
+    assert np.array_equal(a, b)
+  # 分块并行查询的结果与单线程一致
+  with ThreadPoolExecutor(max_workers=2) as executor:
+    for kwargs in [{'n_jobs': 3}, {'executor': executor}]:
+      res = kdtree_nearest_csr(xy_tree, xy_query, r=50, **kwargs)
+      assert all(
+          np.array_equal(a, b) for a, b in zip(res, (ind, dist, offsets))
+      )
+  res = kdtree_nearest_csr(xy_tree, xy_query, r=50, leaf_size='auto')
+  assert all(np.allclose(a, b) for a, b in zip(res, (ind, dist, offsets)))
+  order = np.random.default_rng(2).permutation(len(xy_query))
+  res = reorder_csr(ind, dist, offsets, order)
+  lists = csr_to_lists(ind, offsets)
+  assert csr_to_lists(res[0], res[2]) == [lists[i] for i in order]
+
+
+def test_reduce_csr():
+  offsets = np.array([0, 3, 3, 4, 7, 9])
+  values = np.array([1., np.nan, 3., np.nan, 2., 5., 2., 4., 4.])
+  groups = np.repeat(np.arange(5), np.diff(offsets))
+  series = pd.Series(values)
+  for func in ('sum', 'mean', 'max', 'min', 'count', 'std', 'median'):
+    expected = [getattr(series[groups == i], func)() for i in range(5)]
+    assert np.allclose(reduce_csr(values, offsets, func), expected,
+                       equal_nan=True), func
+  ints = values.copy()
+  ints[np.isnan(ints)] = 0
+  ints = ints.astype(int)
+  assert reduce_csr(ints, offsets, 'sum').tolist() == [4, 0, 0, 9, 8]
+  assert np.allclose(reduce_csr(ints, offsets, 'max'), [3, np.nan, 0, 5, 4],
+                     equal_nan=True)
+  names = np.array(list('abacdeeff'), dtype=object)
+  assert reduce_csr(names, offsets, 'nunique').tolist() == [2, 0, 1, 2, 1]
+
+
+def test_point_index(tmp_path):
+  rng = np.random.default_rng(0)
+  df_poi = pd.DataFrame({
+    'lng': rng.uniform(121, 121.05, 300),
+    'lat': rng.uniform(31, 31.05, 300),
+    'value': rng.integers(0, 10, 300),
+  }, index=rng.permutation(300) + 1000)
+  df_poi.iloc[:2, 0] = None
+  df = pd.DataFrame({'lng': rng.uniform(121, 121.05, 50),
+                     'lat': rng.uniform(31, 31.05, 50)})
+  index = PointIndex.from_df(df_poi, epsg=32651)
+  assert len(index) == 298 and index.leaf_size in LEAF_SIZES
+  ind, dist, offsets = index.query_radius(df, r=300)
+  assert np.array_equal(index.count_radius(df, r=300), np.diff(offsets))
+  assert np.array_equal(index.count_radius(df, r=300, n_jobs=2),
+                        np.diff(offsets))
+  xy = index.project(df)
+  for a, b in zip(index.query_knn(xy, k=3), kdtree_nearest_csr(
+      index.tree.get_arrays()[0], xy, limit=3)):
+    assert np.array_equal(a, b)
+
+  for filepath, mmap in [(tmp_path / 'poi.index', False),
+                         (tmp_path / 'poi_index', True)]:
+    index.save(filepath, mmap=mmap)
+    loaded = PointIndex.load(filepath)
+    assert loaded.crs == index.crs and loaded.index.equals(index.index)
+    for a, b in zip(loaded.query_radius(df, r=300), (ind, dist, offsets)):
+      assert np.array_equal(a, b)
+
+  agg = {'value': ['sum', 'max']}
+  expected = nearest_kdtree(df, df_poi, r=300, agg=agg, keep_origin=True,
+                            epsg=32651)
+  res = nearest_kdtree(df, loaded, r=300, agg=agg, keep_origin=True)
+  pd.testing.assert_frame_equal(res, expected)
+  res = nearest_kdtree(df, loaded, r=300, agg=agg, keep_origin=True, n_jobs=2)
+  pd.testing.assert_frame_equal(res, expected)
+
+
+def test_nearest_kdtree_count_distance():
+  rng = np.random.default_rng(0)
+  df_poi = pd.DataFrame({'lng': rng.uniform(121, 121.05, 500),
+                         'lat': rng.uniform(31, 31.05, 500)})
+  df = pd.DataFrame({'lng': rng.uniform(121, 121.1, 80),
+                     'lat': rng.uniform(31, 31.1, 80)})
+  index = PointIndex.from_df(df_poi, epsg=32651)
+  for kwargs in [{}, {'r': 300}, {'limit': 3}, {'limit': 3, 'r': 300},
+                 {'r': 300, 'c_min_distance': None},
+                 {'r': 300, 'c_count': None}]:
+    # keep_origin 时获取完整的近邻列表，结果作为对照
+    expected = nearest_kdtree(df, index, keep_origin=True, **kwargs)
+    expected = expected.drop(columns=['ind_list', 'dist_list'])
+    res = nearest_kdtree(df, index, **kwargs)
+    pd.testing.assert_frame_equal(res, expected)
+  assert res['min_distance'].isna().any()
+
+
+def test_nearest_kdtree_multi_radius():
+  rng = np.random.default_rng(0)
+  df_poi = pd.DataFrame({'lng': rng.uniform(121, 121.05, 500),
+                         'lat': rng.uniform(31, 31.05, 500),
+                         'value': rng.integers(0, 10, 500)})
+  df = pd.DataFrame({'lng': rng.uniform(121, 121.05, 50),
+                     'lat': rng.uniform(31, 31.05, 50)})
+  index = PointIndex.from_df(df_poi, epsg=32651)
+  agg = {'value': ['sum', 'max']}
+  for kwargs in [{}, {'agg': agg}, {'agg': agg, 'limit': 20}, {'limit': 20}]:
+    single = {
+      r: nearest_kdtree(df, index, r=r, **kwargs) for r in (200, 500, 1000)
+    }
+    for ring in (False, True):
+      res = nearest_kdtree(df, index, r=[1000, 200, 500], ring=ring, **kwargs)
+      assert np.allclose(res['min_distance'], single[1000]['min_distance'],
+                         equal_nan=True)
+      previous = 0
+      for r in (200, 500, 1000):
+        expected = single[r]['count'] - (previous if ring else 0)
+        assert (res[f'count_{r}'] == expected).all()
+        previous = single[r]['count']
+        if 'agg' in kwargs and not ring:
+          for c in ('value_sum', 'value_max'):
+            assert np.allclose(res[f'{c}_{r}'], single[r][c], equal_nan=True)
+    if 'agg' in kwargs:
+      # 环形统计的和等于相邻两个半径的差
+      assert np.allclose(res['value_sum_500'], single[500]['value_sum'] -
+                         single[200]['value_sum'])
+
+
+def test_nearest_kdtree_haversine(tmp_path):
+  rng = np.random.default_rng(0)
+  df_poi = pd.DataFrame({'lng': rng.uniform(121, 121.05, 500),
+                         'lat': rng.uniform(31, 31.05, 500),
+                         'value': rng.integers(0, 10, 500)})
+  df = pd.DataFrame({'lng': rng.uniform(121, 121.05, 50),
+                     'lat': rng.uniform(31, 31.05, 50)})
+  res = nearest_kdtree(df, df_poi, r=500, metric='haversine', keep_origin=True,
+                       agg={'value': ['sum']})
+  for i, row in res.iterrows():
+    poi = df_poi.loc[row['ind_list']]
+    dist = lnglat_distance(row['lng'], row['lat'], poi['lng'], poi['lat'])
+    assert np.allclose(row['dist_list'], dist)
+    assert row['value_sum'] == poi['value'].sum()
+  # 小范围内与投影后的平面距离接近
+  projected = nearest_kdtree(df, df_poi, r=500, epsg=32651)
+  assert np.allclose(res['min_distance'], projected['min_distance'], rtol=0.01)
+  assert np.abs(res['count'] - projected['count']).max() <= 3
+
+  index = PointIndex.from_df(df_poi, metric='haversine')
+  fast = nearest_kdtree(df, index, r=500)
+  pd.testing.assert_frame_equal(fast, res[fast.columns])
+  index.save(tmp_path / 'poi_index', mmap=True)
+  loaded = PointIndex.load(tmp_path / 'poi_index')
+  assert loaded.metric == 'haversine'
+  expected = index.query_radius(df, r=500)
+  for a, b in zip(loaded.query_radius(df, r=500), expected):
+    assert np.array_equal(a, b)
@@ -1,8 +1,11 @@
 import geopandas as gpd
+import numpy as np
+import shapely
 from geopandas.testing import assert_geodataframe_equal
 from shapely.geometry import Polygon
 
 from ricco.geometry.topology import fix_topology
+from ricco.geometry.topology import is_topology_valid
 
 
 def assert_geopandas(res: gpd.GeoDataFrame, test: gpd.GeoDataFrame):
@@ -74,3 +77,50 @@ def test_fix_overlap():
                                          polygon5,
                                          polygon4.difference(polygon5)]})
   assert_geopandas(res4, test4)
+
+
+def test_is_topology_valid():
+  polygon1 = Polygon([(0, 0), (0, 4), (4, 4), (4, 0)])
+  polygon2 = Polygon([(3, 0), (3, 4), (7, 4), (7, 0)])
+  polygon3 = Polygon([(4, 0), (4, 4), (8, 4), (8, 0)])
+  polygon4 = Polygon([(1, 1), (1, 3), (3, 3), (3, 1)])
+  bowtie = Polygon([(10, 0), (12, 2), (12, 0), (10, 2)])
+  # 仅边界接触的面是规范的
+  assert is_topology_valid(gpd.GeoDataFrame(geometry=[polygon1, polygon3]))
+  df = gpd.GeoDataFrame({'geometry': [polygon1, polygon2, polygon3, polygon4]},
+                        index=['a', 'b', 'c', 'd'])
+  assert not is_topology_valid(df)
+  res = is_topology_valid(df, report=True)
+  assert res[['left', 'right']].values.tolist() == [
+    ['a', 'b'], ['a', 'd'], ['b', 'c']]
+  assert res['overlap_area'].tolist() == [4, 4, 12]
+
+  df = gpd.GeoDataFrame(geometry=[polygon1, bowtie])
+  assert not is_topology_valid(df)
+  res = is_topology_valid(df, report=True)
+  assert res[['left', 'right']].values.tolist() == [[1, 1]]
+  assert res['overlap_area'].isna().all()
+
+
+def test_fix_topology_components():
+  rng = np.random.default_rng(0)
+  x, y = rng.uniform(0, 20, 60), rng.uniform(0, 20, 60)
+  df = gpd.GeoDataFrame(
+      {'name': range(60)},
+      geometry=shapely.box(x, y, x + rng.uniform(0.5, 3, 60),
+                           y + rng.uniform(0.5, 3, 60)),
+  )
+  for kwargs in [{}, {'fill_intersects': True, 'keep_contains': True}]:
+    res = fix_topology(df.copy(), **kwargs)
+    report = is_topology_valid(res, report=True)
+    assert (report['overlap_area'] < 1e-5).all()
+    if kwargs:
+      # 填满相交区域时总面积不变
+      union = shapely.union_all(df.geometry.values)
+      area = shapely.area(res.geometry.values).sum()
+      assert np.isclose(area, union.area, rtol=1e-5)
+    res.crs = None
+    # 多线程按连通分量修复的结果与单线程一致
+    parallel = fix_topology(df.copy(), n_jobs=2, **kwargs)
+    parallel.crs = None
+    assert_geopandas(parallel, res)